@@ -1,5 +1,5 @@
 import abc
-from typing import Awaitable, Any
+from typing import Awaitable, Any, List
 
 __all__ = ['Scheduler', 'TaskProvider', 'Worker', 'ProviderClosed']
 
@@ -9,11 +9,13 @@ class TaskProvider(metaclass=abc.ABCMeta):
     Provides the task data from any source. There is an in-memory queue and Kafka implementations,
     but we can also implement fetching tasks from external resource or socket, for example
     """
+    # batched provider returns list of tasks from get, they are passed to Worker.process_batch
+    batched = False
 
     @abc.abstractmethod
-    async def get(self) -> dict:
+    async def get(self) -> Any:
         """
-        :return: Next task
+        :return: Next task, or list of tasks for batched provider
         :raises: ProviderClosed when no more tasks available
         """
         raise NotImplementedError()
@@ -30,20 +32,51 @@ class Worker(metaclass=abc.ABCMeta):
     async def process(self, task: Any) -> Any:
         raise NotImplementedError()
 
+    async def process_batch(self, tasks: List[Any]) -> List[Any]:
+        """
+        Processes tasks one by one in given order. Workers that can handle whole batch at once should override it
+
+        :return: results of tasks
+        """
+        return [await self.process(task) for task in tasks]
+
 
 class Scheduler(metaclass=abc.ABCMeta):
     @abc.abstractmethod
-    def schedule(self, async_callback: Awaitable, interval: dict, *args, **kwargs):
+    def schedule(self, async_callback: Awaitable, interval: dict, *args, offset_s: float = None, **kwargs) -> Any:
         """
         Schedule asynchronous function to be called with given interval
 
         :param async_callback: function to call
         :param interval: dictionary with interval settings, e.g. {'seconds': 20, 'minutes': 2}
         :param args: function positional arguments
+        :param offset_s: delay of the first call. If not set, scheduler chooses it
         :param kwargs: function named arguments
+        :return: handle that can be passed to cancel
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def cancel(self, handle: Any):
+        """
+        Stops calling previously scheduled function
+
+        :param handle: value returned by schedule
         """
         raise NotImplementedError()
 
+    async def close(self):
+        """
+        Stops calling all scheduled functions and waits for background tasks of scheduler to finish
+        """
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
 
 class ProviderClosed(Exception):
     """
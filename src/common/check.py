@@ -0,0 +1,142 @@
+"""
+Check result record passed from site poller through Kafka to database
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Union
+
+from dateutil.parser import parse as parse_date
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def ns_to_datetime(ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=ns // 1000)
+
+
+def datetime_to_ns(moment: datetime) -> int:
+    return (moment - EPOCH) // MICROSECOND * 1000
+
+
+def iso_to_ns(value: str) -> int:
+    """
+    Converts ISO timestamp of messages produced before epoch timestamps were used
+    """
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        moment = parse_date(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return datetime_to_ns(moment)
+
+
+class CheckResult:
+    """
+    Result of one site check. Timestamps are nanoseconds since epoch. Fields that don't apply to the check
+    are None and are not written to messages. Supports read access like dict (result['status'], result.get('match'),
+    'match' in result), so code written for dict messages keeps working. Fields which are None are not "in" result
+    """
+    __slots__ = ('url', 'success', 'started_ns', 'ended_ns', 'response_time_s', 'status', 'pattern', 'match',
+                 'bytes_read', 'truncated', 'not_modified', 'dns_s', 'connect_s', 'ttfb_s', 'transfer_s',
+                 'error_type', 'message', 'validators')
+    # validators are cached by poller and are not sent
+    WIRE_FIELDS = __slots__[:-1]
+    FIELDS = frozenset(WIRE_FIELDS)
+
+    def __init__(self, url: str = None, success: bool = True, started_ns: int = None, ended_ns: int = None,
+                 response_time_s: float = None, status: int = None, pattern: str = None, match: bool = None,
+                 bytes_read: int = None, truncated: bool = None, not_modified: bool = None, dns_s: float = None,
+                 connect_s: float = None, ttfb_s: float = None, transfer_s: float = None, error_type: str = None,
+                 message: str = None):
+        self.url = url
+        self.success = success
+        self.started_ns = started_ns
+        self.ended_ns = ended_ns
+        self.response_time_s = response_time_s
+        self.status = status
+        self.pattern = pattern
+        self.match = match
+        self.bytes_read = bytes_read
+        self.truncated = truncated
+        self.not_modified = not_modified
+        self.dns_s = dns_s
+        self.connect_s = connect_s
+        self.ttfb_s = ttfb_s
+        self.transfer_s = transfer_s
+        self.error_type = error_type
+        self.message = message
+        self.validators = None
+
+    @property
+    def started(self) -> Optional[datetime]:
+        return None if self.started_ns is None else ns_to_datetime(self.started_ns)
+
+    @property
+    def ended(self) -> Optional[datetime]:
+        return None if self.ended_ns is None else ns_to_datetime(self.ended_ns)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __contains__(self, key: str) -> bool:
+        return getattr(self, key, None) is not None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CheckResult):
+            return NotImplemented
+        return self.to_wire() == other.to_wire()
+
+    def __repr__(self) -> str:
+        return f'CheckResult({self.to_wire()})'
+
+    def to_wire(self) -> dict:
+        """
+        Message with fields which are set
+        """
+        return {field: value for field in self.WIRE_FIELDS if (value := getattr(self, field)) is not None}
+
+    @classmethod
+    def from_wire(cls, data: dict) -> 'CheckResult':
+        """
+        Creates result from message. Messages of previous versions with ISO timestamps in started and ended
+        are supported too. Unknown fields are ignored
+        """
+        result = cls.__new__(cls)
+        for field in cls.__slots__:
+            setattr(result, field, None)
+        fields = cls.FIELDS
+        for key, value in data.items():
+            if key in fields:
+                setattr(result, key, value)
+        if result.success is None:
+            result.success = True
+        if result.started_ns is None and data.get('started'):
+            result.started_ns = iso_to_ns(data['started'])
+        if result.ended_ns is None and data.get('ended'):
+            result.ended_ns = iso_to_ns(data['ended'])
+        return result
+
+    def success_row(self, site_id: int) -> tuple:
+        """
+        Row of success table, columns are db.database.SUCCESS_COLUMNS
+        """
+        return (site_id, self.started, self.ended, self.response_time_s, self.status, self.pattern, self.match,
+                self.dns_s, self.connect_s, self.ttfb_s, self.transfer_s)
+
+    def errors_row(self, site_id: int) -> tuple:
+        """
+        Row of errors table, columns are db.database.ERRORS_COLUMNS
+        """
+        return site_id, self.started, self.error_type, self.message
+
+
+def as_check(value: Union[CheckResult, dict]) -> CheckResult:
+    return value if isinstance(value, CheckResult) else CheckResult.from_wire(value)
@@ -1,18 +1,36 @@
 import asyncio
+import time
 from typing import List
 
 import loguru
 
 from abstractions import TaskProvider, Worker, ProviderClosed
-from impl import QueueTaskProvider
+from common.log import MessageLog
+from common.metrics import REGISTRY
+from impl import QueueTaskProvider, BoundedQueue
+
+STAGE_SECONDS = REGISTRY.histogram('pipeline_stage_seconds', 'Time worker spends on one task or batch', ('worker',))
+STAGE_TASKS = REGISTRY.counter('pipeline_tasks_total', 'Tasks processed by worker', ('worker',))
 
 
 class Composer:
     """
     Composer creates and starts a pipeline of workers in background
     """
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, processors_concurrency: int = 1, handlers_concurrency: int = 1,
+                 queue_size: int = 0):
+        """
+        :param logger:
+        :param processors_concurrency: number of background tasks running every processor
+        :param handlers_concurrency: number of background tasks running every output handler
+        :param queue_size: max number of results waiting for output handlers. Processors wait when queue is full.
+            0 means unlimited
+        """
         self.logger = logger or loguru.logger
+        self.processors_concurrency = processors_concurrency
+        self.handlers_concurrency = handlers_concurrency
+        self.queue_size = queue_size
+        self.queues: List[BoundedQueue] = []
 
     def run(self, task_provider: TaskProvider, processors: List[Worker], output_handlers: List[Worker] = None) -> \
             List[asyncio.Task]:
@@ -25,14 +43,18 @@ class Composer:
         :return:
         """
         if output_handlers:
-            results_queue = asyncio.Queue()
-            tasks = run_workers(task_provider, processors, results_queue, self.logger)
-            tasks.extend(run_workers(QueueTaskProvider(results_queue), output_handlers, logger=self.logger))
-            self.logger.info('started {} processor(s) and {} publisher(s)', len(processors), len(output_handlers))
-            return tasks
-
-        processor_tasks = run_workers(task_provider, processors, logger=self.logger)
-        self.logger.info('started {} processor(s)', len(processors))
+            results_queue = BoundedQueue(self.queue_size)
+            self.queues.append(results_queue)
+            processor_tasks = run_workers(task_provider, processors, results_queue, self.logger,
+                                          self.processors_concurrency)
+            handler_tasks = run_workers(QueueTaskProvider(results_queue), output_handlers, logger=self.logger,
+                                        concurrency=self.handlers_concurrency)
+            self.logger.info('started {} processor(s) and {} publisher(s)', len(processor_tasks), len(handler_tasks))
+            return processor_tasks + handler_tasks
+
+        processor_tasks = run_workers(task_provider, processors, logger=self.logger,
+                                      concurrency=self.processors_concurrency)
+        self.logger.info('started {} processor(s)', len(processor_tasks))
         return processor_tasks
 
 
@@ -41,23 +63,38 @@ async def process_tasks(provider: TaskProvider, worker: Worker, output_queue: as
     """
     Background worker caller
     """
+    name = worker.__class__.__name__
+    latency = STAGE_SECONDS.labels(name)
+    processed = STAGE_TASKS.labels(name)
+    log = MessageLog('DEBUG', logger=logger)
     while True:
         try:
             task = await provider.get()
-            logger.debug('sending task to worker: {} - {}', worker.__class__.__name__, task)
-            result = await worker.process(task)
-            logger.debug('worker {} returned {}', worker.__class__.__name__, result)
-            if output_queue and result:
-                await output_queue.put(result)
+            started = time.perf_counter()
+            if provider.batched:
+                log('sending batch of {} tasks to worker: {}', len(task), name)
+                results = await worker.process_batch(task)
+                processed.inc(len(task))
+            else:
+                log('sending task to worker: {} - {}', name, task)
+                results = [await worker.process(task)]
+                processed.inc()
+            latency.observe(time.perf_counter() - started)
+            log('worker {} returned {}', name, results)
+            if output_queue:
+                for result in results or ():
+                    if result:
+                        await output_queue.put(result)
         except ProviderClosed:
             return
         finally:
             provider.task_done()
 
 
-def run_workers(task_provider: TaskProvider, workers: List[Worker],
-                output_queue: asyncio.Queue = None, logger=loguru.logger) -> List[asyncio.Task]:
+def run_workers(task_provider: TaskProvider, workers: List[Worker], output_queue: asyncio.Queue = None,
+                logger=loguru.logger, concurrency: int = 1) -> List[asyncio.Task]:
     """
-    Schedules tasks in the currently running event loop
+    Schedules tasks in the currently running event loop. Every worker is run by concurrency tasks sharing one provider
     """
-    return [asyncio.create_task(process_tasks(task_provider, worker, output_queue, logger)) for worker in workers]
+    return [asyncio.create_task(process_tasks(task_provider, worker, output_queue, logger))
+            for worker in workers for _ in range(concurrency)]
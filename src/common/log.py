@@ -0,0 +1,100 @@
+"""
+Logging helpers for hot path. Loguru formats message only when it is emitted, but even a call with disabled level
+costs about a microsecond, and emitted message costs tens of microseconds. Per-message logs use MessageLog, which
+is a single attribute check when level is disabled, and can be sampled and rate-limited
+"""
+
+import functools
+import sys
+import time
+
+import loguru
+
+from common.settings import EnvSettings
+
+# defaults for MessageLog instances, set by configure_logging
+SAMPLE_EVERY = 1
+MAX_PER_SECOND = 0
+# level of stderr sink, set by configure_logging. Default sink of loguru has the same LOGURU_LEVEL
+MIN_LEVEL = EnvSettings().log_level
+
+
+def configure_logging(settings=EnvSettings(), logger=loguru.logger):
+    """
+    Replaces default loguru sink with stderr sink of LOGURU_LEVEL, in json with LOG_JSON=1.
+    Sets sampling of per-message logs from LOG_SAMPLE_EVERY and LOG_MAX_PER_SECOND
+    """
+    global SAMPLE_EVERY, MAX_PER_SECOND, MIN_LEVEL
+    SAMPLE_EVERY, MAX_PER_SECOND = settings.log_sample_every, settings.log_max_per_second
+    MIN_LEVEL = settings.log_level
+    logger.remove()
+    logger.add(sys.stderr, level=settings.log_level, serialize=settings.log_json)
+
+
+def level_enabled(level: str, logger=loguru.logger) -> bool:
+    """
+    Whether stderr sink accepts messages of this level. Other sinks are not taken into account
+    """
+    return logger.level(level).no >= logger.level(MIN_LEVEL).no
+
+
+class MessageLog:
+    def __init__(self, level: str = 'INFO', sample_every: int = None, max_per_second: int = None,
+                 logger=loguru.logger):
+        """
+        Log for messages written for every processed task. Call it like logger method:
+        log('saved {}', url). Arguments are formatted only for emitted messages, so pass objects, not strings
+
+        :param level: log level, checked once on creation
+        :param sample_every: log only every Nth message. Defaults to LOG_SAMPLE_EVERY
+        :param max_per_second: log no more than this number of messages per second, 0 is unlimited. Number of
+            suppressed messages is logged at the beginning of next second. Defaults to LOG_MAX_PER_SECOND
+        :param logger:
+        """
+        self.level = level
+        self.enabled = level_enabled(level, logger)
+        self.sample_every = sample_every or SAMPLE_EVERY
+        self.max_per_second = MAX_PER_SECOND if max_per_second is None else max_per_second
+        self.base_logger = logger
+        self.logger = logger.opt(depth=1)  # record location of the caller
+        self.seen = 0
+        self.window_start = 0.0
+        self.window_count = 0
+        self.suppressed = 0
+
+    def __call__(self, message: str, *args, **kwargs):
+        if not self.enabled:
+            return
+        if self.sample_every > 1:
+            self.seen += 1
+            if self.seen % self.sample_every:
+                return
+        if self.max_per_second and not self._allow():
+            return
+        self.logger.log(self.level, message, *args, **kwargs)
+
+    def _allow(self) -> bool:
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            if self.suppressed:
+                self.base_logger.opt(depth=2).log(self.level, '{} similar messages suppressed', self.suppressed)
+            self.window_start, self.window_count, self.suppressed = now, 0, 0
+        if self.window_count >= self.max_per_second:
+            self.suppressed += 1
+            return False
+        self.window_count += 1
+        return True
+
+
+def log_errors(method):
+    """
+    Logs and suppresses exceptions of async worker method, like logger.catch, but without its
+    per-call overhead. Instance must have logger attribute
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        except Exception:
+            self.logger.exception('error in {}', method.__qualname__)
+    return wrapper
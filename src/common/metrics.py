@@ -0,0 +1,229 @@
+"""
+Minimal metrics registry with Prometheus text exposition. Hot path operations are a few attribute updates,
+so metrics can stay enabled under load. Get labeled child once and keep it, instead of calling labels() for every event
+"""
+
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import loguru
+from aiohttp import web
+
+# seconds, from fast in-memory operations to slow HTTP requests
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Value:
+    """
+    Counter or gauge value. Can be computed by function on exposition instead of being updated
+    """
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+
+class HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._default = None if self.label_names else self.labels()
+
+    def new_child(self):
+        return Value()
+
+    def labels(self, *values: str):
+        """
+        Child metric for given label values, created on first call
+        """
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            assert len(values) == len(self.label_names), f'{self.name} has labels {self.label_names}'
+            child = self.children[values] = self.new_child()
+        return child
+
+    def remove(self, *values: str):
+        self.children.pop(tuple(str(v) for v in values), None)
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self.children.items()):
+            yield f'{self.name}{format_labels(self.label_names, values)} {format_value(child.get())}'
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels)
+
+    def new_child(self):
+        return HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.bounds, math.inf), child.counts):
+                cumulative += count
+                labels = format_labels(self.label_names, values, f'le="{format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.label_names, values)
+            yield f'{self.name}_sum{labels} {format_value(child.sum)}'
+            yield f'{self.name}_count{labels} {child.count}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Adds metric. If metric with the same name and type exists, it is returned instead
+        """
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            assert type(existing) is type(metric), f'metric {metric.name} is already registered as {existing.type}'
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def expose(self) -> str:
+        return '\n'.join(metric.expose() for metric in self.metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+async def start_metrics_server(port: int, host: str = '0.0.0.0', registry: Registry = REGISTRY,
+                               handlers: Dict[str, Callable] = None, logger=loguru.logger) -> web.AppRunner:
+    """
+    Serves metrics on http://host:port/metrics in background
+
+    :param handlers: additional GET endpoints, by path
+
+    :return: runner, call its cleanup() to stop server
+    """
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(body=registry.expose().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    for path, handler in (handlers or {}).items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('serving metrics on {}:{}/metrics', host, port)
+    return runner
+
+
+def queue_metrics(queues: Dict[str, object], registry: Registry = REGISTRY) -> List[Metric]:
+    """
+    Exposes depth and number of dropped items of BoundedQueue instances. Values are read on exposition
+    """
+    depth = registry.gauge('queue_depth', 'Number of items waiting in queue', ('queue',))
+    coalesced = registry.counter('queue_coalesced_total', 'Items replaced by newer item with the same key', ('queue',))
+    skipped = registry.counter('queue_skipped_total', 'Items dropped because queue was full', ('queue',))
+    for name, queue in queues.items():
+        depth.labels(name).set_function(queue.qsize)
+        coalesced.labels(name).set_function(lambda q=queue: q.coalesced)
+        skipped.labels(name).set_function(lambda q=queue: q.skipped)
+    return [depth, coalesced, skipped]
@@ -0,0 +1,240 @@
+"""
+Diagnostics of running service: sampling profiler and event loop monitor. Profiler is off until it is started
+by SIGUSR1 or by request to /profile endpoint of metrics server, so it costs nothing in normal operation.
+Loop monitor runs all the time, it wakes up a few times per second
+"""
+
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+import loguru
+from aiohttp import web
+
+from common.metrics import REGISTRY
+from common.settings import EnvSettings
+
+LOOP_LAG = REGISTRY.histogram('event_loop_lag_seconds', 'Delay of event loop wake up after sleep')
+LOOP_BLOCKED = REGISTRY.counter('event_loop_blocked_total', 'Times event loop was blocked longer than SLOW_CALLBACK_S')
+
+
+def short_path(filename: str) -> str:
+    """
+    Path relative to the longest sys.path entry containing it
+    """
+    prefixes = [p for p in sys.path if p and filename.startswith(p)]
+    return os.path.relpath(filename, max(prefixes, key=len)) if prefixes else filename
+
+
+class SamplingProfiler:
+    def __init__(self, interval_s: float = 0.01):
+        """
+        Samples stacks of all threads from background thread and counts identical stacks. Stacks are wall-clock:
+        event loop waiting for events shows up as selector call. Result is in collapsed format, which is read by
+        flamegraph.pl, speedscope and other flame graph tools: "thread;outer (file:line);...;inner (file:line) count"
+
+        :param interval_s: time between samples
+        """
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[Tuple[object, int], str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """
+        Starts sampling, previous samples are discarded
+        """
+        assert not self.running, 'profiler is already running'
+        self.stacks, self.samples = Counter(), 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """
+        :return: number of samples of every stack
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            self.sample(skip=own)
+
+    def label(self, code, line: int) -> str:
+        label = self._labels.get((code, line))
+        if label is None:
+            label = f'{code.co_name} ({short_path(code.co_filename)}:{line})'.replace(';', ':')
+            self._labels[(code, line)] = label
+        return label
+
+    def sample(self, skip: int = None):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+    def dump(self, directory: str) -> str:
+        """
+        Writes collapsed stacks to new file in directory
+
+        :return: file path
+        """
+        path = os.path.join(directory, f'profile-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.collapsed')
+        with open(path, 'w') as fp:
+            fp.write(self.collapsed())
+        return path
+
+
+def profile_handler(profiler: SamplingProfiler, max_seconds: float = 300):
+    """
+    Handler of metrics server endpoint, which profiles for ?seconds=N (10 by default) and returns collapsed stacks
+    """
+    async def handle(request: web.Request) -> web.Response:
+        try:
+            seconds = float(request.query.get('seconds', 10))
+        except ValueError:
+            raise web.HTTPBadRequest(text='seconds must be a number')
+        if not 0 < seconds <= max_seconds:
+            raise web.HTTPBadRequest(text=f'seconds must be in (0, {max_seconds}]')
+        if profiler.running:
+            raise web.HTTPConflict(text='profiler is already running')
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+        return web.Response(text=profiler.collapsed())
+
+    return handle
+
+
+def toggle_profiler(profiler: SamplingProfiler, directory: str, logger=loguru.logger):
+    if not profiler.running:
+        profiler.start()
+        logger.info('profiler started, send the same signal again to stop it')
+        return
+    profiler.stop()
+    try:
+        path = profiler.dump(directory)
+    except OSError as e:
+        logger.error('failed to write profile to {}: {}', directory, e)
+        return
+    logger.info('profile with {} samples written to {}', profiler.samples, path)
+
+
+class LoopMonitor:
+    def __init__(self, interval_s: float = 0.1, slow_callback_s: float = 0.1, logger=loguru.logger):
+        """
+        Measures event loop lag, which grows when callbacks run long or there are too many of them.
+        When loop doesn't wake up for slow_callback_s, watchdog thread logs warning with stack of the loop thread,
+        showing the code that blocks it. With asyncio debug mode (PYTHONASYNCIODEBUG=1) asyncio also logs slow
+        callbacks with the same threshold
+
+        :param interval_s: lag is measured with this period
+        :param slow_callback_s: blocked loop threshold, 0 disables watchdog
+        :param logger:
+        """
+        self.interval_s = interval_s
+        self.slow_callback_s = slow_callback_s
+        self.logger = logger
+        self.beat = 0.0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Starts monitoring of the running loop
+        """
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self._task = asyncio.create_task(self.measure())
+        if self.slow_callback_s > 0:
+            loop.slow_callback_duration = self.slow_callback_s
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog:
+            self._stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval_s)
+            self.beat = time.monotonic()
+            LOOP_LAG.observe(max(self.beat - started - self.interval_s, 0))
+
+    def watch(self):
+        reported = None
+        while not self._stop.wait(self.slow_callback_s / 2):
+            beat = self.beat
+            blocked_s = time.monotonic() - beat - self.interval_s
+            if blocked_s < self.slow_callback_s or beat == reported:
+                continue
+            reported = beat
+            LOOP_BLOCKED.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame, limit=20)) if frame else ''
+            self.logger.warning('event loop is blocked for {:.3f}s, loop thread stack:\n{}', blocked_s, stack)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def start_diagnostics(settings=EnvSettings(), logger=loguru.logger) -> Tuple[SamplingProfiler, LoopMonitor]:
+    """
+    Starts loop monitor and makes SIGUSR1 start and stop profiler, which writes profile to PROFILE_DIR.
+    Must be called in running loop
+
+    :return: profiler for /profile endpoint (see profile_handler) and loop monitor, keep reference to it
+    """
+    profiler = SamplingProfiler(settings.profile_interval_s)
+    directory = settings.profile_dir or tempfile.gettempdir()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiler, profiler, directory, logger)
+    except (AttributeError, NotImplementedError):  # no SIGUSR1 or signal handlers on Windows
+        logger.info('profiler can be started only with /profile endpoint of metrics server')
+    monitor = LoopMonitor(slow_callback_s=settings.slow_callback_s, logger=logger)
+    monitor.start()
+    return profiler, monitor
@@ -1,15 +1,110 @@
 import json
 
+from common.check import CheckResult
 
-class Serde:
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+
+# messages in formats other than json start with this byte and format code. JSON text never starts with zero byte,
+# so messages without header are decoded as json
+HEADER_MAGIC = 0
+
+
+class JsonCodec:
     """
-    Common serializer for both consumer and producer
+    Standard library json. Messages have no header, so consumers without codecs support can read them
     """
+    name, code = 'json', None
+
     def __init__(self, encoding='utf-8'):
         self.encoding = encoding
 
-    def serialize(self, value: dict) -> bytes:
+    def encode(self, value: dict) -> bytes:
         return json.dumps(value).encode(self.encoding)
 
+    def decode(self, value: bytes) -> dict:
+        return json.loads(bytes(value).decode(self.encoding))
+
+
+class OrjsonCodec:
+    name, code = 'orjson', 1
+
+    def __init__(self, encoding='utf-8'):
+        if orjson is None:
+            raise ValueError('orjson message format requires orjson package')
+
+    def encode(self, value: dict) -> bytes:
+        return orjson.dumps(value)
+
+    def decode(self, value: bytes) -> dict:
+        return orjson.loads(value)
+
+
+class MsgpackCodec:
+    name, code = 'msgpack', 2
+
+    def __init__(self, encoding='utf-8'):
+        if msgpack is None:
+            raise ValueError('msgpack message format requires msgpack package')
+
+    def encode(self, value: dict) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, value: bytes) -> dict:
+        return msgpack.unpackb(value, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+
+
+class Serde:
+    """
+    Common serializer for both consumer and producer
+    """
+    def __init__(self, encoding='utf-8', message_format='json'):
+        """
+        :param encoding: text encoding for json format
+        :param message_format: format of serialized messages, one of CODECS. Messages in any format with available
+            package can be deserialized
+        """
+        assert message_format in CODECS, f'unknown message format {message_format}'
+        self.encoding = encoding
+        self.codec = CODECS[message_format](encoding)
+        self.header = bytes((HEADER_MAGIC, self.codec.code)) if self.codec.code else b''
+        self.json = JsonCodec(encoding)
+        self.decoders = {}
+
+    def serialize(self, value) -> bytes:
+        """
+        :param value: dict or CheckResult, which is written as dict of its fields
+        """
+        if type(value) is CheckResult:
+            value = value.to_wire()
+        return self.header + self.codec.encode(value)
+
     def deserialize(self, value: bytes) -> dict:
-        return json.loads(value.decode(self.encoding))
+        if not value or value[0] != HEADER_MAGIC:
+            return self.json.decode(value)
+        return self.decoder(value[1]).decode(memoryview(value)[2:])
+
+    def deserialize_check(self, value: bytes) -> CheckResult:
+        return CheckResult.from_wire(self.deserialize(value))
+
+    def decoder(self, code: int):
+        try:
+            return self.decoders[code]
+        except KeyError:
+            pass
+        for codec in CODECS.values():
+            if codec.code == code:
+                self.decoders[code] = codec(self.encoding)
+                return self.decoders[code]
+        raise ValueError(f'unknown message format code {code}')
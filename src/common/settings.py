@@ -23,9 +23,21 @@ class EnvSettings:
     @property
     def kafka_topic_success(self): return getenv('KAFKA_TOPIC_SUCCESS', 'checks-success')
 
+    @property
+    def kafka_topic_anomalies(self): return getenv('KAFKA_TOPIC_ANOMALIES', 'checks-anomalies')
+
     @property
     def kafka_consumer_group(self): return getenv('KAFKA_CONSUMER_GROUP', 'checks-consumer')
 
+    @property
+    def kafka_linger_ms(self): return int(getenv('KAFKA_LINGER_MS', '0'))
+
+    @property
+    def kafka_max_batch_size(self): return int(getenv('KAFKA_MAX_BATCH_SIZE', '16384'))
+
+    @property
+    def kafka_compression_type(self): return getenv('KAFKA_COMPRESSION_TYPE', '') or None
+
     @property
     def postgres_dsn(self): return getenv('POSTGRES_DSN')
 
@@ -35,6 +47,123 @@ class EnvSettings:
     @property
     def message_encoding(self): return getenv('MESSAGE_ENCODING', 'utf-8')
 
+    @property
+    def message_format(self): return getenv('MESSAGE_FORMAT', 'json')
+
+    @property
+    def http_limit(self): return int(getenv('HTTP_LIMIT', '100'))
+
+    @property
+    def http_limit_per_host(self): return int(getenv('HTTP_LIMIT_PER_HOST', '10'))
+
+    @property
+    def http_dns_ttl_s(self): return int(getenv('HTTP_DNS_TTL_S', '300'))
+
+    @property
+    def http_keepalive_s(self): return float(getenv('HTTP_KEEPALIVE_S', '30'))
+
+    @property
+    def http_max_requests(self): return int(getenv('HTTP_MAX_REQUESTS', '0'))
+
+    @property
+    def host_rate(self): return float(getenv('HOST_RATE', '0'))
+
+    @property
+    def host_burst(self): return float(getenv('HOST_BURST', '1'))
+
+    @property
+    def host_concurrency(self): return int(getenv('HOST_CONCURRENCY', '0'))
+
+    @property
+    def host_max_backoff_s(self): return float(getenv('HOST_MAX_BACKOFF_S', '600'))
+
+    @property
+    def max_body_bytes(self): return int(getenv('MAX_BODY_BYTES', '0'))
+
+    @property
+    def producer_workers(self): return int(getenv('PRODUCER_WORKERS', '1'))
+
+    @property
+    def pollers(self): return int(getenv('POLLERS', '1'))
+
+    @property
+    def publishers(self): return int(getenv('PUBLISHERS', '1'))
+
+    @property
+    def writers(self): return int(getenv('WRITERS', '1'))
+
+    @property
+    def queue_size(self): return int(getenv('QUEUE_SIZE', '0'))
+
+    @property
+    def overload_policy(self): return getenv('OVERLOAD_POLICY', 'block')
+
+    @property
+    def log_level(self): return getenv('LOGURU_LEVEL', 'DEBUG')
+
+    @property
+    def log_json(self): return getenv('LOG_JSON', '0') == '1'
+
+    @property
+    def log_sample_every(self): return int(getenv('LOG_SAMPLE_EVERY', '1'))
+
+    @property
+    def log_max_per_second(self): return int(getenv('LOG_MAX_PER_SECOND', '0'))
+
+    @property
+    def metrics_port(self): return int(getenv('METRICS_PORT', '0'))
+
+    @property
+    def profile_dir(self): return getenv('PROFILE_DIR', '')
+
+    @property
+    def profile_interval_s(self): return float(getenv('PROFILE_INTERVAL_S', '0.01'))
+
+    @property
+    def slow_callback_s(self): return float(getenv('SLOW_CALLBACK_S', '0.1'))
+
+    @property
+    def spool_dir(self): return getenv('SPOOL_DIR', '')
+
+    @property
+    def spool_max_bytes(self): return int(getenv('SPOOL_MAX_BYTES', str(1024 ** 3)))
+
+    @property
+    def spool_segment_bytes(self): return int(getenv('SPOOL_SEGMENT_BYTES', str(16 * 1024 ** 2)))
+
+    @property
+    def spool_latency_s(self): return float(getenv('SPOOL_LATENCY_S', '0'))
+
+    @property
+    def targets_reload_s(self): return float(getenv('TARGETS_RELOAD_S', '30'))
+
+    @property
+    def rollups(self): return getenv('ROLLUPS', '0') == '1'
+
+    @property
+    def anomalies(self): return getenv('ANOMALIES', '0') == '1'
+
+    @property
+    def anomaly_max_sites(self): return int(getenv('ANOMALY_MAX_SITES', '100000'))
+
+    @property
+    def anomaly_window(self): return int(getenv('ANOMALY_WINDOW', '64'))
+
+    @property
+    def anomaly_z_score(self): return float(getenv('ANOMALY_Z_SCORE', '4'))
+
+    @property
+    def schema_mode(self): return getenv('SCHEMA_MODE', 'plain')
+
+    @property
+    def partition_interval(self): return getenv('PARTITION_INTERVAL', 'day')
+
+    @property
+    def partitions_premake(self): return int(getenv('PARTITIONS_PREMAKE', '7'))
+
+    @property
+    def partitions_retention(self): return int(getenv('PARTITIONS_RETENTION', '0'))
+
     @property
     def user_agent(self): return getenv('USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                                                       '(KHTML, like Gecko) Chrome/89.0.4389.90 Safari/537.36')
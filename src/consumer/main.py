@@ -1,49 +1,111 @@
 import argparse
 import asyncio
-from functools import partial
-
+from contextlib import AsyncExitStack
 import asyncpg
-from aiokafka import ConsumerRecord, AIOKafkaConsumer, TopicPartition
 
 from common.composer import Composer
-from common.kafka import create_consumer
+from common.kafka import create_consumer, create_producer
+from common.metrics import start_metrics_server
+from common.profiling import start_diagnostics, profile_handler
 from common.serializer import Serde
 from common.settings import EnvSettings
 from db import PostgresRepo
-from impl import KafkaTaskProvider
-from impl.worker import DbWriter
+from impl import KafkaTaskProvider, KafkaBatchTaskProvider, OffsetTracker, CommitOnRebalance
+from impl.worker import DbWriter, BatchDbWriter, FanOut
+from impl.anomaly import AnomalyDetector, LatencyWindows
 
 
-def configure_parser(parent=None) -> argparse.ArgumentParser:
+def configure_parser(parent=None, settings=EnvSettings()) -> argparse.ArgumentParser:
     """
     Adds this module subparser arguments to main's parser, if passed
     :param parent: parser from parent module
+    :param settings: source of default values
     :return: subparser
     """
     parser = argparse.ArgumentParser(parents=[parent] if parent else [], add_help=False)
     parser.add_argument('--no-autocommit', action='store_true', default=False, dest='no_autocommit',
-                        help='Do not autocommit offset on message fetch')
+                        help='Do not autocommit offset on message fetch, commit offsets of saved messages instead')
+    parser.add_argument('--commit-interval-s', default=5.0, type=float, dest='commit_interval_s',
+                        help='With --no-autocommit, how often offsets of saved messages are committed')
+    parser.add_argument('--commit-every', default=1000, type=int, dest='commit_every',
+                        help='With --no-autocommit, also commit after this number of saved messages')
+    parser.add_argument('--batch-size', default=1, type=int, dest='batch_size',
+                        help='Save records to database with batches of this size')
+    parser.add_argument('--batch-age-s', default=1.0, type=float, dest='batch_age_s',
+                        help='Max time for record to wait in incomplete batch')
+    parser.add_argument('--fetch-max-records', default=0, type=int, dest='fetch_max_records',
+                        help='Fetch records from Kafka with batches of up to this size and save every batch with one '
+                             'transaction. 0 fetches records one by one')
+    parser.add_argument('--fetch-timeout-ms', default=1000, type=int, dest='fetch_timeout_ms',
+                        help='Max time to wait for records when fetching batch')
+    parser.add_argument('--writers', default=settings.writers, type=int,
+                        help='Number of concurrent database writers (env WRITERS)')
+    parser.add_argument('--metrics-port', default=settings.metrics_port, type=int, dest='metrics_port',
+                        help='Serve metrics on this port, 0 disables metrics server (env METRICS_PORT)')
+    parser.add_argument('--rollups', action='store_true', default=settings.rollups,
+                        help='Update per minute rollups of checks with every save (env ROLLUPS=1). '
+                             'Works best with batches')
+    parser.add_argument('--anomalies', action='store_true', default=settings.anomalies,
+                        help='Detect response time anomalies and publish them to KAFKA_TOPIC_ANOMALIES topic '
+                             '(env ANOMALIES=1). Requires numpy')
     return parser
 
 
-def commit_offset(consumer: AIOKafkaConsumer, msg: ConsumerRecord):
-    tp = TopicPartition(msg.topic, msg.partition)
-    asyncio.create_task(consumer.commit({tp: msg.offset + 1}))
+async def anomaly_detector(settings: EnvSettings, stack: AsyncExitStack) -> AnomalyDetector:
+    """
+    Creates anomaly detector with its own Kafka producer, both are closed with exit stack
+    """
+    windows = LatencyWindows(max_sites=settings.anomaly_max_sites, window=settings.anomaly_window,
+                             z_score=settings.anomaly_z_score)
+    producer = create_producer(settings, value_serializer=Serde(settings.message_encoding).serialize)
+    await producer.start()
+    stack.push_async_callback(producer.stop)
+    detector = AnomalyDetector(producer, settings.kafka_topic_success, settings.kafka_topic_anomalies, windows)
+    return await stack.enter_async_context(detector)
 
 
 async def main(args: argparse.Namespace, settings=EnvSettings()):
-    consumer = create_consumer(settings, value_deserializer=Serde(settings.message_encoding).deserialize)
+    profiler, loop_monitor = start_diagnostics(settings)
+    deserializer = Serde(settings.message_encoding).deserialize_check
+    if args.no_autocommit:
+        consumer = create_consumer(settings, value_deserializer=deserializer, enable_auto_commit=False)
+        tracker = OffsetTracker(consumer, args.commit_interval_s, args.commit_every)
+        # subscribe again with listener, which commits offsets of revoked partitions
+        consumer.subscribe((settings.kafka_topic_success, settings.kafka_topic_failure),
+                           listener=CommitOnRebalance(tracker))
+    else:
+        consumer = create_consumer(settings, value_deserializer=deserializer)
+        tracker = None
+
+    if args.fetch_max_records > 0:
+        kafka_reader = KafkaBatchTaskProvider(consumer, args.fetch_timeout_ms, args.fetch_max_records, tracker)
+    else:
+        kafka_reader = KafkaTaskProvider(consumer, tracker)
 
-    async with asyncpg.create_pool(settings.postgres_dsn) as pg_pool, KafkaTaskProvider(consumer) as kafka_reader:
+    # exit order matters: writer saves buffered records, then tracker commits their offsets, then consumer stops
+    async with asyncpg.create_pool(settings.postgres_dsn) as pg_pool, kafka_reader, AsyncExitStack() as stack:
         await consumer.start()
         await consumer.seek_to_committed()
 
-        repo = PostgresRepo(pg_pool)
-        db_writer = DbWriter(repo, settings.kafka_topic_success, settings.kafka_topic_failure)
-        if args.no_autocommit:
-            db_writer.success_callback = partial(commit_offset, consumer)
+        repo = PostgresRepo(pg_pool, rollups=args.rollups)
+        await repo.warm_cache()
+        if args.batch_size > 1:
+            db_writer = BatchDbWriter(repo, settings.kafka_topic_success, settings.kafka_topic_failure,
+                                      max_size=args.batch_size, max_age_s=args.batch_age_s)
+        else:
+            db_writer = DbWriter(repo, settings.kafka_topic_success, settings.kafka_topic_failure)
+        if tracker:
+            db_writer.success_callback = tracker.done
+            db_writer.failure_callback = tracker.done  # skipped record must not stop commits of later ones
+            await stack.enter_async_context(tracker)
+        await stack.enter_async_context(db_writer)
+        worker = db_writer
+        if args.anomalies:
+            worker = FanOut([db_writer, await anomaly_detector(settings, stack)])
 
-        _ = Composer().run(kafka_reader, [db_writer])
+        _ = Composer(processors_concurrency=args.writers).run(kafka_reader, [worker])
+        if args.metrics_port:
+            await start_metrics_server(args.metrics_port, handlers={'/profile': profile_handler(profiler)})
         await asyncio.Queue().get()
 
 
@@ -1,10 +1,16 @@
 import abc
-import asyncio
-from typing import Any, Union
+import time
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+from typing import Any, Union, List, Dict, Iterable, Optional, Sequence
 
 import asyncpg
 import loguru
-from dateutil.parser import parse as parse_date
+
+from common.check import CheckResult, as_check
+from common.metrics import REGISTRY
+from db.rollups import ROLLUP_RESOLUTIONS, UPSERT_MINUTE, histogram_percentile, merge_histograms, minute_rollups
 
 
 class Repository(metaclass=abc.ABCMeta):
@@ -17,26 +23,103 @@ class Repository(metaclass=abc.ABCMeta):
     async def save_failed_check(self, data: dict):
         raise NotImplementedError()
 
+    async def save_checks(self, successful: List[dict], failed: List[dict]):
+        """
+        Saves batch of checks at once. Default implementation saves them one by one
+        """
+        for data in successful:
+            await self.save_successful_check(data)
+        for data in failed:
+            await self.save_failed_check(data)
+
+
+SUCCESS_COLUMNS = ('site_id', 'started', 'ended', 'response_time', 'status', 'pattern', 'match',
+                   'dns_time', 'connect_time', 'ttfb_time', 'transfer_time')
+ERRORS_COLUMNS = ('site_id', 'started', 'error_type', 'message')
+
+DB_SECONDS = REGISTRY.histogram('db_query_seconds', 'Database round trip time, without waiting for connection',
+                                ('operation',))
+DB_ERRORS = REGISTRY.counter('db_errors_total', 'Failed database operations', ('operation',))
+QUERY_SECONDS, SAVE_SECONDS = DB_SECONDS.labels('query'), DB_SECONDS.labels('save_checks')
+QUERY_ERRORS, SAVE_ERRORS = DB_ERRORS.labels('query'), DB_ERRORS.labels('save_checks')
+
+
+def success_row(site_id: int, data: Union[CheckResult, dict]) -> tuple:
+    return as_check(data).success_row(site_id)
+
+
+def errors_row(site_id: int, data: Union[CheckResult, dict]) -> tuple:
+    return as_check(data).errors_row(site_id)
+
+
+class LruCache:
+    """
+    Dictionary with limited size. When full, least recently used key is evicted
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.data = OrderedDict()
+
+    def get(self, key, default=None) -> Optional[Any]:
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            return default
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
 
 class PostgresRepo(Repository):
-    def __init__(self, pool_or_dsn: [Union[str, asyncpg.Pool]], logger=loguru.logger, default_timeout_s=10):
+    def __init__(self, pool_or_dsn: [Union[str, asyncpg.Pool]], logger=loguru.logger, default_timeout_s=10,
+                 cache_size=100_000, rollups=False):
+        """
+        :param pool_or_dsn: connection pool or DSN to create one
+        :param logger:
+        :param default_timeout_s: query timeout
+        :param cache_size: max number of url ids kept in memory
+        :param rollups: update minute rollups when batch of checks is saved
+        """
         self.pool: asyncpg.Pool = asyncpg.create_pool(pool_or_dsn) if isinstance(pool_or_dsn, str) else pool_or_dsn
         self.logger = logger
         self.default_timeout_s = default_timeout_s
-        self.lock = asyncio.Lock()
+        self.site_ids = LruCache(cache_size)
+        self.rollups = rollups
 
     async def exec(self, query, *args, timeout=None) -> Any:
         async with self.pool.acquire() as conn:  # type: asyncpg.Connection
+            started = time.perf_counter()
             try:
                 self.logger.debug('query: {}, args: {}', query, args)
                 # result = await conn.execute(query, *args, timeout=timeout or self.default_timeout_s)
                 result = await conn.fetch(query, *args, timeout=timeout or self.default_timeout_s)
+                QUERY_SECONDS.observe(time.perf_counter() - started)
                 self.logger.debug('query result: {}', result)
                 return result
             except Exception:
+                QUERY_ERRORS.inc()
                 self.logger.debug('error executing query {} witg args {}', query, args)
                 raise
 
+    async def warm_cache(self):
+        """
+        Loads ids of most recently added urls, so first messages don't need to query them
+        """
+        records = await self.exec('SELECT id, url FROM sites ORDER BY id DESC LIMIT $1', self.site_ids.max_size)
+        for r in reversed(records):
+            self.site_ids.put(r['url'], r['id'])
+        self.logger.info('loaded {} site ids', len(records))
+
     async def upsert_url(self, url: str) -> int:
         """
         Inserts new url if it not exists in DB
@@ -44,42 +127,149 @@ class PostgresRepo(Repository):
         :param url: unique url
         :return: url id
         """
-        # requires postgres >=9.1  https://stackoverflow.com/a/6722460/2465961
-        query = """
-        WITH new_row AS (
-            INSERT INTO sites (url)
-            SELECT $1
-            WHERE NOT EXISTS(SELECT * FROM sites WHERE url = $1)
-            RETURNING id
-        )
-        SELECT id FROM new_row UNION SELECT id FROM sites WHERE url = $1"""
+        site_id = self.site_ids.get(url)
+        if site_id is None:
+            site_id = (await self.upsert_urls([url]))[url]
+        return site_id
+
+    async def upsert_urls(self, urls: Iterable[str]) -> Dict[str, int]:
+        """
+        Inserts all urls missing in DB with one query. Known urls are taken from cache
 
-        async with self.lock:
-            records = await self.exec(query, url)
-        return records[0]['id']
+        :param urls: unique urls
+        :return: mapping of url to its id
+        """
+        site_ids, missing = {}, []
+        for url in urls:
+            site_id = self.site_ids.get(url)
+            if site_id is None:
+                missing.append(url)
+            else:
+                site_ids[url] = site_id
+
+        if missing:
+            # no-op update makes RETURNING include existing rows. Sorting avoids deadlocks between concurrent upserts
+            query = """
+            INSERT INTO sites (url)
+            SELECT DISTINCT url FROM unnest($1::text[]) AS url ORDER BY url
+            ON CONFLICT (url) DO UPDATE SET url = EXCLUDED.url
+            RETURNING id, url"""
+            for r in await self.exec(query, missing):
+                self.site_ids.put(r['url'], r['id'])
+                site_ids[r['url']] = r['id']
+        return site_ids
 
     async def save_successful_check(self, data: dict):
         """
-        :param data: dict with keys url, started, ended, response_time, status
+        :param data: CheckResult, or message dict with keys url, started_ns, ended_ns, response_time_s, status,
+            optional pattern, match and request phases timings dns_s, connect_s, ttfb_s, transfer_s
         """
+        if self.rollups:
+            return await self.save_checks([data], [])
         site_id = await self.upsert_url(data['url'])
-        started, ended = parse_date(data['started']), parse_date(data['ended'])
-        response_time, status = data['response_time_s'], data['status']
-        pattern, match = data.get('pattern'), data.get('match')
-        query = 'INSERT INTO success (site_id, started, ended, response_time, status, pattern, match) ' \
-                'VALUES ($1, $2, $3, $4, $5, $6, $7)'
+        query = 'INSERT INTO success (site_id, started, ended, response_time, status, pattern, match, ' \
+                'dns_time, connect_time, ttfb_time, transfer_time) ' \
+                'VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)'
 
-        return await self.exec(query, site_id, started, ended, response_time, status, pattern, match)
+        return await self.exec(query, *success_row(site_id, data))
 
     async def save_failed_check(self, data: dict):
         """
-        :param data: dict with keys url, started, error_type, error
+        :param data: CheckResult, or message dict with keys url, started_ns, error_type, message
         """
+        if self.rollups:
+            return await self.save_checks([], [data])
         site_id = await self.upsert_url(data['url'])
-        error_type, message = data['error_type'], data['message']
-        started = parse_date(data['started'])
         query = 'INSERT INTO errors (site_id, started, error_type, message) VALUES ($1, $2, $3, $4)'
-        return await self.exec(query, site_id, started, error_type, message)
+        return await self.exec(query, *errors_row(site_id, data))
+
+    async def save_checks(self, successful: List[dict], failed: List[dict]):
+        """
+        Saves batch of checks with COPY in one transaction, so either all rows are stored or none.
+        Minute rollups are updated in the same transaction, if enabled
+
+        :param successful: checks like in save_successful_check
+        :param failed: checks like in save_failed_check
+        """
+        site_ids = await self.upsert_urls({data['url'] for data in chain(successful, failed)})
+        success_rows = [success_row(site_ids[data['url']], data) for data in successful]
+        errors_rows = [errors_row(site_ids[data['url']], data) for data in failed]
+
+        async with self.pool.acquire() as conn:  # type: asyncpg.Connection
+            started = time.perf_counter()
+            try:
+                await self._copy_checks(conn, success_rows, errors_rows)
+            except Exception:
+                SAVE_ERRORS.inc()
+                raise
+            SAVE_SECONDS.observe(time.perf_counter() - started)
+        self.logger.debug('saved {} successful and {} failed checks', len(success_rows), len(errors_rows))
+
+    async def _copy_checks(self, conn: asyncpg.Connection, success_rows: List[tuple], errors_rows: List[tuple]):
+        async with conn.transaction():
+            if success_rows:
+                await conn.copy_records_to_table('success', records=success_rows, columns=SUCCESS_COLUMNS,
+                                                 timeout=self.default_timeout_s)
+            if errors_rows:
+                await conn.copy_records_to_table('errors', records=errors_rows, columns=ERRORS_COLUMNS,
+                                                 timeout=self.default_timeout_s)
+            if self.rollups:
+                await conn.executemany(UPSERT_MINUTE, minute_rollups(success_rows, errors_rows),
+                                       timeout=self.default_timeout_s)
+
+    async def site_stats(self, url: str, since: datetime, until: datetime, resolution: str = 'minute',
+                         percentiles: Sequence[float] = (0.5, 0.95, 0.99)) -> dict:
+        """
+        Availability and response time stats of site from rollups, raw checks are not read
+
+        :param url:
+        :param since: start of time range, rounded down to rollup bucket
+        :param until: end of time range, exclusive
+        :param resolution: minute or hour rollups. Hourly rollups are available for compacted hours only
+        :param percentiles: response time percentiles to estimate, as fractions
+        :return: dict with count, error_count, availability, min_time, max_time, mean_time and percentiles like p95.
+            Time stats are None when there were no successful checks
+        """
+        assert resolution in ROLLUP_RESOLUTIONS, f'unknown rollup resolution {resolution}'
+        records = await self.exec(
+            f'SELECT count, error_count, min_time, max_time, sum_time, histogram FROM {ROLLUP_RESOLUTIONS[resolution]} '
+            'WHERE site_id = (SELECT id FROM sites WHERE url = $1) AND bucket >= date_trunc($2, $3::timestamptz) '
+            'AND bucket < $4', url, resolution, since, until)
+
+        count = sum(r['count'] for r in records)
+        error_count = sum(r['error_count'] for r in records)
+        histogram = []
+        for r in records:
+            histogram = merge_histograms(histogram, r['histogram'])
+        min_times = [r['min_time'] for r in records if r['min_time'] is not None]
+        max_times = [r['max_time'] for r in records if r['max_time'] is not None]
+        successful = count - error_count
+
+        stats = {
+            'count': count,
+            'error_count': error_count,
+            'availability': successful / count if count else None,
+            'min_time': min(min_times, default=None),
+            'max_time': max(max_times, default=None),
+            'mean_time': sum(r['sum_time'] or 0 for r in records) / successful if successful else None,
+        }
+        for q in percentiles:
+            stats[f'p{q * 100:g}'] = histogram_percentile(histogram, q)
+        return stats
+
+    async def availability(self, url: str, since: datetime, until: datetime, resolution: str = 'minute') \
+            -> Optional[float]:
+        """
+        Share of successful checks, None if site wasn't checked
+        """
+        return (await self.site_stats(url, since, until, resolution, percentiles=()))['availability']
+
+    async def latency_percentile(self, url: str, q: float, since: datetime, until: datetime,
+                                 resolution: str = 'minute') -> Optional[float]:
+        """
+        Approximate response time percentile in seconds, None if there were no successful checks
+        """
+        return (await self.site_stats(url, since, until, resolution, percentiles=(q,)))[f'p{q * 100:g}']
 
     async def __aenter__(self):
         return self
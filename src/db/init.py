@@ -12,25 +12,51 @@ import loguru
 
 from common.funcs import MissingVariableError
 from common.settings import EnvSettings
+from db.partitions import PartitionManager, PARTITIONED_TABLES
+from db.retention import add_schema_arguments
 
+SCHEMA_SCRIPTS = {
+    'plain': 'create.sql',
+    'partitioned': 'create_partitioned.sql',
+}
 
-def configure_parser(parent=None) -> argparse.ArgumentParser:
+
+def configure_parser(parent=None, settings=EnvSettings()) -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(parents=[parent] if parent else [], add_help=False)
     parser.add_argument('--scripts', required=True, type=str, help='directory with SQL scripts')
+    add_schema_arguments(parser, settings)
     return parser
 
 
 async def main(args: argparse.Namespace, settings=EnvSettings()):
     logger = loguru.logger
-    with open(os.path.join(args.scripts, 'create.sql')) as fp:
-        script = fp.read().strip()
+    scripts = []
+    for name in (SCHEMA_SCRIPTS[args.schema_mode], 'create_rollups.sql'):
+        with open(os.path.join(args.scripts, name)) as fp:
+            scripts.append(fp.read().strip())
 
     try:
         conn: asyncpg.Connection = await asyncpg.connect(settings.postgres_dsn)
-        await conn.execute(script)
-        logger.info('postgres tables initialized')
     except MissingVariableError:  # no postgres dsn available - service don't use postgres
-        pass
+        return
+
+    try:
+        if args.schema_mode == 'partitioned':
+            plain = await conn.fetch("SELECT relname FROM pg_class WHERE relname = any($1::text[]) AND relkind = 'r'",
+                                     list(PARTITIONED_TABLES))
+            if plain:
+                logger.error('tables {} already exist and are not partitioned, move data to new tables manually',
+                             [r['relname'] for r in plain])
+                return
+
+        for script in scripts:
+            await conn.execute(script)
+        if args.schema_mode == 'partitioned':
+            manager = PartitionManager(conn, args.partition_interval, args.premake, args.retention, logger=logger)
+            await manager.maintain()
+        logger.info('postgres tables initialized')
+    finally:
+        await conn.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, List, Tuple, Union
+
+import asyncpg
+import loguru
+
+PARTITION_INTERVALS = ('day', 'week')
+PARTITIONED_TABLES = ('success', 'errors')
+
+
+def partition_start(day: date, interval: str) -> date:
+    """
+    First day of partition containing given day. Weekly partitions start on Monday
+    """
+    assert interval in PARTITION_INTERVALS, f'unknown partition interval {interval}'
+    return day - timedelta(days=day.weekday()) if interval == 'week' else day
+
+
+def partition_step(interval: str) -> timedelta:
+    return timedelta(weeks=1) if interval == 'week' else timedelta(days=1)
+
+
+def partition_name(table: str, start: date) -> str:
+    return f'{table}_p{start:%Y%m%d}'
+
+
+def parse_partition_name(table: str, name: str) -> Union[date, None]:
+    """
+    Start day of partition created by PartitionManager, None for other tables like default partition
+    """
+    found = re.fullmatch(rf'{re.escape(table)}_p(\d{{8}})', name)
+    return datetime.strptime(found.group(1), '%Y%m%d').date() if found else None
+
+
+class PartitionManager:
+    def __init__(self, conn: Union[asyncpg.Connection, asyncpg.Pool], interval: str = 'day', premake: int = 7,
+                 retention: int = 0, tables: Iterable[str] = PARTITIONED_TABLES, logger=loguru.logger):
+        """
+        Maintains range partitions by started time of tables created with create_partitioned.sql.
+        Partition bounds are days (or weeks) in UTC
+
+        :param conn: connection or pool
+        :param interval: partition size, day or week
+        :param premake: number of partitions created ahead of the current one
+        :param retention: number of past partitions kept besides the current one, older are dropped. 0 keeps all
+        :param tables: partitioned tables
+        :param logger:
+        """
+        assert interval in PARTITION_INTERVALS, f'unknown partition interval {interval}'
+        self.conn = conn
+        self.interval = interval
+        self.premake = premake
+        self.retention = retention
+        self.tables = tuple(tables)
+        self.logger = logger
+
+    def current(self, now: datetime = None) -> date:
+        now = now or datetime.now(timezone.utc)
+        return partition_start(now.astimezone(timezone.utc).date(), self.interval)
+
+    def wanted(self, now: datetime = None) -> List[Tuple[date, date]]:
+        """
+        Bounds of the current partition and partitions made ahead
+        """
+        start, step = self.current(now), partition_step(self.interval)
+        return [(start + step * i, start + step * (i + 1)) for i in range(self.premake + 1)]
+
+    def expired(self, start: date, now: datetime = None) -> bool:
+        if not self.retention:
+            return False
+        return start < self.current(now) - partition_step(self.interval) * self.retention
+
+    async def existing(self, table: str) -> List[Tuple[str, date]]:
+        """
+        Names and start days of partitions of the table made by this manager
+        """
+        records = await self.conn.fetch('''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = $1''', table)
+        partitions = [(r['relname'], parse_partition_name(table, r['relname'])) for r in records]
+        return sorted((name, start) for name, start in partitions if start is not None)
+
+    async def create(self, now: datetime = None) -> List[str]:
+        """
+        Creates missing partitions from the current one to premake ahead
+
+        :return: names of created partitions
+        """
+        created = []
+        for table in self.tables:
+            existing = {name for name, _ in await self.existing(table)}
+            for start, end in self.wanted(now):
+                name = partition_name(table, start)
+                if name in existing:
+                    continue
+                try:
+                    await self.conn.execute(
+                        f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} '
+                        f"FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')")
+                    created.append(name)
+                except asyncpg.PostgresError as e:  # for example default partition already has rows of this range
+                    self.logger.error('error creating partition {}: {}', name, e)
+        if created:
+            self.logger.info('created partitions: {}', created)
+        return created
+
+    async def drop(self, now: datetime = None) -> List[str]:
+        """
+        Drops partitions older than retention
+
+        :return: names of dropped partitions
+        """
+        dropped = []
+        for table in self.tables:
+            for name, start in await self.existing(table):
+                if self.expired(start, now):
+                    await self.conn.execute(f'DROP TABLE IF EXISTS {name}')
+                    dropped.append(name)
+        if dropped:
+            self.logger.info('dropped partitions: {}', dropped)
+        return dropped
+
+    async def maintain(self, now: datetime = None):
+        await self.create(now)
+        await self.drop(now)
@@ -0,0 +1,89 @@
+"""
+Database maintenance: creates future partitions ahead of time and drops expired ones, compacts minute rollups into
+hourly ones and drops old minute rollups
+"""
+
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import loguru
+
+from common.settings import EnvSettings
+from db.partitions import PartitionManager, PARTITION_INTERVALS
+from db.rollups import COMPACT_HOURS, compaction_range
+
+SCHEMA_MODES = ('plain', 'partitioned')
+
+
+def add_schema_arguments(parser: argparse.ArgumentParser, settings=EnvSettings()):
+    parser.add_argument('--schema-mode', default=settings.schema_mode, choices=SCHEMA_MODES, dest='schema_mode',
+                        help='plain tables, or tables partitioned by started time (env SCHEMA_MODE)')
+    parser.add_argument('--partition-interval', default=settings.partition_interval, choices=PARTITION_INTERVALS,
+                        dest='partition_interval',
+                        help='Range of started time stored in one partition (env PARTITION_INTERVAL)')
+    parser.add_argument('--premake', default=settings.partitions_premake, type=int,
+                        help='Number of partitions created ahead of the current one (env PARTITIONS_PREMAKE)')
+    parser.add_argument('--retention', default=settings.partitions_retention, type=int,
+                        help='Number of past partitions to keep, older ones are dropped. '
+                             '0 keeps all (env PARTITIONS_RETENTION)')
+
+
+def configure_parser(parent=None, settings=EnvSettings()) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(parents=[parent] if parent else [], add_help=False)
+    add_schema_arguments(parser, settings)
+    parser.add_argument('--rollups-lookback-h', default=2, type=int, dest='rollups_lookback_h',
+                        help='Number of completed hours compacted into hourly rollups on every check')
+    parser.add_argument('--minute-rollups-retention-h', default=48, type=int, dest='minute_rollups_retention_h',
+                        help='Minute rollups older than this number of hours are dropped. 0 keeps all')
+    parser.add_argument('--check-interval-s', default=3600, type=float, dest='check_interval_s',
+                        help='How often maintenance is done')
+    parser.add_argument('--once', action='store_true', default=False,
+                        help='Do maintenance once and exit, for running from cron')
+    return parser
+
+
+async def compact_rollups(conn, lookback_h: int, minute_retention_h: int = 0, now: datetime = None,
+                          logger=loguru.logger):
+    """
+    Recomputes hourly rollups of recent completed hours from minute rollups, drops minute rollups after retention
+
+    :param conn: connection or pool
+    :param lookback_h: number of completed hours to compact
+    :param minute_retention_h: drop minute rollups older than this number of hours, 0 keeps all
+    :param now:
+    :param logger:
+    """
+    now = now or datetime.now(timezone.utc)
+    since, until = compaction_range(now, lookback_h)
+    await conn.execute(COMPACT_HOURS, since, until)
+    logger.info('compacted rollups from {} to {}', since, until)
+    if minute_retention_h:
+        await conn.execute('DELETE FROM rollup_minute WHERE bucket < $1', now - timedelta(hours=minute_retention_h))
+
+
+async def maintain(conn, args: argparse.Namespace, logger=loguru.logger):
+    if args.schema_mode == 'partitioned':
+        await PartitionManager(conn, args.partition_interval, args.premake, args.retention, logger=logger).maintain()
+    await compact_rollups(conn, args.rollups_lookback_h, args.minute_rollups_retention_h, logger=logger)
+
+
+async def main(args: argparse.Namespace, settings=EnvSettings()):
+    logger = loguru.logger
+    async with asyncpg.create_pool(settings.postgres_dsn, min_size=1, max_size=1) as pool:
+        while True:
+            try:
+                await maintain(pool, args, logger)
+            except Exception:
+                if args.once:
+                    raise
+                logger.exception('error maintaining database')
+            if args.once:
+                return
+            await asyncio.sleep(args.check_interval_s)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(configure_parser().parse_args()))
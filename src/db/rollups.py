@@ -0,0 +1,153 @@
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+ROLLUP_RESOLUTIONS = {'minute': 'rollup_minute', 'hour': 'rollup_hour'}
+
+# latency sketch is a histogram with logarithmic buckets: bucket 0 holds times up to HISTOGRAM_MIN_S, every next bucket
+# is HISTOGRAM_GROWTH times wider. Relative error of percentiles is about half of growth, buckets cover up to 10 minutes
+HISTOGRAM_MIN_S = 0.001
+HISTOGRAM_GROWTH = 1.1
+HISTOGRAM_BUCKETS = 140
+
+UPSERT_MINUTE = '''
+    INSERT INTO rollup_minute (site_id, bucket, count, error_count, min_time, max_time, sum_time, histogram)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+    ON CONFLICT (site_id, bucket) DO UPDATE SET
+        count = rollup_minute.count + EXCLUDED.count,
+        error_count = rollup_minute.error_count + EXCLUDED.error_count,
+        min_time = least(rollup_minute.min_time, EXCLUDED.min_time),
+        max_time = greatest(rollup_minute.max_time, EXCLUDED.max_time),
+        sum_time = coalesce(rollup_minute.sum_time, 0) + coalesce(EXCLUDED.sum_time, 0),
+        histogram = histogram_merge(rollup_minute.histogram, EXCLUDED.histogram)'''
+
+# recomputes whole hours, so it can be repeated when late checks update minute rollups
+COMPACT_HOURS = '''
+    INSERT INTO rollup_hour (site_id, bucket, count, error_count, min_time, max_time, sum_time, histogram)
+    SELECT site_id, date_trunc('hour', bucket), sum(count), sum(error_count), min(min_time), max(max_time),
+           sum(sum_time), histogram_sum(histogram)
+    FROM rollup_minute
+    WHERE bucket >= $1 AND bucket < $2
+    GROUP BY site_id, date_trunc('hour', bucket)
+    ON CONFLICT (site_id, bucket) DO UPDATE SET
+        count = EXCLUDED.count,
+        error_count = EXCLUDED.error_count,
+        min_time = EXCLUDED.min_time,
+        max_time = EXCLUDED.max_time,
+        sum_time = EXCLUDED.sum_time,
+        histogram = EXCLUDED.histogram'''
+
+
+def bucket_of(value_s: float) -> int:
+    if value_s <= HISTOGRAM_MIN_S:
+        return 0
+    return min(int(math.log(value_s / HISTOGRAM_MIN_S, HISTOGRAM_GROWTH)) + 1, HISTOGRAM_BUCKETS - 1)
+
+
+def bucket_value(index: int) -> float:
+    """
+    Representative time of bucket, geometric middle of its bounds
+    """
+    if index == 0:
+        return HISTOGRAM_MIN_S
+    return HISTOGRAM_MIN_S * HISTOGRAM_GROWTH ** (index - 0.5)
+
+
+def merge_histograms(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    """
+    Element-wise sum, same as histogram_merge SQL function
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    return [x + (b[i] if i < len(b) else 0) for i, x in enumerate(a)]
+
+
+def histogram_percentile(histogram: Sequence[int], q: float) -> Optional[float]:
+    """
+    :param histogram: bucket counters
+    :param q: percentile as a fraction, like 0.95
+    :return: approximate value, None for empty histogram
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = max(math.ceil(q * total), 1)
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return bucket_value(index)
+
+
+class Rollup:
+    """
+    Aggregated checks of one site for a time bucket. Response times are aggregated only for successful checks
+    """
+    __slots__ = ('count', 'error_count', 'min_time', 'max_time', 'sum_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.min_time: Optional[float] = None
+        self.max_time: Optional[float] = None
+        self.sum_time: Optional[float] = None
+        self.histogram: List[int] = []
+
+    def add(self, response_time_s: float):
+        self.count += 1
+        self.min_time = response_time_s if self.min_time is None else min(self.min_time, response_time_s)
+        self.max_time = response_time_s if self.max_time is None else max(self.max_time, response_time_s)
+        self.sum_time = (self.sum_time or 0) + response_time_s
+        index = bucket_of(response_time_s)
+        if len(self.histogram) <= index:
+            self.histogram.extend([0] * (index + 1 - len(self.histogram)))
+        self.histogram[index] += 1
+
+    def add_error(self):
+        self.count += 1
+        self.error_count += 1
+
+    def row(self, site_id: int, bucket: datetime) -> tuple:
+        return (site_id, bucket, self.count, self.error_count, self.min_time, self.max_time, self.sum_time,
+                self.histogram)
+
+
+def minute_of(started: datetime) -> datetime:
+    return started.replace(second=0, microsecond=0)
+
+
+def minute_rollups(success_rows: Iterable[tuple], errors_rows: Iterable[tuple]) -> List[tuple]:
+    """
+    Aggregates rows of success and errors tables by site and minute
+
+    :param success_rows: rows in order of SUCCESS_COLUMNS
+    :param errors_rows: rows in order of ERRORS_COLUMNS
+    :return: rows for UPSERT_MINUTE
+    """
+    rollups: Dict[Tuple[int, datetime], Rollup] = {}
+
+    def rollup_of(site_id: int, started: datetime) -> Rollup:
+        key = (site_id, minute_of(started))
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = Rollup()
+        return rollup
+
+    for site_id, started, _, response_time, *_ in success_rows:
+        rollup_of(site_id, started).add(response_time)
+    for site_id, started, *_ in errors_rows:
+        rollup_of(site_id, started).add_error()
+    # same order of upserted rows in all writers, so concurrent transactions don't deadlock
+    return [rollups[key].row(*key) for key in sorted(rollups)]
+
+
+def hour_of(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def compaction_range(now: datetime, lookback_h: int) -> Tuple[datetime, datetime]:
+    """
+    Completed hours to compact: lookback_h hours before the current one
+    """
+    until = hour_of(now)
+    return until - timedelta(hours=lookback_h), until
@@ -24,6 +24,13 @@ CREATE TABLE IF NOT EXISTS success
     match bool
 );
 
+-- request phases timings, empty for checks made before they were collected
+ALTER TABLE success
+    ADD COLUMN IF NOT EXISTS dns_time float4,
+    ADD COLUMN IF NOT EXISTS connect_time float4,
+    ADD COLUMN IF NOT EXISTS ttfb_time float4,
+    ADD COLUMN IF NOT EXISTS transfer_time float4;
+
 CREATE TABLE IF NOT EXISTS errors
 (
     site_id int NOT NULL
@@ -32,4 +39,9 @@ CREATE TABLE IF NOT EXISTS errors
     started timestamptz,
     error_type text,
     message text
-);
\ No newline at end of file
+);
+CREATE INDEX IF NOT EXISTS success_site_id_started_index
+    ON success (site_id, started);
+
+CREATE INDEX IF NOT EXISTS errors_site_id_started_index
+    ON errors (site_id, started);
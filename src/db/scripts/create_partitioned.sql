@@ -0,0 +1,51 @@
+-- same tables as create.sql, but checks are stored in partitions by range of started time.
+-- Partitions are created and dropped by retention job, rows without matching partition go to default one
+CREATE TABLE IF NOT EXISTS sites
+(
+    id serial NOT NULL,
+    url text,
+    constraint sites_pk primary key (id)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS sites_id_uindex
+    ON sites (id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS sites_url_uindex
+    ON sites (url);
+
+CREATE TABLE IF NOT EXISTS success
+(
+    site_id int NOT NULL
+        CONSTRAINT success_sites_id_fk
+            REFERENCES sites,
+    started timestamptz NOT NULL,
+    ended timestamptz,
+    response_time float4,
+    status int,
+    pattern text,
+    match bool,
+    dns_time float4,
+    connect_time float4,
+    ttfb_time float4,
+    transfer_time float4
+) PARTITION BY RANGE (started);
+
+CREATE TABLE IF NOT EXISTS success_default PARTITION OF success DEFAULT;
+
+CREATE INDEX IF NOT EXISTS success_site_id_started_index
+    ON success (site_id, started);
+
+CREATE TABLE IF NOT EXISTS errors
+(
+    site_id int NOT NULL
+        CONSTRAINT errors_sites_id_fk
+            REFERENCES sites,
+    started timestamptz NOT NULL,
+    error_type text,
+    message text
+) PARTITION BY RANGE (started);
+
+CREATE TABLE IF NOT EXISTS errors_default PARTITION OF errors DEFAULT;
+
+CREATE INDEX IF NOT EXISTS errors_site_id_started_index
+    ON errors (site_id, started);
@@ -0,0 +1,49 @@
+-- per site aggregates of checks, used for availability and latency percentiles without reading raw rows.
+-- histogram holds counters of logarithmic response time buckets, see db/rollups.py
+CREATE OR REPLACE FUNCTION histogram_merge(a int[], b int[]) RETURNS int[] AS
+$$
+SELECT coalesce(array_agg(coalesce(a[i], 0) + coalesce(b[i], 0) ORDER BY i), '{}')
+FROM generate_series(1, greatest(coalesce(array_length(a, 1), 0), coalesce(array_length(b, 1), 0))) AS i
+$$ LANGUAGE sql IMMUTABLE;
+
+DO
+$$
+    BEGIN
+        CREATE AGGREGATE histogram_sum(int[]) (SFUNC = histogram_merge, STYPE = int[], INITCOND = '{}');
+    EXCEPTION
+        WHEN duplicate_function THEN NULL;
+    END
+$$;
+
+CREATE TABLE IF NOT EXISTS rollup_minute
+(
+    site_id int NOT NULL
+        CONSTRAINT rollup_minute_sites_id_fk
+            REFERENCES sites,
+    bucket timestamptz NOT NULL,
+    count int NOT NULL,
+    error_count int NOT NULL,
+    min_time float4,
+    max_time float4,
+    sum_time float8,
+    histogram int[] NOT NULL,
+    CONSTRAINT rollup_minute_pk PRIMARY KEY (site_id, bucket)
+);
+
+CREATE INDEX IF NOT EXISTS rollup_minute_bucket_index
+    ON rollup_minute (bucket);
+
+CREATE TABLE IF NOT EXISTS rollup_hour
+(
+    site_id int NOT NULL
+        CONSTRAINT rollup_hour_sites_id_fk
+            REFERENCES sites,
+    bucket timestamptz NOT NULL,
+    count int NOT NULL,
+    error_count int NOT NULL,
+    min_time float4,
+    max_time float4,
+    sum_time float8,
+    histogram int[] NOT NULL,
+    CONSTRAINT rollup_hour_pk PRIMARY KEY (site_id, bucket)
+);
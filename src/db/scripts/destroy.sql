@@ -1,3 +1,7 @@
 DROP TABLE IF EXISTS sites CASCADE;
 DROP TABLE IF EXISTS success;
 DROP TABLE IF EXISTS errors;
+DROP TABLE IF EXISTS rollup_minute;
+DROP TABLE IF EXISTS rollup_hour;
+DROP AGGREGATE IF EXISTS histogram_sum(int[]);
+DROP FUNCTION IF EXISTS histogram_merge(int[], int[]);
@@ -1,3 +1,10 @@
+from .queues import *
+from .offsets import *
 from .task_provider import *
 from .scheduler import *
+from .politeness import *
+from .spool import *
+from .http_client import *
+from .matching import *
 from .worker import *
+from .anomaly import *
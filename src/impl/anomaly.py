@@ -0,0 +1,209 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import loguru
+from aiokafka import AIOKafkaProducer, ConsumerRecord
+
+from abstractions import Worker
+from common.log import MessageLog, log_errors
+from common.metrics import REGISTRY
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+__all__ = ['LatencyWindows', 'AnomalyDetector']
+
+ANOMALIES = REGISTRY.counter('anomalies_total', 'Response time anomalies detected')
+EVICTED_SITES = REGISTRY.counter('anomaly_sites_evicted_total', 'Sites evicted from anomaly detector windows')
+
+
+class LatencyWindows:
+    def __init__(self, max_sites: int = 100_000, window: int = 64, alpha: float = 0.05, z_score: float = 4.0,
+                 percentile: float = 99, min_samples: int = 30):
+        """
+        Rolling response time statistics of sites in preallocated arrays: ring buffer of last values,
+        exponentially weighted mean and variance. Arrays are allocated on creation, about
+        max_sites * (window * 4 + 24) bytes. When all slots are taken, least recently updated site is evicted.
+        Batch must have fewer distinct sites than max_sites, otherwise its sites evict each other
+
+        :param max_sites: number of sites with statistics
+        :param window: number of last values kept for percentile
+        :param alpha: EWMA weight of new value
+        :param z_score: value is anomaly when it is this number of standard deviations above EWMA...
+        :param percentile: ...and above this percentile of values in window
+        :param min_samples: sites with fewer values are not checked for anomalies
+        """
+        if np is None:
+            raise ValueError('anomaly detection requires numpy package')
+        assert min_samples <= window, 'percentile needs min_samples values in window'
+        self.max_sites = max_sites
+        self.window = window
+        self.alpha = alpha
+        self.z_score = z_score
+        self.percentile = percentile
+        self.min_samples = min_samples
+
+        self.values = np.full((max_sites, window), np.nan, dtype=np.float32)
+        self.mean = np.zeros(max_sites, dtype=np.float64)
+        self.var = np.zeros(max_sites, dtype=np.float64)
+        self.count = np.zeros(max_sites, dtype=np.int32)
+        self.position = np.zeros(max_sites, dtype=np.int32)
+        self.slots: 'OrderedDict[str, int]' = OrderedDict()  # least recently updated site first
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.values, self.mean, self.var, self.count, self.position))
+
+    def slot(self, url: str) -> int:
+        """
+        Slot of the site, marked as the most recently updated. New site takes free slot or evicts the least
+        recently updated site, so sites seen earlier in the same batch are not evicted
+        """
+        slot = self.slots.get(url)
+        if slot is not None:
+            self.slots.move_to_end(url)
+            return slot
+        if len(self.slots) < self.max_sites:
+            slot = len(self.slots)
+        else:
+            _, slot = self.slots.popitem(last=False)
+            EVICTED_SITES.inc()
+        self.slots[url] = slot
+        self.values[slot] = np.nan
+        self.mean[slot] = self.var[slot] = 0
+        self.count[slot] = self.position[slot] = 0
+        return slot
+
+    def update(self, urls: List[str], response_times: List[float]) -> List[Tuple[int, dict]]:
+        """
+        Adds batch of values. Every value is checked against statistics before it is added
+
+        :return: indexes of anomalous values in batch and their statistics
+        """
+        slots = np.fromiter((self.slot(url) for url in urls), dtype=np.int64, count=len(urls))
+        values = np.asarray(response_times, dtype=np.float64)
+        indexes = np.arange(len(urls))
+        anomalies = []
+        while len(slots):
+            # a site can have several values in batch, they are applied in rounds, one value of site per round
+            _, first = np.unique(slots, return_index=True)
+            anomalies.extend(self._update_unique(slots[first], values[first], indexes[first]))
+            rest = np.ones(len(slots), dtype=bool)
+            rest[first] = False
+            slots, values, indexes = slots[rest], values[rest], indexes[rest]
+        return sorted(anomalies, key=lambda a: a[0])
+
+    def _update_unique(self, slots, values, indexes) -> List[Tuple[int, dict]]:
+        mean, var, count = self.mean[slots], self.var[slots], self.count[slots]
+        std = np.sqrt(var)
+        ready = (count >= self.min_samples) & (std > 0)
+        z = np.zeros(len(slots))
+        np.divide(values - mean, std, out=z, where=ready)
+
+        anomalies = []
+        candidates = np.flatnonzero(z >= self.z_score)
+        if len(candidates):
+            percentiles = np.nanpercentile(self.values[slots[candidates]], self.percentile, axis=1)
+            for i, percentile in zip(candidates, percentiles):
+                if values[i] > percentile:
+                    anomalies.append((int(indexes[i]), {'ewma_s': float(mean[i]), 'std_s': float(std[i]),
+                                                        'z_score': float(z[i]), 'percentile_s': float(percentile)}))
+
+        # exponentially weighted variance, see Finch, "Incremental calculation of weighted mean and variance"
+        diff = values - mean
+        increment = self.alpha * diff
+        first = count == 0
+        self.mean[slots] = np.where(first, values, mean + increment)
+        self.var[slots] = np.where(first, 0, (1 - self.alpha) * (var + diff * increment))
+        self.values[slots, self.position[slots]] = values
+        self.position[slots] = (self.position[slots] + 1) % self.window
+        self.count[slots] = count + 1
+        return anomalies
+
+
+class AnomalyDetector(Worker):
+    def __init__(self, producer: AIOKafkaProducer, topic_success: str, topic_anomalies: str,
+                 windows: LatencyWindows = None, max_size: int = 500, max_age_s: float = 1.0, logger=loguru.logger):
+        """
+        Finds response time anomalies in successful checks and publishes them to Kafka topic.
+        Records are buffered and statistics are updated by batches, see LatencyWindows
+
+        :param producer: Kafka producer for anomaly events
+        :param topic_success: name of topic with successful checks, records of other topics are ignored
+        :param topic_anomalies: topic for anomaly events
+        :param windows: statistics of sites, created with default parameters if not set
+        :param max_size: buffered records are processed when there are this number of them...
+        :param max_age_s: ...or when oldest of them waits for this time
+        :param logger:
+        """
+        self.producer = producer
+        self.topic_success = topic_success
+        self.topic_anomalies = topic_anomalies
+        self.windows = windows or LatencyWindows()
+        self.max_size = max_size
+        self.max_age_s = max_age_s
+        self.logger = logger
+        self.buffer: List[dict] = []
+        self._first_added = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+        self.anomaly_log = MessageLog('INFO', logger=logger)
+
+    @log_errors
+    async def process(self, task: ConsumerRecord) -> Any:
+        if task.topic != self.topic_success or task.value.get('response_time_s') is None:
+            return
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_by_age())
+        if not self.buffer:
+            self._first_added = time.monotonic()
+        self.buffer.append(task.value)
+        if len(self.buffer) >= self.max_size:
+            await self.flush()
+
+    @log_errors
+    async def process_batch(self, tasks: List[ConsumerRecord]) -> List[Any]:
+        self.buffer.extend(t.value for t in tasks
+                           if t.topic == self.topic_success and t.value.get('response_time_s') is not None)
+        await self.flush()
+        return []
+
+    async def flush(self):
+        checks, self.buffer = self.buffer, []
+        if not checks:
+            return
+        anomalies = self.windows.update([c['url'] for c in checks], [c['response_time_s'] for c in checks])
+        detected_ns = time.time_ns()
+        for index, stats in anomalies:
+            check = checks[index]
+            event = {'url': check['url'], 'started_ns': check.get('started_ns'), 'detected_ns': detected_ns,
+                     'response_time_s': check['response_time_s'], **stats}
+            self.anomaly_log('response time anomaly: {}', event)
+            await self.producer.send(self.topic_anomalies, event)
+        ANOMALIES.inc(len(anomalies))
+
+    async def _flush_by_age(self):
+        while True:
+            delay = self._first_added + self.max_age_s - time.monotonic() if self.buffer else self.max_age_s
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await self.flush()
+            except Exception:
+                self.logger.exception('error detecting anomalies')
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, AsyncIterator, Optional, Tuple
+
+import loguru
+from aiohttp import ClientSession, ClientResponse, TCPConnector, TraceConfig
+
+from common.metrics import REGISTRY
+from impl.politeness import HostPoliteness
+
+__all__ = ['HttpClientEngine', 'RequestTimings', 'timing_trace_config', 'PHASES']
+
+PHASES = ('dns_s', 'connect_s', 'ttfb_s', 'transfer_s')
+
+IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'HTTP requests waiting for response or reading body')
+
+
+def _seconds(start_ns: Optional[int], end_ns: Optional[int]) -> Optional[float]:
+    if start_ns is None or end_ns is None:
+        return None
+    return (end_ns - start_ns) / 1e9
+
+
+class RequestTimings:
+    """
+    Monotonic timestamps of request phases in nanoseconds. Passed to request as trace_request_ctx
+    and filled by timing_trace_config hooks. Phases that didn't happen, like DNS lookup and connect
+    for reused connection, stay None
+    """
+    __slots__ = ('request_start', 'dns_start', 'dns_end', 'connect_start', 'connect_end', 'headers_end', 'body_end')
+
+    def __init__(self, request_start: int = None):
+        self.request_start = request_start
+        self.dns_start = self.dns_end = None
+        self.connect_start = self.connect_end = None
+        self.headers_end = self.body_end = None
+
+    def durations(self) -> Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]:
+        """
+        Durations of phases in seconds, in order of PHASES. Phases don't overlap, so together they make up
+        the whole request time: dns_s - host resolution, connect_s - TCP and TLS handshakes, ttfb_s - from
+        connection being ready to response headers, transfer_s - reading the body
+        """
+        dns_s = _seconds(self.dns_start, self.dns_end)
+        connect_s = _seconds(self.connect_start, self.connect_end)
+        if connect_s is not None and dns_s is not None:
+            connect_s = max(connect_s - dns_s, 0.0)  # aiohttp resolves host inside connection creation
+        return (dns_s, connect_s, _seconds(self.connect_end or self.request_start, self.headers_end),
+                _seconds(self.headers_end, self.body_end))
+
+    def phases(self) -> dict:
+        """
+        Durations by phase name, see durations
+        """
+        return dict(zip(PHASES, self.durations()))
+
+    def headers_s(self) -> Optional[float]:
+        """
+        Time from request start to response headers, which is check response time. Body transfer is not included,
+        so response time means the same for checks with and without pattern
+        """
+        return _seconds(self.request_start, self.headers_end)
+
+
+def timing_trace_config() -> TraceConfig:
+    """
+    Trace config recording phases into RequestTimings given as trace_request_ctx.
+    Requests without it are not traced
+    """
+    def hook(*fields: str, first: bool = False):
+        async def record(session, context, params):
+            timings = context.trace_request_ctx
+            if not isinstance(timings, RequestTimings):
+                return
+            now = time.perf_counter_ns()
+            for field in fields:
+                if not first or getattr(timings, field) is None:  # redirects repeat hooks
+                    setattr(timings, field, now)
+        return record
+
+    config = TraceConfig()
+    config.on_request_start.append(hook('request_start', first=True))
+    config.on_dns_resolvehost_start.append(hook('dns_start'))
+    config.on_dns_resolvehost_end.append(hook('dns_end'))
+    config.on_connection_create_start.append(hook('connect_start'))
+    config.on_connection_create_end.append(hook('connect_end'))
+    config.on_request_end.append(hook('headers_end'))
+    config.freeze()
+    return config
+
+
+class HttpClientEngine:
+    def __init__(self, limit: int = 100, limit_per_host: int = 10, dns_ttl_s: int = 300,
+                 keepalive_timeout_s: float = 30, session_kwargs: dict = None,
+                 session_factory: Callable[[dict], ClientSession] = None, max_requests: int = 0,
+                 politeness: HostPoliteness = None, logger=loguru.logger):
+        """
+        Long-lived HTTP client shared by all checks of a poller. Pooled requests reuse keep-alive connections
+        and resolved addresses, cold requests open a new session (and connection) every time
+
+        :param limit: Total number of simultaneous connections in pool
+        :param limit_per_host: Number of simultaneous connections to the same endpoint
+        :param dns_ttl_s: How long resolved addresses are cached
+        :param keepalive_timeout_s: How long idle connection is kept open
+        :param session_kwargs: Args for session constructor, like headers, timeouts, auth and more
+        :param session_factory: Use it if you want to control session creation
+        :param max_requests: If set, no more than this number of requests (both pooled and cold) run at the same time
+        :param politeness: Per-host rate limit and backoff. Requests to backing off host raise HostBackoff
+        :param logger:
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl_s = dns_ttl_s
+        self.keepalive_timeout_s = keepalive_timeout_s
+        self.session_kwargs = dict(session_kwargs or {})
+        self.session_kwargs['trace_configs'] = [*self.session_kwargs.get('trace_configs', ()), timing_trace_config()]
+        self.session_factory = session_factory if session_factory else lambda kw: ClientSession(**kw)
+        self.logger = logger
+        self.requests_semaphore = asyncio.Semaphore(max_requests) if max_requests > 0 else None
+        self.politeness = politeness
+        self._session: Optional[ClientSession] = None
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        Pooled session. Created on first access, because connector requires running event loop
+        """
+        if self._session is None or self._session.closed:
+            kwargs = dict(self.session_kwargs)
+            kwargs.setdefault('connector', TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_ttl_s,
+                keepalive_timeout=self.keepalive_timeout_s
+            ))
+            self._session = self.session_factory(kwargs)
+            self.logger.debug('pooled http session created')
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, cold: bool = False, **kwargs) -> AsyncIterator[ClientResponse]:
+        """
+        Issues HTTP request and yields response
+
+        :param method: HTTP verb
+        :param url:
+        :param cold: use fresh session, so DNS lookup and TCP/TLS handshakes are part of every request
+        :param kwargs: any request kwargs, like proxy, headers or timeouts. Pass RequestTimings
+            as trace_request_ctx to get request phases timings
+        :raises HostBackoff: if host asked to back off
+        """
+        if self.politeness:
+            async with self.politeness.slot(url) as host:
+                async with self._limited_request(method, url, cold, **kwargs) as response:
+                    self.politeness.observe(host, response)
+                    yield response
+        else:
+            async with self._limited_request(method, url, cold, **kwargs) as response:
+                yield response
+
+    @asynccontextmanager
+    async def _limited_request(self, method: str, url: str, cold: bool, **kwargs) -> AsyncIterator[ClientResponse]:
+        if self.requests_semaphore:
+            await self.requests_semaphore.acquire()
+        IN_FLIGHT.inc()
+        try:
+            async with self._request(method, url, cold, **kwargs) as response:
+                yield response
+        finally:
+            IN_FLIGHT.dec()
+            if self.requests_semaphore:
+                self.requests_semaphore.release()
+
+    @asynccontextmanager
+    async def _request(self, method: str, url: str, cold: bool, **kwargs) -> AsyncIterator[ClientResponse]:
+        if cold:
+            async with self.session_factory(self.session_kwargs) as session:
+                async with session.request(method, url, **kwargs) as response:
+                    yield response
+        else:
+            async with self.session.request(method, url, **kwargs) as response:
+                yield response
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,47 @@
+import codecs
+import re
+from functools import lru_cache
+from typing import Pattern
+
+__all__ = ['StreamMatcher', 'compile_pattern']
+
+
+@lru_cache(maxsize=1024)
+def compile_pattern(pattern: str) -> Pattern:
+    """
+    Compiles pattern once for all checks of the site
+    :raises re.error: if pattern is invalid
+    """
+    return re.compile(pattern)
+
+
+class StreamMatcher:
+    def __init__(self, pattern: Pattern, encoding: str = 'utf-8', overlap: int = 4096):
+        """
+        Searches for pattern in text received by chunks. Tail of previous text is searched together with next chunk,
+        so matches crossing chunk border are found if they are not longer than overlap
+
+        :param pattern: compiled regular expression
+        :param encoding: text encoding. Unknown encodings are replaced with utf-8, undecodable bytes are replaced
+        :param overlap: number of characters of previous text to search together with next chunk
+        """
+        try:
+            decoder_factory = codecs.getincrementaldecoder(encoding)
+        except LookupError:
+            decoder_factory = codecs.getincrementaldecoder('utf-8')
+        self.decoder = decoder_factory(errors='replace')
+        self.pattern = pattern
+        self.overlap = overlap
+        self.tail = ''
+
+    def feed(self, chunk: bytes, final: bool = False) -> bool:
+        """
+        :param chunk: next part of body
+        :param final: True for the last chunk, flushes incomplete characters
+        :return: True if pattern is found
+        """
+        text = self.tail + self.decoder.decode(chunk, final)
+        if self.pattern.search(text):
+            return True
+        self.tail = text[-self.overlap:] if self.overlap else ''
+        return False
@@ -0,0 +1,130 @@
+import asyncio
+from collections import defaultdict, deque
+from typing import Dict, Iterable, Optional, Deque, Set
+
+import loguru
+from aiokafka import AIOKafkaConsumer, ConsumerRecord, ConsumerRebalanceListener, TopicPartition
+
+__all__ = ['OffsetTracker', 'CommitOnRebalance']
+
+
+class OffsetTracker:
+    def __init__(self, consumer: AIOKafkaConsumer, commit_interval_s: float = 5, commit_every: int = 1000,
+                 logger=loguru.logger):
+        """
+        Commits offsets of processed records for consumer without autocommit. Records can be processed in any order,
+        but for every partition only offset after the last record of contiguous processed sequence is committed,
+        so unprocessed records are received again after restart
+
+        :param consumer:
+        :param commit_interval_s: commit processed offsets with this interval
+        :param commit_every: also commit after this number of processed records
+        :param logger:
+        """
+        self.consumer = consumer
+        self.commit_interval_s = commit_interval_s
+        self.commit_every = commit_every
+        self.logger = logger
+        self.fetched: Dict[TopicPartition, Deque[int]] = defaultdict(deque)
+        self.processed: Dict[TopicPartition, Set[int]] = defaultdict(set)
+        self.committable: Dict[TopicPartition, int] = {}
+        self.committed: Dict[TopicPartition, int] = {}
+        self.processed_since_commit = 0
+        self._commit_lock = asyncio.Lock()
+        self._periodic: Optional[asyncio.Task] = None
+        self._pending_commit: Optional[asyncio.Task] = None
+
+    def track(self, record: ConsumerRecord):
+        """
+        Registers fetched record. Records of every partition must be tracked in offset order
+        """
+        self.fetched[TopicPartition(record.topic, record.partition)].append(record.offset)
+
+    def done(self, record: ConsumerRecord):
+        """
+        Marks record as processed
+        """
+        tp = TopicPartition(record.topic, record.partition)
+        fetched = self.fetched.get(tp)
+        if not fetched or record.offset < fetched[0]:  # partition was revoked while record was processed
+            return
+
+        processed = self.processed[tp]
+        processed.add(record.offset)
+        while fetched and fetched[0] in processed:
+            offset = fetched.popleft()
+            processed.discard(offset)
+            self.committable[tp] = offset + 1
+
+        self.processed_since_commit += 1
+        if self.processed_since_commit >= self.commit_every and not self._pending_commit:
+            self._pending_commit = asyncio.create_task(self.commit())
+            self._pending_commit.add_done_callback(self._commit_finished)
+
+    def _commit_finished(self, _: asyncio.Task):
+        self._pending_commit = None
+
+    async def commit(self, partitions: Iterable[TopicPartition] = None):
+        """
+        Commits offsets that were not committed yet
+
+        :param partitions: commit only these partitions
+        """
+        async with self._commit_lock:
+            partitions = set(partitions) if partitions is not None else None
+            offsets = {tp: offset for tp, offset in self.committable.items()
+                       if offset > self.committed.get(tp, -1) and (partitions is None or tp in partitions)}
+            if not offsets:
+                return
+
+            self.processed_since_commit = 0
+            try:
+                await self.consumer.commit(offsets)
+                self.committed.update(offsets)
+                self.logger.debug('committed offsets: {}', offsets)
+            except Exception:
+                self.logger.exception('error committing offsets {}', offsets)
+
+    def forget(self, partitions: Iterable[TopicPartition]):
+        """
+        Drops state of partitions, for example when they are revoked or assigned again
+        """
+        for tp in partitions:
+            for state in (self.fetched, self.processed, self.committable, self.committed):
+                state.pop(tp, None)
+
+    async def commit_periodically(self):
+        while True:
+            await asyncio.sleep(self.commit_interval_s)
+            await self.commit()
+
+    def start(self):
+        self._periodic = asyncio.create_task(self.commit_periodically())
+
+    async def close(self):
+        if self._periodic:
+            self._periodic.cancel()
+            self._periodic = None
+        await self.commit()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class CommitOnRebalance(ConsumerRebalanceListener):
+    """
+    Commits processed offsets of revoked partitions before they are assigned to another consumer
+    """
+    def __init__(self, tracker: OffsetTracker):
+        self.tracker = tracker
+
+    async def on_partitions_revoked(self, revoked):
+        await self.tracker.commit(revoked)
+        self.tracker.forget(revoked)
+
+    async def on_partitions_assigned(self, assigned):
+        self.tracker.forget(assigned)
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import loguru
+from aiohttp import ClientError, ClientResponse
+
+from common.metrics import REGISTRY
+
+__all__ = ['HostPoliteness', 'HostBackoff', 'parse_retry_after', 'BACKOFF_STATUSES']
+
+# statuses meaning that host asks to slow down
+BACKOFF_STATUSES = (429, 503)
+
+HOST_WAIT_SECONDS = REGISTRY.histogram('http_host_wait_seconds', 'Time request waits for per-host rate limit')
+HOST_BACKOFF_SKIPPED = REGISTRY.counter('http_host_backoff_skipped_total', 'Checks skipped while host backs off')
+
+
+class HostBackoff(ClientError):
+    """
+    Request was not sent, because host asked to back off
+    """
+
+
+def parse_retry_after(value: Optional[str], now: datetime = None) -> Optional[float]:
+    """
+    :param value: Retry-After header, delay in seconds or HTTP date
+    :return: delay in seconds, None if header is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - (now or datetime.now(timezone.utc))).total_seconds(), 0.0)
+
+
+class HostState:
+    """
+    Token bucket, concurrency limit and backoff of one host
+    """
+    __slots__ = ('tokens', 'updated', 'semaphore', 'backoff_until', 'failures')
+
+    def __init__(self, burst: float, concurrency: int):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.backoff_until = 0.0
+        self.failures = 0
+
+
+class HostPoliteness:
+    def __init__(self, rate: float = 0, burst: float = 1, concurrency: int = 0, base_backoff_s: float = 1,
+                 max_backoff_s: float = 600, logger=loguru.logger):
+        """
+        Limits requests to every host, so checks of many sites of one host don't hit it with bursts.
+        When host answers 429 or 503, its checks are skipped for Retry-After seconds, or, without the header,
+        for exponentially growing delay
+
+        :param rate: max requests per second to one host, 0 is unlimited
+        :param burst: number of requests that can be sent at once after host was idle
+        :param concurrency: max simultaneous requests to one host, 0 is unlimited
+        :param base_backoff_s: backoff after first 429/503 without Retry-After, doubled after every next one
+        :param max_backoff_s: max backoff, also caps Retry-After. 0 disables backoff
+        :param logger:
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.logger = logger
+        self.hosts: Dict[str, HostState] = {}
+
+    def state(self, host: str) -> HostState:
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.burst, self.concurrency)
+        return state
+
+    async def take_token(self, state: HostState):
+        """
+        Waits until host bucket has a token and takes it
+        """
+        while True:
+            now = time.monotonic()
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.tokens >= 1:
+                state.tokens -= 1
+                return
+            await asyncio.sleep((1 - state.tokens) / self.rate)
+
+    @staticmethod
+    def check_backoff(host: str, state: HostState):
+        remaining = state.backoff_until - time.monotonic()
+        if remaining > 0:
+            HOST_BACKOFF_SKIPPED.inc()
+            raise HostBackoff(f'host {host} backs off for {remaining:.1f}s')
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[HostState]:
+        """
+        Waits until request to URL host is allowed and holds host concurrency slot
+
+        :raises HostBackoff: if host backs off
+        """
+        host = urlsplit(url).hostname or ''
+        state = self.state(host)
+        self.check_backoff(host, state)
+
+        started = time.perf_counter()
+        if state.semaphore:
+            await state.semaphore.acquire()
+        try:
+            if self.rate > 0:
+                await self.take_token(state)
+            self.check_backoff(host, state)  # host could answer 429 to request sent while this one waited
+            HOST_WAIT_SECONDS.observe(time.perf_counter() - started)
+            yield state
+        finally:
+            if state.semaphore:
+                state.semaphore.release()
+
+    def observe(self, state: HostState, response: ClientResponse):
+        """
+        Starts or resets host backoff by response status
+        """
+        if response.status not in BACKOFF_STATUSES:
+            state.failures = 0
+            return
+        if not self.max_backoff_s:
+            return
+        delay = parse_retry_after(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = self.base_backoff_s * 2 ** state.failures
+        delay = min(delay, self.max_backoff_s)
+        state.failures = min(state.failures + 1, 30)
+        state.backoff_until = max(state.backoff_until, time.monotonic() + delay)
+        self.logger.warning('{} answered {}, backing off for {:.1f}s', response.url.host, response.status, delay)
@@ -0,0 +1,85 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Hashable, Optional
+
+__all__ = ['BoundedQueue', 'OVERLOAD_POLICIES']
+
+OVERLOAD_POLICIES = ('block', 'coalesce', 'skip')
+
+
+def task_url(task: Any) -> Optional[str]:
+    return task.get('url') if isinstance(task, dict) else None
+
+
+class BoundedQueue(asyncio.Queue):
+    def __init__(self, maxsize: int = 0, policy: str = 'block', key: Callable[[Any], Hashable] = task_url):
+        """
+        Queue with limited size and configurable behaviour when it's full
+
+        :param maxsize: max number of items, 0 is unlimited
+        :param policy: what to do with new items when queue is full:
+            block - wait for free slot;
+            coalesce - replace pending item with the same key (item for the same URL waits until fresher item
+            is taken), wait for free slot if there is no such item;
+            skip - drop new item
+        :param key: key of item for coalesce policy. Items with None key are never coalesced
+        """
+        assert policy in OVERLOAD_POLICIES, f'unknown overload policy {policy}'
+        self.policy = policy
+        self.key = key
+        self.coalesced = 0
+        self.skipped = 0
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = deque()
+        self._pending = {}  # for coalesce policy: queue keeps keys, items are stored here
+
+    def _put(self, item):
+        if self.policy != 'coalesce':
+            self._queue.append(item)
+            return
+
+        key = self.key(item)
+        if key is None:
+            key = object()
+        self._queue.append(key)
+        self._pending[key] = item
+
+    def _get(self):
+        item = self._queue.popleft()
+        return self._pending.pop(item) if self.policy == 'coalesce' else item
+
+    def _drop(self, item) -> bool:
+        """
+        Replaces pending item with the same key, or drops item when queue is full, depending on policy.
+        Done before base class puts item, so dropped items don't count as unfinished tasks of join
+
+        :return: whether item must not be added
+        """
+        if self.policy == 'coalesce':
+            key = self.key(item)
+            if key is not None and key in self._pending:
+                self._pending[key] = item
+                self.coalesced += 1
+                return True
+        elif self.policy == 'skip' and self.full():
+            self.skipped += 1
+            return True
+        return False
+
+    def put_nowait(self, item):
+        if not self._drop(item):
+            super().put_nowait(item)
+
+    async def put(self, item):
+        # base class calls put_nowait after waiting for free slot, it coalesces with items added meanwhile
+        if not self._drop(item):
+            await super().put(item)
+
+    @property
+    def dropped(self) -> int:
+        return self.coalesced + self.skipped
+
+    def stats(self) -> dict:
+        return {'depth': self.qsize(), 'maxsize': self.maxsize, 'coalesced': self.coalesced, 'skipped': self.skipped}
@@ -1,13 +1,22 @@
 import asyncio
+import heapq
+import random
+from contextlib import suppress
 from datetime import datetime
-from typing import Any, Callable, Awaitable
+from itertools import count
+from typing import Any, Callable, Awaitable, List, Optional, Set, Tuple
 
 import loguru
 from dateutil.relativedelta import relativedelta
 
 from abstractions import Scheduler
+from common.log import MessageLog
+from common.metrics import REGISTRY
 
-__all__ = ['SimpleScheduler']
+__all__ = ['SimpleScheduler', 'HeapScheduler', 'ScheduledJob']
+
+SCHEDULER_DRIFT = REGISTRY.histogram('scheduler_drift_seconds', 'Delay of scheduled call from its planned time',
+                                     ('scheduler',))
 
 
 class SimpleScheduler(Scheduler):
@@ -16,23 +25,42 @@ class SimpleScheduler(Scheduler):
     """
     def __init__(self, logger=loguru.logger):
         self.logger = logger
+        self.calls_log = MessageLog('DEBUG', logger=logger)
+        self.drift = SCHEDULER_DRIFT.labels('simple')
+        self.tasks: Set[asyncio.Task] = set()
 
-    def schedule(self, async_callback: Callable[[Any], Awaitable[str]], interval: dict, *args, **kwargs):
+    def schedule(self, async_callback: Callable[[Any], Awaitable[str]], interval: dict, *args,
+                 offset_s: float = None, **kwargs) -> asyncio.Task:
         """
         :param async_callback: Function to call to call
         :param interval: dateutil.relativedelta constructor arguments
         :param args: function args
+        :param offset_s: delay of the first call, by default function is called right away
         :param kwargs: function kwargs
-        :return:
+        :return: background task calling the function
         """
-        asyncio.create_task(self.loop(async_callback, interval, *args, **kwargs))
+        task = asyncio.create_task(self.loop(async_callback, interval, *args, offset_s=offset_s, **kwargs))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def cancel(self, handle: asyncio.Task):
+        handle.cancel()
+
+    async def close(self):
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     @loguru.logger.catch
-    async def loop(self, async_callback, interval_kwargs, *args, **kwargs):
+    async def loop(self, async_callback, interval_kwargs, *args, offset_s: float = None, **kwargs):
         async def callback():
-            self.logger.debug('calling callback function')
+            self.calls_log('calling callback function')
             await async_callback(*args, **kwargs)
 
+        if offset_s:
+            await asyncio.sleep(offset_s)
         previous_call = datetime.now()
         await callback()
 
@@ -46,4 +74,160 @@ class SimpleScheduler(Scheduler):
 
             pause = (next_call - now).total_seconds()
             await asyncio.sleep(pause)
+            self.drift.observe((datetime.now() - next_call).total_seconds())
             await callback()
+
+
+def interval_seconds(interval: dict) -> float:
+    """
+    Converts dateutil.relativedelta constructor arguments to seconds, counting from current moment
+    """
+    now = datetime.now()
+    return (now + relativedelta(**interval) - now).total_seconds()
+
+
+def wake_up(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ScheduledJob:
+    """
+    Scheduled callback. Kept in scheduler heap until cancelled
+    """
+    __slots__ = ('callback', 'args', 'kwargs', 'interval_s', 'when', 'cancelled')
+
+    def __init__(self, callback: Callable[..., Awaitable], args: tuple, kwargs: dict, interval_s: float, when: float):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.interval_s = interval_s
+        self.when = when
+        self.cancelled = False
+
+
+class HeapScheduler(Scheduler):
+    def __init__(self, jitter: float = 1.0, logger=loguru.logger):
+        """
+        Keeps all scheduled callbacks in one min-heap ordered by next call time, and calls them from single
+        background task. Uses event loop monotonic clock, so wall clock changes don't affect intervals
+
+        :param jitter: first call is delayed by random part of interval, up to jitter * interval.
+            Spreads calls of sites with the same interval. 0 calls everything right after scheduling
+        :param logger:
+        """
+        self.jitter = jitter
+        self.logger = logger
+        self.calls_log = MessageLog('DEBUG', logger=logger)
+        self.drift = SCHEDULER_DRIFT.labels('heap')
+        self.heap: List[Tuple[float, int, ScheduledJob]] = []
+        self.cancelled = 0
+        self._sequence = count()
+        self._driver: Optional[asyncio.Task] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._running: Optional[ScheduledJob] = None
+
+    def schedule(self, async_callback: Callable[..., Awaitable], interval: dict, *args, offset_s: float = None,
+                 **kwargs) -> ScheduledJob:
+        """
+        :param async_callback: Function to call
+        :param interval: dateutil.relativedelta constructor arguments
+        :param args: function args
+        :param offset_s: delay of the first call, by default random part of interval, see jitter
+        :param kwargs: function kwargs
+        :return: job handle
+        """
+        loop = asyncio.get_running_loop()
+        interval_s = interval_seconds(interval)
+        if offset_s is None:
+            offset_s = random.uniform(0, self.jitter * interval_s)
+        job = ScheduledJob(async_callback, args, kwargs, interval_s, loop.time() + offset_s)
+        self._push(job)
+
+        if self._driver is None or self._driver.done():
+            self._driver = asyncio.create_task(self.drive())
+        return job
+
+    def cancel(self, handle: ScheduledJob):
+        """
+        Marks job as cancelled. It is removed from heap when reaches the top, or when cancelled jobs take
+        more than half of heap
+        """
+        if handle.cancelled:
+            return
+        handle.cancelled = True
+        if handle is self._running:  # not in heap now, won't be put back
+            return
+        self.cancelled += 1
+        if self.cancelled > len(self.heap) // 2:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def __len__(self) -> int:
+        return len(self.heap) - self.cancelled
+
+    async def close(self):
+        """
+        Drops all jobs, cancels driver task and waits for it. Callback being called is cancelled too
+        """
+        self.heap, self.cancelled = [], 0
+        driver, self._driver = self._driver, None
+        if driver is not None:
+            driver.cancel()
+            with suppress(asyncio.CancelledError):
+                await driver
+
+    def _push(self, job: ScheduledJob):
+        heapq.heappush(self.heap, (job.when, next(self._sequence), job))
+        if self.heap[0][2] is job and self._waiter:
+            wake_up(self._waiter)  # driver has to sleep until new earliest job
+
+    def _pop_cancelled(self):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+
+    async def drive(self):
+        """
+        Sleeps until the earliest job, calls it and puts it back with next call time
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._pop_cancelled()
+            if self.heap and self.heap[0][0] <= loop.time():
+                _, _, job = heapq.heappop(self.heap)
+                self.drift.observe(loop.time() - job.when)
+                self._running = job
+                await self.call(job)
+                self._running = None
+                if not job.cancelled:
+                    job.when = self.next_call(job, loop.time())
+                    self._push(job)
+                continue
+
+            self._waiter = loop.create_future()
+            timer = loop.call_at(self.heap[0][0], wake_up, self._waiter) if self.heap else None
+            try:
+                await self._waiter
+            finally:
+                if timer:
+                    timer.cancel()
+                self._waiter = None
+
+    async def call(self, job: ScheduledJob):
+        try:
+            self.calls_log('calling callback function')
+            await job.callback(*job.args, **job.kwargs)
+        except Exception:
+            self.logger.exception('scheduled callback failed')
+
+    @staticmethod
+    def next_call(job: ScheduledJob, now: float) -> float:
+        """
+        Next call time keeping the job phase. Skips calls missed while scheduler was busy
+        """
+        next_call = job.when + job.interval_s
+        if next_call <= now:
+            next_call += ((now - next_call) // job.interval_s + 1) * job.interval_s
+        return next_call
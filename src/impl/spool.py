@@ -0,0 +1,181 @@
+import asyncio
+import os
+import struct
+import zlib
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+import loguru
+
+from common.metrics import REGISTRY
+from common.serializer import Serde
+
+__all__ = ['DiskSpool']
+
+SPOOL_BYTES = REGISTRY.gauge('spool_bytes', 'Size of spool segments on disk')
+SPOOL_WRITTEN = REGISTRY.counter('spool_written_total', 'Messages written to spool')
+SPOOL_DROPPED = REGISTRY.counter('spool_dropped_total', 'Spooled messages dropped to keep spool size limit')
+
+# record is length and crc32 of payload followed by payload
+RECORD_HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.spool'
+
+
+def segment_name(sequence: int) -> str:
+    return f'{sequence:020d}{SEGMENT_SUFFIX}'
+
+
+def read_records(path: str, serde: Serde) -> Tuple[List[dict], bool]:
+    """
+    Reads records of segment file. Reading stops at incomplete or corrupted record, which is left by
+    interrupted write
+
+    :return: records and whether whole file was read
+    """
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    records, position = [], 0
+    while position + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, position)
+        start, end = position + RECORD_HEADER.size, position + RECORD_HEADER.size + length
+        payload = data[start:end]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return records, False
+        records.append(serde.deserialize(payload))
+        position = end
+    return records, position == len(data)
+
+
+class DiskSpool:
+    def __init__(self, directory: str, max_bytes: int = 1024 ** 3, segment_bytes: int = 16 * 1024 ** 2,
+                 buffer_bytes: int = 64 * 1024, serde: Serde = None, logger=loguru.logger):
+        """
+        Append-only log of messages on disk, split into segment files. Messages are written to the newest segment
+        through a buffer, and read back by whole segments, oldest first. Segments left by previous run are
+        read too. Written messages reach disk on flush, segment rotation or close
+
+        :param directory: directory for segment files, created if missing
+        :param max_bytes: max size of all segments. When it is exceeded, oldest segments are dropped
+        :param segment_bytes: segment is closed and new one is started after this size
+        :param buffer_bytes: write buffer size
+        :param serde: messages serializer
+        :param logger:
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.buffer_bytes = buffer_bytes
+        assert segment_bytes <= max_bytes, 'segment must fit into spool size limit'
+        self.serde = serde or Serde()
+        self.logger = logger
+        # [sequence, size, records] of closed segments, oldest first. Records count is unknown for old segments
+        self.closed: Deque[list] = deque()
+        self.closed_bytes = 0
+        self.active_sequence = 0
+        self.active_size = 0
+        self.active_records = 0
+        self._file = None
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                sequence = int(name[:-len(SEGMENT_SUFFIX)])
+                self.closed.append([sequence, os.path.getsize(self.path(sequence)), None])
+                self.closed_bytes += self.closed[-1][1]
+                self.active_sequence = sequence + 1
+        if self.closed:
+            self.logger.info('spool has {} segments, {} bytes', len(self.closed), self.size_bytes)
+        SPOOL_BYTES.set(self.size_bytes)
+
+    def path(self, sequence: int) -> str:
+        return os.path.join(self.directory, segment_name(sequence))
+
+    @property
+    def size_bytes(self) -> int:
+        return self.closed_bytes + self.active_size
+
+    def __bool__(self) -> bool:
+        return bool(self.closed) or self.active_records > 0
+
+    def append(self, message: dict):
+        """
+        Writes message to buffer of active segment
+        """
+        payload = self.serde.serialize(message)
+        if self._file is None:
+            self._file = open(self.path(self.active_sequence), 'ab', buffering=self.buffer_bytes)
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self.active_size += RECORD_HEADER.size + len(payload)
+        self.active_records += 1
+        SPOOL_WRITTEN.inc()
+
+        if self.active_size >= self.segment_bytes:
+            self.rotate()
+        while self.size_bytes > self.max_bytes and self.closed:
+            self.drop_oldest()
+        SPOOL_BYTES.set(self.size_bytes)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def rotate(self):
+        """
+        Closes active segment, next message starts new one
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self.closed.append([self.active_sequence, self.active_size, self.active_records])
+        self.closed_bytes += self.active_size
+        self.active_sequence += 1
+        self.active_size = self.active_records = 0
+
+    def drop_oldest(self):
+        sequence, size, records = self.closed.popleft()
+        self.closed_bytes -= size
+        self.remove_file(sequence)
+        if records:
+            SPOOL_DROPPED.inc(records)
+        self.logger.error('spool size limit {} bytes exceeded, dropped segment {} with {} messages',
+                          self.max_bytes, sequence, 'unknown number of' if records is None else records)
+
+    def remove_file(self, sequence: int):
+        try:
+            os.remove(self.path(sequence))
+        except FileNotFoundError:
+            pass
+
+    async def oldest(self) -> Optional[Tuple[int, List[dict]]]:
+        """
+        Reads oldest segment in a thread. Active segment is closed first when there are no others
+
+        :return: segment sequence and its messages, None if spool is empty
+        """
+        if not self.closed:
+            if not self.active_records:
+                return None
+            self.rotate()
+        sequence = self.closed[0][0]
+        records, complete = await asyncio.get_running_loop().run_in_executor(
+            None, read_records, self.path(sequence), self.serde)
+        if not complete:
+            self.logger.warning('spool segment {} has incomplete record at the end, it is skipped', sequence)
+        return sequence, records
+
+    def remove(self, sequence: int):
+        """
+        Removes segment after its messages are delivered
+        """
+        self.remove_file(sequence)
+        if self.closed and self.closed[0][0] == sequence:
+            self.closed_bytes -= self.closed.popleft()[1]
+        SPOOL_BYTES.set(self.size_bytes)
+
+    def close(self):
+        """
+        Closes active segment, so buffered messages are written
+        """
+        self.rotate()
@@ -1,11 +1,13 @@
 import asyncio
+from typing import List
 
-from aiokafka import AIOKafkaConsumer
+from aiokafka import AIOKafkaConsumer, ConsumerRecord
 
 from abstractions import TaskProvider
+from impl.offsets import OffsetTracker
 
 
-__all__ = ['QueueTaskProvider', 'KafkaTaskProvider']
+__all__ = ['QueueTaskProvider', 'KafkaTaskProvider', 'KafkaBatchTaskProvider']
 
 
 class QueueTaskProvider(TaskProvider):
@@ -26,14 +28,51 @@ class KafkaTaskProvider(TaskProvider):
     """
     Provides tasks from kafka. Used by consumer
     """
-    def __init__(self, consumer: AIOKafkaConsumer):
+    def __init__(self, consumer: AIOKafkaConsumer, tracker: OffsetTracker = None):
+        """
+        :param consumer:
+        :param tracker: if set, every fetched record is registered in it
+        """
         self.consumer = consumer
+        self.tracker = tracker
 
-    async def get(self) -> dict:
-        return await self.consumer.getone()
+    async def get(self) -> ConsumerRecord:
+        record = await self.consumer.getone()
+        if self.tracker:
+            self.tracker.track(record)
+        return record
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.consumer.stop()
+
+
+class KafkaBatchTaskProvider(KafkaTaskProvider):
+    """
+    Provides batches of records fetched from kafka at once. Records of every partition go in offset order
+    """
+    batched = True
+
+    def __init__(self, consumer: AIOKafkaConsumer, timeout_ms: int = 1000, max_records: int = 500,
+                 tracker: OffsetTracker = None):
+        """
+        :param consumer:
+        :param timeout_ms: how long to wait for records if none are available
+        :param max_records: max batch size
+        :param tracker: if set, every fetched record is registered in it
+        """
+        super().__init__(consumer, tracker)
+        self.timeout_ms = timeout_ms
+        self.max_records = max_records
+
+    async def get(self) -> List[ConsumerRecord]:
+        while True:
+            partitions = await self.consumer.getmany(timeout_ms=self.timeout_ms, max_records=self.max_records)
+            if partitions:
+                batch = [record for records in partitions.values() for record in records]
+                if self.tracker:
+                    for record in batch:
+                        self.tracker.track(record)
+                return batch
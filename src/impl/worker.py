@@ -1,19 +1,45 @@
+import asyncio
+import hashlib
 import re
-from datetime import datetime, timezone
-from typing import Any, Callable
+import time
+from functools import partial
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Pattern, Tuple
 
 import loguru
-from aiohttp import ClientSession, ClientError
+from aiohttp import ClientSession, ClientError, ClientConnectionError, ClientResponse
 from aiokafka import AIOKafkaProducer, ConsumerRecord
 
 from abstractions import Worker
+from common.check import CheckResult
+from common.log import MessageLog, log_errors
+from common.metrics import REGISTRY
 from db import Repository
+from db.database import LruCache
+from impl.http_client import HttpClientEngine, RequestTimings
+from impl.politeness import HostBackoff
+from impl.spool import DiskSpool
+from impl.matching import StreamMatcher, compile_pattern
 
-__all__ = ['KafkaPublisher', 'AsyncSitePoller', 'DbWriter']
+__all__ = ['KafkaPublisher', 'AsyncSitePoller', 'DbWriter', 'BatchDbWriter', 'FanOut', 'CHECK_MODES']
+
+# full - request with configured method, body is read if there is a pattern; head - HEAD request, body and pattern
+# are ignored; range - only first bytes of body are requested; conditional - request with validators of previous
+# response, unchanged body is not downloaded or matched again
+CHECK_MODES = ('full', 'head', 'range', 'conditional')
+
+KAFKA_SEND_SECONDS = REGISTRY.histogram('kafka_send_seconds', 'Time to add message to producer batch')
+KAFKA_ACK_SECONDS = REGISTRY.histogram('kafka_ack_seconds', 'Time from sending message to broker ack')
+KAFKA_DELIVERY_ERRORS = REGISTRY.counter('kafka_delivery_errors_total', 'Messages not acked by broker')
+KAFKA_IN_FLIGHT = REGISTRY.gauge('kafka_messages_in_flight', 'Messages sent without ack yet')
+SPOOL_REPLAYED = REGISTRY.counter('spool_replayed_total', 'Spooled messages delivered to Kafka')
 
 
 class KafkaPublisher(Worker):
-    def __init__(self, producer: AIOKafkaProducer, topic_success: str, topic_failure: str, logger=loguru.logger):
+    def __init__(self, producer: AIOKafkaProducer, topic_success: str, topic_failure: str, logger=loguru.logger,
+                 max_in_flight: int = 0, delivery_callback: Callable[[dict, Exception], None] = None,
+                 spool: DiskSpool = None, spool_latency_s: float = 0, replay_batch_size: int = 500,
+                 replay_interval_s: float = 1):
         """
         Publishes json messages to one of given topics
 
@@ -21,13 +47,39 @@ class KafkaPublisher(Worker):
         :param topic_success: Topic name for messages about successful requests
         :param topic_failure: Topic name for messages about failed requests
         :param logger:
+        :param max_in_flight: If set, messages are published without waiting for ack, but no more than this number
+            of messages can wait for ack at the same time
+        :param delivery_callback: Called with message and error when pipelined message is not delivered
+        :param spool: If set, messages are written to it when publishing fails or acks are slow, and sent from it
+            in background once Kafka recovers. Until spool is empty, all messages go through it, keeping their order
+        :param spool_latency_s: Ack latency which switches publishing to spool, 0 means only errors do
+        :param replay_batch_size: Number of spooled messages sent before waiting for their acks
+        :param replay_interval_s: How often spool is flushed and replay is attempted
         """
         self.producer = producer
         self.topic_success = topic_success
         self.topic_failure = topic_failure
         self.logger = logger
+        self.window = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+        self.delivery_callback = delivery_callback or self.log_delivery_error
+        self.published_log = MessageLog('DEBUG', logger=logger)
+        self.sent_log = MessageLog('INFO', logger=logger)
+        self.spool = spool
+        self.spool_latency_s = spool_latency_s
+        self.replay_batch_size = replay_batch_size
+        self.replay_interval_s = replay_interval_s
+        self.spooling = bool(spool)  # messages left by previous run are sent first
+        # pipelined messages waiting for ack, by send order. With spool, all of them are spooled on first failure
+        self.in_flight: Dict[int, dict] = {}
+        self._sequence = count()
+        self.replay_position: Optional[Tuple[int, int]] = None
+        self.spooled_log = MessageLog('DEBUG', logger=logger)
+        self._replay_task: Optional[asyncio.Task] = None
 
-    @loguru.logger.catch
+    def topic(self, task: dict) -> str:
+        return self.topic_success if task['success'] else self.topic_failure
+
+    @log_errors
     async def process(self, task: dict) -> Any:
         """
         Publishes response information to one of Kafka topics depending on 'success' field value
@@ -35,123 +87,611 @@ class KafkaPublisher(Worker):
         :param task: Response information from AsyncSitePoller
         :return: None
         """
-        topic = self.topic_success if task['success'] else self.topic_failure
-        pub_result = await self.producer.send_and_wait(topic, task)
-        self.logger.debug('published: {}', pub_result)
-        self.logger.info('message sent: {}', task)
+        if self.spooling:
+            self.spooled_log('message spooled: {}', task)
+            self.spool.append(task)
+            return
+
+        topic = self.topic(task)
+        started = time.perf_counter()
+        try:
+            if self.window:
+                await self.send(topic, task)
+                return
+            KAFKA_IN_FLIGHT.inc()
+            try:
+                pub_result = await self.producer.send_and_wait(topic, task)
+            except Exception:
+                KAFKA_DELIVERY_ERRORS.inc()
+                raise
+            finally:
+                KAFKA_IN_FLIGHT.dec()
+        except Exception as e:
+            if self.spool is None:
+                raise
+            self.start_spooling(repr(e))
+            self.spool.append(task)
+            return
+        self.on_ack(time.perf_counter() - started)
+        self.published_log('published: {}', pub_result)
+        self.sent_log('message sent: {}', task)
+
+    async def send(self, topic: str, task: dict):
+        """
+        Adds message to producer batch and returns without waiting for ack. Waits only if in-flight window is full
+        """
+        await self.window.acquire()
+        started = time.perf_counter()
+        try:
+            delivery = await self.producer.send(topic, task)
+        except Exception:
+            self.window.release()
+            KAFKA_DELIVERY_ERRORS.inc()
+            raise
+        KAFKA_SEND_SECONDS.observe(time.perf_counter() - started)
+        KAFKA_IN_FLIGHT.inc()
+        sequence = next(self._sequence)
+        self.in_flight[sequence] = task
+        delivery.add_done_callback(partial(self.on_delivery, sequence, task, started))
+
+    def on_delivery(self, sequence: int, task: dict, started: float, delivery: asyncio.Future):
+        self.window.release()
+        KAFKA_IN_FLIGHT.dec()
+        spooled = self.in_flight.pop(sequence, None) is None
+        if delivery.cancelled() or delivery.exception():
+            KAFKA_DELIVERY_ERRORS.inc()
+            error = asyncio.CancelledError() if delivery.cancelled() else delivery.exception()
+            if self.spool is None:
+                self.delivery_callback(task, error)
+            elif not spooled:
+                self.start_spooling(repr(error))
+                self.spool_in_flight(sequence, task)
+        elif not spooled:  # ack of spooled message means it will be delivered twice, it's not counted
+            self.on_ack(time.perf_counter() - started)
+            self.published_log('published: {}', delivery.result())
+
+    def spool_in_flight(self, sequence: int, task: dict):
+        """
+        Spools failed message together with all messages still waiting for ack, in order they were sent,
+        so spool replay doesn't put failed message after later checks of the same site
+        """
+        self.in_flight[sequence] = task
+        for _, message in sorted(self.in_flight.items()):
+            self.spool.append(message)
+        self.in_flight.clear()
+
+    def on_ack(self, latency_s: float):
+        KAFKA_ACK_SECONDS.observe(latency_s)
+        if self.spool is not None and self.spool_latency_s and latency_s > self.spool_latency_s:
+            self.start_spooling(f'ack took {latency_s:.1f}s')
+
+    def log_delivery_error(self, task: dict, error: Exception):
+        self.logger.error('message not delivered: {} - {!r}', task, error)
+
+    def start_spooling(self, reason: str):
+        if not self.spooling:
+            self.spooling = True
+            self.logger.warning('publishing to spool: {}', reason)
+
+    async def replay_spool(self):
+        """
+        Background task flushing spool and sending spooled messages when spooling
+        """
+        while True:
+            await asyncio.sleep(self.replay_interval_s)
+            self.spool.flush()
+            if not self.spooling:
+                continue
+            try:
+                await self.replay()
+            except Exception as e:
+                self.logger.warning('spool replay failed, {} bytes left: {!r}', self.spool.size_bytes, e)
+
+    async def replay(self):
+        """
+        Sends spooled messages by batches, oldest first. Segment is removed when all its messages are acked.
+        Publishing goes back to Kafka when spool is empty. Batch that failed is sent again, so
+        some of its messages can be delivered twice
+        """
+        while True:
+            segment = await self.spool.oldest()
+            if segment is None:
+                self.spooling = False
+                self.logger.info('spool replayed, publishing to Kafka')
+                return
+            sequence, messages = segment
+            first = self.replay_position[1] if self.replay_position and self.replay_position[0] == sequence else 0
+            for start in range(first, len(messages), self.replay_batch_size):
+                self.replay_position = (sequence, start)
+                batch = messages[start:start + self.replay_batch_size]
+                deliveries = [await self.producer.send(self.topic(task), task) for task in batch]
+                await asyncio.gather(*deliveries)
+                SPOOL_REPLAYED.inc(len(batch))
+            self.spool.remove(sequence)
+            self.replay_position = None
 
     async def __aenter__(self):
+        if self.spool is not None:
+            self._replay_task = asyncio.create_task(self.replay_spool())
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._replay_task:
+            self._replay_task.cancel()
+        if self.spool is not None:
+            self.spool.close()
         await self.producer.stop()
 
 
+def with_headers(request_kwargs: dict, headers: dict) -> dict:
+    """
+    Copy of request kwargs with headers added to task headers
+    """
+    return {**request_kwargs, 'headers': {**request_kwargs.get('headers', {}), **headers}}
+
+
+class Validators:
+    """
+    What is known about previous response of a site in conditional mode
+    """
+    __slots__ = ('etag', 'last_modified', 'body_hash', 'match')
+
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], body_hash: Optional[bytes] = None,
+                 match: Optional[bool] = None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        self.match = match
+
+    def headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
 class AsyncSitePoller(Worker):
-    def __init__(self, session_kwargs: dict = None, session_factory: Callable[[dict], ClientSession] = None, 
-        logger=loguru.logger):
+    def __init__(self, session_kwargs: dict = None, session_factory: Callable[[dict], ClientSession] = None,
+                 logger=loguru.logger, engine: HttpClientEngine = None, max_body_bytes: int = 0,
+                 chunk_size: int = 64 * 1024, match_overlap: int = 4096, range_bytes: int = 64 * 1024,
+                 validators_cache_size: int = 100_000, drain_bytes: int = 64 * 1024):
         """
         Can poll urls with big variety of options
 
         :param session_kwargs: Args for session constructor, like headers, timeouts, auth and more
         :param session_factory: Use it if you want to control session creation
         :param logger:
+        :param engine: Pooled HTTP client. If not set, one with default limits is created from session args
+        :param max_body_bytes: Stop reading body after this number of bytes, 0 is unlimited. Can be set for task
+        :param chunk_size: Body is read and matched by chunks of this size
+        :param match_overlap: Max length of pattern match that can cross chunks border
+        :param range_bytes: Number of bytes requested in range mode, if task has no max_body_bytes
+        :param validators_cache_size: Max number of sites which previous responses are remembered in conditional mode
+        :param drain_bytes: Unread rest of body up to this size is read after check, so connection is returned to
+            keep-alive pool. Connection with longer rest is closed. 0 never reads the rest
         """
-        self.session_kwargs = session_kwargs or {}
-        self.session_factory = session_factory if session_factory else lambda kw: ClientSession(**kw)
+        self.engine = engine or HttpClientEngine(session_kwargs=session_kwargs, session_factory=session_factory,
+                                                 logger=logger)
         self.logger = logger
+        self.max_body_bytes = max_body_bytes
+        self.chunk_size = chunk_size
+        self.match_overlap = match_overlap
+        self.range_bytes = range_bytes
+        self.validators = LruCache(validators_cache_size)
+        self.drain_bytes = drain_bytes
+        self.skipped_log = MessageLog('DEBUG', logger=logger)
 
-    @loguru.logger.catch
+    @log_errors
     async def process(self, task: dict) -> Any:
         """
         Issues HTTP requests and returns data about operation result
 
-        :param task: must have 'url' key, can have 'pattern'
-        :return: Info about response time or error description
+        :param task: must have 'url' key, can have 'pattern', 'method', 'check', 'cold', 'max_body_bytes'
+            and 'request_kwargs'
+        :return: Info about response time or error description. None if check was skipped, because host backs off
         """
         assert 'url' in task, 'Site poller requires url to fetch data from'
         url = task['url']
         method = task.get('method', 'GET')
-        pattern = task.get('pattern')
+        check = task.get('check') or 'full'
+        assert check in CHECK_MODES, f'unknown check mode {check}'
+        pattern = task.get('pattern') if check != 'head' else None
+        cold = task.get('cold', False)
+        max_body_bytes = task.get('max_body_bytes')
+        if max_body_bytes is None:
+            max_body_bytes = self.max_body_bytes
         request_kwargs = task.get('request_kwargs', {})
 
-        data = await self.request(method, url, **request_kwargs)
-        data['url'] = url
-        if pattern and data['success']:
+        compiled = None
+        if pattern:
             try:
-                data['match'] = bool(re.search(pattern, data['text']))
-                data['pattern'] = pattern
+                compiled = compile_pattern(pattern)
             except re.error as e:
                 self.logger.error('error matching text with pattern {}: {}', pattern, e)
-        if 'text' in data:
-            del data['text']
-        return data
 
-    async def request(self, method: str, url: str, **kwargs) -> dict:
+        if check == 'head':
+            method = 'HEAD'
+        elif check == 'range':
+            max_body_bytes = max_body_bytes or self.range_bytes
+            request_kwargs = with_headers(request_kwargs, {'Range': f'bytes=0-{max_body_bytes - 1}'})
+        elif check == 'conditional':
+            return await self.conditional_check(method, url, cold, pattern, compiled, max_body_bytes, request_kwargs)
+
+        result = await self.request(method, url, cold=cold, pattern=compiled, max_body_bytes=max_body_bytes,
+                                    **request_kwargs)
+        if compiled and result is not None and result.success:
+            result.pattern = pattern
+        return result
+
+    async def conditional_check(self, method: str, url: str, cold: bool, pattern: Optional[str],
+                                compiled: Optional[Pattern], max_body_bytes: int,
+                                request_kwargs: dict) -> Optional[CheckResult]:
+        """
+        Sends validators of previous response of the site. On 304 previous match result is reused.
+        On new body, pattern is matched only if body hash differs from previous one
+        """
+        key = (url, pattern)
+        cached: Optional[Validators] = self.validators.get(key)
+        if cached:
+            request_kwargs = with_headers(request_kwargs, cached.headers())
+
+        result = await self.request(method, url, cold=cold, pattern=compiled, max_body_bytes=max_body_bytes,
+                                    conditional=True, cached=cached, **request_kwargs)
+        if result is None:
+            return None
+        if compiled and result.success and result.match is not None:
+            result.pattern = pattern
+
+        if result.validators:
+            self.validators.put(key, result.validators)
+            result.validators = None
+        return result
+
+    async def request(self, method: str, url: str, cold: bool = False, pattern: Pattern = None,
+                      max_body_bytes: int = 0, conditional: bool = False, cached: Validators = None,
+                      **kwargs) -> Optional[CheckResult]:
         """
         Issues HTTP requests to target URL. Only handles aiohttp errors
 
         :param method: HTTP verb
         :param url:
+        :param cold: do not reuse pooled connections, measure time with DNS lookup and handshakes
+        :param pattern: if set, body is searched for it. Otherwise body is not read
+        :param max_body_bytes: stop reading body after this number of bytes, 0 is unlimited
+        :param conditional: result has validators of response to cache, see read_conditional
+        :param cached: validators of previous response in conditional mode
         :param kwargs: any request kwargs, like proxy, headers or timeouts
-        :return:
+        :return: check result with response time (to response headers) and request phases: dns_s, connect_s,
+            ttfb_s and transfer_s of body, see RequestTimings.durations. None if request was not sent, because host
+            backs off
         """
-        started = datetime.now(timezone.utc).astimezone()
+        started_ns = time.time_ns()
+        timings, request_start = RequestTimings(), time.perf_counter_ns()
 
-        async with self.session_factory(self.session_kwargs) as session:
-            try:
-                async with session.request(method, url, **kwargs) as response:
-                    ended = datetime.now(timezone.utc).astimezone()
-                    text = await response.text()
-                    status = response.status
-
-                    return {
-                        'started': started.isoformat(),
-                        'ended': ended.isoformat(),
-                        'response_time_s': (ended - started).total_seconds(),
-                        'text': text,
-                        'status': status,
-                        'success': True
-                    }
-            except ClientError as e:
-                self.logger.exception('error requesting url {}', url)
-                return {
-                    'started': started.isoformat(),
-                    'success': False,
-                    'error_type': str(type(e)),
-                    'message': str(e)
-                }
+        try:
+            async with self.engine.request(method, url, cold=cold, trace_request_ctx=timings, **kwargs) as response:
+                if timings.headers_end is None:  # request was not traced
+                    timings.request_start, timings.headers_end = request_start, time.perf_counter_ns()
+                result = CheckResult(url, True, started_ns, time.time_ns(), status=response.status)
+                if conditional:
+                    await self.read_conditional(response, pattern, max_body_bytes, cached, result)
+                elif pattern:
+                    await self.match_body(response, pattern, max_body_bytes, result)
+                if pattern and not result.not_modified:
+                    timings.body_end = time.perf_counter_ns()
+                result.response_time_s = timings.headers_s()
+                result.dns_s, result.connect_s, result.ttfb_s, result.transfer_s = timings.durations()
+                await self.drain(response)
+                return result
+        except HostBackoff as e:
+            self.skipped_log('check of {} skipped: {}', url, e)
+            return None
+        except ClientConnectionError as e:  # site is down or slow, traceback tells nothing
+            self.logger.error('error requesting url {}: {!r}', url, e)
+            return CheckResult(url, False, started_ns, error_type=str(type(e)), message=str(e))
+        except ClientError as e:
+            self.logger.opt(exception=e).error('error requesting url {}', url)
+            return CheckResult(url, False, started_ns, error_type=str(type(e)), message=str(e))
+
+    async def match_body(self, response: ClientResponse, pattern: Pattern, max_body_bytes: int,
+                         result: CheckResult):
+        """
+        Reads body by chunks until pattern is found, body ends or max_body_bytes are read. Sets match result,
+        number of bytes read and whether reading stopped before body end without match
+        """
+        matcher = StreamMatcher(pattern, response.charset or 'utf-8', self.match_overlap)
+        bytes_read, match, truncated = 0, False, False
+
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            if max_body_bytes:
+                chunk = chunk[:max_body_bytes - bytes_read]
+            bytes_read += len(chunk)
+            if matcher.feed(chunk):
+                match = True
+                break
+            if max_body_bytes and bytes_read >= max_body_bytes:
+                truncated = not response.content.at_eof()
+                break
+        else:
+            match = matcher.feed(b'', final=True)
+
+        result.match, result.bytes_read, result.truncated = match, bytes_read, truncated
+
+    async def drain(self, response: ClientResponse):
+        """
+        Reads and drops body left unread by check, at most drain_bytes. aiohttp closes connection of response with
+        unread body instead of returning it to pool, then next check of the host pays for new handshakes. Reading
+        short rest is cheaper, long one is not worth the traffic, so its connection is closed. Read errors are
+        ignored, check result is already known
+        """
+        drained = 0
+        try:
+            while drained < self.drain_bytes and not response.content.at_eof():
+                drained += len(await response.content.read(min(self.chunk_size, self.drain_bytes - drained)))
+        except (ClientError, asyncio.TimeoutError):
+            pass
+
+    async def read_conditional(self, response: ClientResponse, pattern: Optional[Pattern], max_body_bytes: int,
+                               cached: Optional[Validators], result: CheckResult):
+        """
+        Handles response to conditional request. Not modified response reuses previous match result. Otherwise
+        body (up to max_body_bytes) is read and hashed, and pattern is matched only if hash has changed.
+        Sets match result like match_body and validators to cache, if response should be cached
+        """
+        if response.status == 304 and cached:
+            result.not_modified, result.validators = True, cached
+            if pattern and cached.match is not None:
+                result.match, result.bytes_read, result.truncated = cached.match, 0, False
+            return
+
+        if not 200 <= response.status < 300:
+            return
+        validators = result.validators = Validators(response.headers.get('ETag'),
+                                                    response.headers.get('Last-Modified'))
+        if not pattern:
+            return
+
+        digest = hashlib.blake2b(digest_size=16)
+        chunks, bytes_read, limited = [], 0, False
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            if max_body_bytes:
+                chunk = chunk[:max_body_bytes - bytes_read]
+            bytes_read += len(chunk)
+            digest.update(chunk)
+            chunks.append(chunk)
+            if max_body_bytes and bytes_read >= max_body_bytes:
+                limited = not response.content.at_eof()
+                break
+        validators.body_hash = digest.digest()
+
+        if cached and cached.body_hash == validators.body_hash and cached.match is not None:
+            match = cached.match
+        else:
+            matcher = StreamMatcher(pattern, response.charset or 'utf-8', self.match_overlap)
+            match = any(matcher.feed(chunk) for chunk in chunks) or matcher.feed(b'', final=True)
+        validators.match = match
+        result.match, result.bytes_read, result.truncated = match, bytes_read, limited and not match
+
+    async def close(self):
+        await self.engine.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
 
 
 class DbWriter(Worker):
     def __init__(self, repo: Repository, topic_success: str, topic_failure: str, logger=loguru.logger,
-                 success_callback: Callable[[ConsumerRecord], None] = None):
+                 success_callback: Callable[[ConsumerRecord], None] = None,
+                 failure_callback: Callable[[ConsumerRecord], None] = None, retries: int = 3,
+                 retry_delay_s: float = 1.0):
         """
-        Stores messages in database
+        Stores messages in database. Failed save is retried, record that still can't be saved is logged with its
+        content and skipped
 
         :param repo: Db methods provider
         :param topic_success: name of topic with successful tasks
         :param topic_failure: name of topic with errors
         :param logger:
         :param success_callback: if provided, will be called with received ConsumerRecord after save
+        :param failure_callback: if provided, will be called with ConsumerRecord that is skipped after retries
+        :param retries: number of retries of failed save
+        :param retry_delay_s: pause before first retry, doubles with every next one
         """
         self.repo = repo
         self.topic_success = topic_success
         self.topic_failure = topic_failure
         self.logger = logger
         self.success_callback = success_callback
+        self.failure_callback = failure_callback
+        self.retries = retries
+        self.retry_delay_s = retry_delay_s
+        self.received_log = MessageLog('DEBUG', logger=logger)
+        self.saved_log = MessageLog('INFO', logger=logger)
 
-    @loguru.logger.catch
+    @log_errors
     async def process(self, task: ConsumerRecord) -> Any:
-        self.logger.debug('received record: {}', task)
+        self.received_log('received record: {}', task)
+        error = await self.retry(self.save_record, task)
+        if error:
+            self.skip(task, error)
+
+    async def save_record(self, task: ConsumerRecord):
         if task.topic == self.topic_success:
             await self.repo.save_successful_check(task.value)
-            self.logger.info('saved state for url: {}', task.value.get('url'))
+            self.saved_log('saved state for url: {}', task.value.get('url'))
         elif task.topic == self.topic_failure:
             await self.repo.save_failed_check(task.value)
-            self.logger.info('saved error info for url: {}', task.value.get('url'))
+            self.saved_log('saved error info for url: {}', task.value.get('url'))
         else:
-            self.logger.info('unknown topic: {}. No action will be taken', task.topic)
+            self.saved_log('unknown topic: {}. No action will be taken', task.topic)
 
         if self.success_callback:
             self.success_callback(task)
+
+    @log_errors
+    async def process_batch(self, tasks: List[ConsumerRecord]) -> List[Any]:
+        if not await self.retry(self.save_batch, tasks):
+            return []
+        # one bad record fails the whole batch, save others without it
+        for task in tasks:
+            try:
+                await self.save_batch([task])
+            except Exception as e:
+                self.skip(task, e)
+        return []
+
+    async def retry(self, save: Callable[[Any], Awaitable], records: Any) -> Optional[Exception]:
+        """
+        Calls save with retries
+
+        :return: error of the last attempt, None if save succeeded
+        """
+        delay = self.retry_delay_s
+        for attempt in range(self.retries + 1):
+            try:
+                await save(records)
+                return None
+            except Exception as e:
+                if attempt == self.retries:
+                    return e
+                self.logger.warning('error saving records: {!r}, retrying in {}s', e, delay)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def skip(self, record: ConsumerRecord, error: Exception):
+        self.logger.opt(exception=error).error('record {} is not saved, skipping it', record)
+        if self.failure_callback:
+            self.failure_callback(record)
+
+    async def save_batch(self, records: List[ConsumerRecord]):
+        """
+        Saves all records with one transaction, then calls success callback for every record
+        """
+        successful = [r.value for r in records if r.topic == self.topic_success]
+        failed = [r.value for r in records if r.topic == self.topic_failure]
+        if len(successful) + len(failed) < len(records):
+            self.logger.info('batch has records from unknown topics. No action will be taken for them')
+
+        await self.repo.save_checks(successful, failed)
+        self.saved_log('saved {} successful and {} failed checks', len(successful), len(failed))
+        if self.success_callback:
+            for record in records:
+                self.success_callback(record)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class BatchDbWriter(DbWriter):
+    def __init__(self, repo: Repository, topic_success: str, topic_failure: str, logger=loguru.logger,
+                 success_callback: Callable[[ConsumerRecord], None] = None, max_size: int = 500,
+                 max_age_s: float = 1.0, max_buffered: int = None,
+                 failure_callback: Callable[[ConsumerRecord], None] = None):
+        """
+        Stores messages in database with micro-batches. Batch is saved when it reaches max_size records or
+        when its oldest record waits for max_age_s. Success callback is called only after whole batch is saved.
+        When saving fails, records stay in buffer and are saved by batches of max_size every max_age_s, new records
+        don't trigger saving until retry succeeds.
+        Once buffer has max_buffered records, process waits until they are saved, so consumer stops fetching
+
+        :param repo: Db methods provider
+        :param topic_success: name of topic with successful tasks
+        :param topic_failure: name of topic with errors
+        :param logger:
+        :param success_callback: if provided, will be called with every ConsumerRecord of batch after save
+        :param max_size: max records in one batch
+        :param max_age_s: max time for record to wait in batch
+        :param max_buffered: max records waiting for save, 10 batches by default
+        :param failure_callback: called with records skipped by process_batch, see DbWriter. Records buffered by
+            process are retried until saved
+        """
+        super().__init__(repo, topic_success, topic_failure, logger, success_callback, failure_callback)
+        self.max_size = max_size
+        self.max_age_s = max_age_s
+        self.max_buffered = max_buffered or max_size * 10
+        assert self.max_buffered >= max_size, 'buffer must fit a batch'
+        self.buffer: List[ConsumerRecord] = []
+        self._first_added = 0.0
+        self._retry_at = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        self._flusher: Optional[asyncio.Task] = None
+
+    @log_errors
+    async def process(self, task: ConsumerRecord) -> Any:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_by_age())
+        while len(self.buffer) >= self.max_buffered:
+            self._has_room.clear()
+            await self._has_room.wait()
+        if not self.buffer:
+            self._first_added = asyncio.get_running_loop().time()
+        self.buffer.append(task)
+        if len(self.buffer) >= self.max_size and not self._retry_at:  # retries are left to _flush_by_age
+            await self.flush()
+
+    async def flush(self):
+        """
+        Saves buffered records by batches of up to max_size. If saving fails, records are returned to buffer and
+        will be saved on the next flush, which is attempted after max_age_s
+        """
+        async with self._flush_lock:
+            while self.buffer:
+                batch, self.buffer = self.buffer[:self.max_size], self.buffer[self.max_size:]
+                try:
+                    await self.save_batch(batch)
+                    self._retry_at = 0.0
+                except Exception:
+                    self.logger.exception('error saving batch of {} records, will retry, {} records buffered',
+                                          len(batch), len(self.buffer) + len(batch))
+                    self.buffer = batch + self.buffer
+                    self._retry_at = asyncio.get_running_loop().time() + self.max_age_s
+                    break
+            if len(self.buffer) < self.max_buffered:
+                self._has_room.set()
+
+    async def _flush_by_age(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = max(self._first_added + self.max_age_s, self._retry_at) - loop.time() if self.buffer \
+                else self.max_age_s
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.flush()
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+
+class FanOut(Worker):
+    def __init__(self, workers: List[Worker]):
+        """
+        Passes every task to all workers, one after another. Use it to run several workers on the same records,
+        like database writer and anomaly detector, because workers of Composer share tasks between them
+        """
+        self.workers = workers
+
+    async def process(self, task: Any) -> Any:
+        for worker in self.workers:
+            await worker.process(task)
+
+    async def process_batch(self, tasks: List[Any]) -> List[Any]:
+        for worker in self.workers:
+            await worker.process_batch(tasks)
+        return []
@@ -4,18 +4,22 @@ import asyncio
 
 import consumer
 import db.init
+import db.retention
 import producer
+from common.log import configure_logging
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--mode', required=True, choices=['consumer', 'producer', 'init'])
+    parser.add_argument('--mode', required=True, choices=['consumer', 'producer', 'init', 'retention'])
 
     arguments, _ = parser.parse_known_args()
+    configure_logging()
 
     module_mapping = {
         'producer': producer,
         'consumer': consumer,
-        'init': db.init
+        'init': db.init,
+        'retention': db.retention
     }
 
     module = module_mapping[arguments.mode]
@@ -1,71 +1,170 @@
 import argparse
 import asyncio
 import os
+from typing import Dict
 
 from loguru import logger
-import yaml
 
 from abstractions.components import Scheduler
 from common.composer import Composer
 from common.kafka import create_producer
+from common.metrics import start_metrics_server, queue_metrics
+from common.profiling import start_diagnostics, profile_handler
 from common.serializer import Serde
 from common.settings import EnvSettings
-from impl import SimpleScheduler, QueueTaskProvider, KafkaPublisher, AsyncSitePoller
+from impl import SimpleScheduler, HeapScheduler, QueueTaskProvider, KafkaPublisher, AsyncSitePoller, HttpClientEngine, \
+    BoundedQueue, HostPoliteness, DiskSpool, OVERLOAD_POLICIES, CHECK_MODES
+from producer.supervisor import Supervisor
+from producer.targets import TargetsWatcher
 
 
-
-def configure_parser(parent=None) -> argparse.ArgumentParser:
+def configure_parser(parent=None, settings=EnvSettings()) -> argparse.ArgumentParser:
     """
     Adds this module subparser arguments to main's parser, if passed
     :param parent: parser from parent module
+    :param settings: source of default values
     :return: subparser
     """
     parent = argparse.ArgumentParser(parents=[parent] if parent else [], add_help=False)
     parent.add_argument('--targets-file', help='path to file with target sites', type=str)
+    parent.add_argument('--reload-interval-s', default=settings.targets_reload_s, type=float,
+                        dest='reload_interval_s',
+                        help='check targets file for changes every this number of seconds and reschedule changed '
+                             'sites, 0 disables reload (env TARGETS_RELOAD_S)')
     parent.add_argument('--url', help='site to check')
     parent.add_argument('--seconds', default=60, help='polling interval in seconds', type=int)
     parent.add_argument('--pattern', help='pattern to search for in response text')
+    parent.add_argument('--cold', action='store_true', default=False,
+                        help='open new connection for every check to measure DNS lookup and handshakes')
+    parent.add_argument('--check', default='full', choices=CHECK_MODES,
+                        help='full request, HEAD request, request of first bytes of body (range) '
+                             'or conditional request with validators of previous response')
+    parent.add_argument('--max-body-bytes', default=settings.max_body_bytes, type=int, dest='max_body_bytes',
+                        help='stop searching for pattern after this number of bytes, 0 is unlimited '
+                             '(env MAX_BODY_BYTES)')
+    parent.add_argument('--scheduler', default='simple', choices=['simple', 'heap'],
+                        help='simple runs background task per site, heap runs all sites from one task')
+    parent.add_argument('--max-in-flight', default=0, type=int, dest='max_in_flight',
+                        help='publish without waiting for ack, keeping at most this number of unacked messages')
+    parent.add_argument('--spool-dir', default=settings.spool_dir, dest='spool_dir',
+                        help='write results to files in this directory when Kafka is unavailable and send them '
+                             'after it recovers, empty disables spool (env SPOOL_DIR)')
+    parent.add_argument('--pollers', default=settings.pollers, type=int,
+                        help='number of concurrent site checks (env POLLERS)')
+    parent.add_argument('--publishers', default=settings.publishers, type=int,
+                        help='number of concurrent Kafka publishers (env PUBLISHERS)')
+    parent.add_argument('--queue-size', default=settings.queue_size, type=int, dest='queue_size',
+                        help='max number of checks and results waiting in queues, 0 is unlimited (env QUEUE_SIZE)')
+    parent.add_argument('--overload-policy', default=settings.overload_policy, choices=OVERLOAD_POLICIES,
+                        dest='overload_policy',
+                        help='what to do with scheduled check when checks queue is full: block scheduler, coalesce '
+                             'with pending check of the same URL or skip it (env OVERLOAD_POLICY)')
+    parent.add_argument('--max-requests', default=settings.http_max_requests, type=int, dest='max_requests',
+                        help='max number of HTTP requests running at the same time, 0 is unlimited '
+                             '(env HTTP_MAX_REQUESTS)')
+    parent.add_argument('--host-rate', default=settings.host_rate, type=float, dest='host_rate',
+                        help='max requests per second to one host, 0 is unlimited (env HOST_RATE)')
+    parent.add_argument('--host-concurrency', default=settings.host_concurrency, type=int, dest='host_concurrency',
+                        help='max simultaneous requests to one host, 0 is unlimited (env HOST_CONCURRENCY)')
+    parent.add_argument('--workers', default=settings.producer_workers, type=int,
+                        help='number of producer processes, sites are distributed between them by URL hash '
+                             '(env PRODUCER_WORKERS)')
+    parent.add_argument('--metrics-port', default=settings.metrics_port, type=int, dest='metrics_port',
+                        help='serve metrics on this port, 0 disables metrics server. With --workers, every process '
+                             'uses its own port starting from this one (env METRICS_PORT)')
+    parent.add_argument('--shard-index', default=0, type=int, dest='shard_index', help=argparse.SUPPRESS)
+    parent.add_argument('--shard-count', default=1, type=int, dest='shard_count', help=argparse.SUPPRESS)
     return parent
 
 
-def schedule_many(scheduler: Scheduler, input_queue: asyncio.Queue, config_path: str):
-    with open(config_path) as fp:
-        conf = yaml.safe_load(fp)
-    for site in conf['sites']:
-        task = {
-            'url': site['url'],
-            'pattern': site.get('pattern'),
-            'request_kwargs': site.get('request_kwargs', {})
-        }
-        interval = site.get('interval', {'seconds': 60})
-        scheduler.schedule(input_queue.put, interval, task)
+async def report_queues(queues: Dict[str, BoundedQueue], interval_s: float = 60):
+    """
+    Periodically logs queue depth and number of dropped items
+    """
+    while True:
+        await asyncio.sleep(interval_s)
+        for name, queue in queues.items():
+            stats = queue.stats()
+            log = logger.warning if queue.dropped else logger.info
+            log('{} queue: {depth}/{maxsize} items, {coalesced} coalesced, {skipped} skipped', name, **stats)
+
+
+def schedule_many(scheduler: Scheduler, input_queue: asyncio.Queue, config_path: str, shard_index: int = 0,
+                  shard_count: int = 1) -> TargetsWatcher:
+    """
+    Schedules checks of sites from config file. When producer is sharded, only sites of given shard are scheduled
+
+    :return: watcher keeping scheduled sites, which can reload config file
+    """
+    watcher = TargetsWatcher(scheduler, input_queue.put, config_path, shard_index, shard_count)
+    watcher.stamp = watcher.file_stamp()
+    watcher.apply(watcher.load())
+    logger.info('scheduled {} sites from {}', len(watcher.targets), config_path)
+    return watcher
 
 
 async def main(args: argparse.Namespace, settings=EnvSettings()):
     assert args.url or args.targets_file, '--url or --targets-file argument required'
 
-    producer = create_producer(settings, value_serializer=Serde(settings.message_encoding).serialize)
-
-    async with KafkaPublisher(producer, settings.kafka_topic_success, settings.kafka_topic_failure) as kafka_publisher:
+    if args.workers > 1:
+        await Supervisor(args, args.workers).run()
+        return
+
+    profiler, loop_monitor = start_diagnostics(settings)
+    serde = Serde(settings.message_encoding, settings.message_format)
+    producer = create_producer(settings, value_serializer=serde.serialize,
+                               linger_ms=settings.kafka_linger_ms, max_batch_size=settings.kafka_max_batch_size,
+                               compression_type=settings.kafka_compression_type)
+
+    engine = HttpClientEngine(limit=settings.http_limit, limit_per_host=settings.http_limit_per_host,
+                              dns_ttl_s=settings.http_dns_ttl_s, keepalive_timeout_s=settings.http_keepalive_s,
+                              max_requests=args.max_requests,
+                              politeness=HostPoliteness(rate=args.host_rate, burst=settings.host_burst,
+                                                        concurrency=args.host_concurrency,
+                                                        max_backoff_s=settings.host_max_backoff_s))
+
+    spool = None
+    if args.spool_dir:
+        spool_dir = os.path.join(args.spool_dir, f'shard-{args.shard_index}') if args.shard_count > 1 \
+            else args.spool_dir
+        spool = DiskSpool(spool_dir, max_bytes=settings.spool_max_bytes, segment_bytes=settings.spool_segment_bytes,
+                          serde=serde)
+
+    async with KafkaPublisher(producer, settings.kafka_topic_success, settings.kafka_topic_failure,
+                              max_in_flight=args.max_in_flight, spool=spool,
+                              spool_latency_s=settings.spool_latency_s) as kafka_publisher, \
+            AsyncSitePoller(engine=engine, max_body_bytes=args.max_body_bytes) as poller:
         await producer.start()
 
-        input_queue = asyncio.Queue()
-        scheduler = SimpleScheduler()
+        input_queue = BoundedQueue(args.queue_size, args.overload_policy)
+        scheduler = HeapScheduler() if args.scheduler == 'heap' else SimpleScheduler()
         task_provider = QueueTaskProvider(input_queue)
-        poller = AsyncSitePoller()
 
-        _ = Composer().run(task_provider, processors=[poller], output_handlers=[kafka_publisher])
+        composer = Composer(processors_concurrency=args.pollers, handlers_concurrency=args.publishers,
+                            queue_size=args.queue_size)
+        _ = composer.run(task_provider, processors=[poller], output_handlers=[kafka_publisher])
+        queues = {'checks': input_queue, 'results': composer.queues[0]}
+        _ = asyncio.create_task(report_queues(queues))
+        queue_metrics(queues)
+        if args.metrics_port:
+            await start_metrics_server(args.metrics_port + args.shard_index,
+                                       handlers={'/profile': profile_handler(profiler)})
         if args.targets_file:
             if not os.path.exists(args.targets_file):
                 logger.error('configuration file not found: {}', args.targets_file)
                 exit(1)
-            schedule_many(scheduler, input_queue, args.targets_file)
-        else:
-            task = {'url': args.url, 'pattern': args.pattern}
+            watcher = schedule_many(scheduler, input_queue, args.targets_file, args.shard_index, args.shard_count)
+            if args.reload_interval_s:
+                _ = asyncio.create_task(watcher.watch(args.reload_interval_s))
+        elif args.shard_index == 0:
+            task = {'url': args.url, 'pattern': args.pattern, 'cold': args.cold, 'check': args.check}
             interval = {'seconds': args.seconds}
             scheduler.schedule(input_queue.put, interval, task)
 
-        await asyncio.Queue().get()
+        try:
+            await asyncio.Queue().get()
+        finally:
+            await scheduler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+"""
+Runs producer pipeline in several processes, every process checks its own part of target sites
+"""
+
+import argparse
+import asyncio
+import copy
+import multiprocessing
+import time
+import zlib
+from multiprocessing.process import BaseProcess
+from multiprocessing.sharedctypes import Synchronized
+from typing import Callable, List, Optional
+
+import loguru
+
+
+def shard_of(url: str, shards: int) -> int:
+    """
+    Number of process responsible for url. Stable between runs and processes, unlike built-in hash
+    """
+    return zlib.crc32(url.encode()) % shards
+
+
+async def send_heartbeats(heartbeat: Synchronized, interval_s: float = 1):
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(interval_s)
+
+
+def run_shard(args: argparse.Namespace, heartbeat: Synchronized):
+    """
+    Child process entry point. Runs usual producer pipeline for one shard of sites
+    """
+    from common.log import configure_logging
+    from producer.main import main
+
+    configure_logging()
+
+    async def run():
+        _ = asyncio.create_task(send_heartbeats(heartbeat))
+        await main(args)
+
+    asyncio.run(run())
+
+
+class Shard:
+    """
+    Child process state
+    """
+    def __init__(self, index: int, heartbeat: Synchronized):
+        self.index = index
+        self.heartbeat = heartbeat
+        self.process: Optional[BaseProcess] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0  # restarts since the shard was last stable, backoff grows with them
+        self.restart_at = 0.0
+
+    def health(self, now: float, heartbeat_timeout_s: float) -> dict:
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            'shard': self.index,
+            'pid': self.process.pid if self.process else None,
+            'alive': alive,
+            'responsive': alive and now - max(self.heartbeat.value, self.started) < heartbeat_timeout_s,
+            'restarts': self.restarts,
+            'exitcode': self.process.exitcode if self.process else None,
+        }
+
+
+class Supervisor:
+    def __init__(self, args: argparse.Namespace, workers: int, target: Callable = run_shard,
+                 heartbeat_timeout_s: float = 30, max_backoff_s: float = 60, check_interval_s: float = 1,
+                 report_interval_s: float = 60, stable_s: float = 600, logger=loguru.logger):
+        """
+        Starts producer processes and restarts them if they exit or stop sending heartbeats
+
+        :param args: producer arguments. Every process gets a copy with its own shard index
+        :param workers: number of processes
+        :param target: process function, called with args and heartbeat value
+        :param heartbeat_timeout_s: process without heartbeats for this time is killed and restarted
+        :param max_backoff_s: max pause before restart, pause doubles with every restart of the shard
+        :param stable_s: shard that runs responsive for this time is stable, its pause before restart is reset
+        :param check_interval_s: how often processes are checked
+        :param report_interval_s: how often health summary is logged
+        :param logger:
+        """
+        self.args = args
+        self.target = target
+        self.heartbeat_timeout_s = heartbeat_timeout_s
+        self.max_backoff_s = max_backoff_s
+        self.check_interval_s = check_interval_s
+        self.report_interval_s = report_interval_s
+        self.stable_s = stable_s
+        self.logger = logger
+        self.context = multiprocessing.get_context('spawn')
+        self.shards = [Shard(i, self.context.Value('d', 0.0, lock=False)) for i in range(workers)]
+
+    def shard_args(self, index: int) -> argparse.Namespace:
+        args = copy.copy(self.args)
+        args.workers = 1
+        args.shard_index = index
+        args.shard_count = len(self.shards)
+        return args
+
+    def start(self, shard: Shard):
+        shard.process = self.context.Process(target=self.target, args=(self.shard_args(shard.index), shard.heartbeat),
+                                             name=f'producer-{shard.index}', daemon=True)
+        shard.started = time.time()
+        shard.process.start()
+        self.logger.info('started producer shard {} with pid {}', shard.index, shard.process.pid)
+
+    def check(self, shard: Shard, now: float):
+        """
+        Restarts exited process with backoff, kills process that doesn't send heartbeats
+        """
+        if shard.process.is_alive():
+            if not shard.health(now, self.heartbeat_timeout_s)['responsive']:
+                self.logger.error('producer shard {} is not responding, terminating', shard.index)
+                shard.process.kill()
+            elif shard.failures and now - shard.started >= self.stable_s:
+                shard.failures = 0
+            return
+
+        if not shard.restart_at:
+            backoff = min(2 ** shard.failures, self.max_backoff_s)
+            shard.restart_at = now + backoff
+            self.logger.error('producer shard {} exited with code {}, restarting in {}s',
+                              shard.index, shard.process.exitcode, backoff)
+        elif now >= shard.restart_at:
+            shard.restarts += 1
+            shard.failures += 1
+            shard.restart_at = 0.0
+            self.start(shard)
+
+    def health(self) -> List[dict]:
+        now = time.time()
+        return [shard.health(now, self.heartbeat_timeout_s) for shard in self.shards]
+
+    def report(self):
+        health = self.health()
+        responsive = sum(h['responsive'] for h in health)
+        log = self.logger.info if responsive == len(health) else self.logger.warning
+        log('{}/{} producer shards are healthy, restarts: {}', responsive, len(health),
+            [h['restarts'] for h in health])
+
+    async def run(self):
+        for shard in self.shards:
+            self.start(shard)
+
+        last_report = time.time()
+        try:
+            while True:
+                await asyncio.sleep(self.check_interval_s)
+                now = time.time()
+                for shard in self.shards:
+                    self.check(shard, now)
+                if now - last_report >= self.report_interval_s:
+                    self.report()
+                    last_report = now
+        finally:
+            self.stop()
+
+    def stop(self):
+        for shard in self.shards:
+            if shard.process and shard.process.is_alive():
+                shard.process.terminate()
+        for shard in self.shards:
+            if shard.process:
+                shard.process.join(timeout=10)
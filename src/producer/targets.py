@@ -0,0 +1,192 @@
+"""
+Targets file loading and hot reload. Targets are kept by URL, so reload schedules only added sites, cancels removed
+ones and reschedules sites with changed settings, other sites keep their schedule
+"""
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import loguru
+import yaml
+
+from abstractions import Scheduler
+from impl import CHECK_MODES
+from impl.scheduler import interval_seconds
+from producer.supervisor import shard_of
+
+# libyaml parser is several times faster than pure python one
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# URL -> (task, interval)
+Targets = Dict[str, Tuple[dict, dict]]
+
+
+def load_config(path: str) -> dict:
+    """
+    Reads targets file. Files with .json extension are parsed as JSON, which is much faster than YAML
+    for large files, other files as YAML
+    """
+    with open(path, 'rb') as fp:
+        if path.endswith('.json'):
+            return json.load(fp)
+        return yaml.load(fp, Loader=YAML_LOADER)
+
+
+def site_target(site: dict) -> Tuple[dict, dict]:
+    """
+    Converts site from targets file to check task and interval
+    """
+    check = site.get('check', 'full')
+    assert check in CHECK_MODES, f'unknown check mode {check} of site {site["url"]}'
+    task = {
+        'url': site['url'],
+        'method': site.get('method', 'GET'),
+        'check': check,
+        'pattern': site.get('pattern'),
+        'cold': site.get('cold', False),
+        'max_body_bytes': site.get('max_body_bytes'),
+        'request_kwargs': site.get('request_kwargs', {})
+    }
+    return task, site.get('interval', {'seconds': 60})
+
+
+def load_targets(path: str, shard_index: int = 0, shard_count: int = 1, logger=loguru.logger) -> Targets:
+    """
+    Loads sites of given shard from targets file. Only the last of sites with the same URL is kept
+    """
+    targets = {}
+    for site in load_config(path)['sites']:
+        url = site['url']
+        if shard_count > 1 and shard_of(url, shard_count) != shard_index:
+            continue
+        if url in targets:
+            logger.warning('site {} is listed more than once, using the last one', url)
+        targets[url] = site_target(site)
+    return targets
+
+
+def diff_targets(old: Targets, new: Targets) -> Tuple[List[str], List[str], List[str]]:
+    """
+    :return: URLs of added, removed and changed targets
+    """
+    added = [url for url in new if url not in old]
+    removed = [url for url in old if url not in new]
+    changed = [url for url, target in new.items() if url in old and old[url] != target]
+    return added, removed, changed
+
+
+def host_offsets(targets: Targets, urls: List[str]) -> Dict[str, float]:
+    """
+    First call offsets of given URLs. Sites of the same host are spread evenly over their interval,
+    so the host doesn't get their checks at once. Sites with unique host get no offset
+    """
+    by_host = defaultdict(list)
+    for url in targets:
+        by_host[urlsplit(url).hostname].append(url)
+    shares = {}
+    for host in {urlsplit(url).hostname for url in urls}:
+        same_host = by_host[host]
+        if len(same_host) > 1:
+            for rank, url in enumerate(sorted(same_host)):
+                shares[url] = rank / len(same_host)
+
+    offsets, intervals = {}, {}
+    for url in urls:
+        if url in shares:
+            interval = targets[url][1]
+            key = tuple(sorted(interval.items()))
+            if key not in intervals:
+                intervals[key] = interval_seconds(interval)
+            offsets[url] = shares[url] * intervals[key]
+    return offsets
+
+
+class TargetsWatcher:
+    def __init__(self, scheduler: Scheduler, async_callback: Callable[[dict], Awaitable], config_path: str,
+                 shard_index: int = 0, shard_count: int = 1, logger=loguru.logger):
+        """
+        Keeps sites from targets file scheduled. File is polled for changes of modification time and size,
+        and parsed in a thread, so event loop keeps running checks during reload
+
+        :param scheduler: scheduler to schedule checks with
+        :param async_callback: function called with check task, like input queue put
+        :param config_path: path to targets file
+        :param shard_index: index of this producer process
+        :param shard_count: number of producer processes
+        :param logger:
+        """
+        self.scheduler = scheduler
+        self.async_callback = async_callback
+        self.config_path = config_path
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.logger = logger
+        self.targets: Targets = {}
+        self.handles: Dict[str, Any] = {}
+        self.stamp: Optional[Tuple[int, int]] = None
+
+    def file_stamp(self) -> Tuple[int, int]:
+        stat = os.stat(self.config_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> Targets:
+        return load_targets(self.config_path, self.shard_index, self.shard_count, self.logger)
+
+    def apply(self, targets: Targets) -> Tuple[int, int, int]:
+        """
+        Schedules added targets, cancels removed and reschedules changed ones. Scheduled sites of the same host
+        are spread over interval, see host_offsets
+
+        :return: number of added, removed and changed targets
+        """
+        added, removed, changed = diff_targets(self.targets, targets)
+        for url in removed + changed:
+            self.scheduler.cancel(self.handles.pop(url))
+        offsets = host_offsets(targets, added + changed) if added or changed else {}
+        for url in added + changed:
+            task, interval = targets[url]
+            self.handles[url] = self.scheduler.schedule(self.async_callback, interval, task,
+                                                        offset_s=offsets.get(url))
+        self.targets = targets
+        return len(added), len(removed), len(changed)
+
+    async def reload(self) -> bool:
+        """
+        Applies targets file if it has changed since previous load. Invalid file is logged and ignored,
+        previous targets stay scheduled
+
+        :return: whether targets were reloaded
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            stamp = await loop.run_in_executor(None, self.file_stamp)
+        except OSError as e:
+            self.logger.warning('targets file {} is not available, keeping {} targets: {}',
+                                self.config_path, len(self.targets), e)
+            return False
+        if stamp == self.stamp:
+            return False
+        self.stamp = stamp  # invalid file is reported once, not on every poll
+
+        try:
+            targets = await loop.run_in_executor(None, self.load)
+        except Exception:
+            self.logger.exception('failed to load targets file {}, keeping {} targets',
+                                  self.config_path, len(self.targets))
+            return False
+
+        added, removed, changed = self.apply(targets)
+        self.logger.info('targets loaded from {}: {} added, {} removed, {} changed, {} total',
+                         self.config_path, added, removed, changed, len(targets))
+        return True
+
+    async def watch(self, interval_s: float):
+        """
+        Reloads targets file every interval_s seconds
+        """
+        while True:
+            await asyncio.sleep(interval_s)
+            await self.reload()
@@ -0,0 +1,3 @@
+"""
+Benchmarks are not collected by pytest. Run them from src directory, e.g. python -m tests.benchmarks.scheduler
+"""
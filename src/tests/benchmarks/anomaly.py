@@ -0,0 +1,39 @@
+"""
+Measures update time of anomaly detector statistics with batches of checks of many sites, and their memory
+"""
+import argparse
+import time
+
+import numpy as np
+
+from impl import LatencyWindows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sites', default=100_000, type=int)
+    parser.add_argument('--window', default=64, type=int)
+    parser.add_argument('--batch-sizes', default=[1, 100, 500, 5000], type=int, nargs='+')
+    parser.add_argument('--checks', default=200_000, type=int, help='checks per measurement')
+    args = parser.parse_args()
+
+    urls = [f'https://site-{i}.example.com' for i in range(args.sites)]
+    rng = np.random.default_rng(1)
+    print(f'{"batch":>7}{"checks/s":>12}{"us/check":>10}{"anomalies":>11}{"memory, MB":>12}')
+    for batch_size in args.batch_sizes:
+        windows = LatencyWindows(max_sites=args.sites, window=args.window)
+        site_indexes = rng.integers(0, args.sites, args.checks)
+        times = rng.lognormal(-2, 0.3, args.checks).tolist()
+        batches = [([urls[i] for i in site_indexes[start:start + batch_size]], times[start:start + batch_size])
+                   for start in range(0, args.checks, batch_size)]
+        anomalies = 0
+        started = time.perf_counter()
+        for batch_urls, batch_times in batches:
+            anomalies += len(windows.update(batch_urls, batch_times))
+        elapsed = time.perf_counter() - started
+        print(f'{batch_size:>7}{args.checks / elapsed:>12.0f}{elapsed / args.checks * 1e6:>10.1f}{anomalies:>11}'
+              f'{windows.nbytes / 1024 ** 2:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
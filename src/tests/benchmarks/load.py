@@ -0,0 +1,228 @@
+"""
+Load test of producer and consumer pipelines with local stand-ins. Sites are served by aiohttp target farm running
+in separate processes, Kafka is replaced by in-memory MemoryKafka, checks are saved to MockRepository, or to Postgres
+with --postgres-dsn (schema must be created by db.init). Every targets count is measured in a fresh process.
+Reports offered and saved checks per second, p50 and p99 latency of pipeline stages and RSS of pipelines process:
+  poll - HTTP request, from check start to its end
+  publish - from check end to message in Kafka, includes waiting in results queue
+  kafka - from message in Kafka to its fetch by consumer
+  save - from fetch to database write, includes waiting in batch
+  total - from check start to database write
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import loguru
+from aiohttp import web
+
+from common.composer import Composer
+from common.serializer import Serde, CODECS
+from impl import HeapScheduler, QueueTaskProvider, KafkaPublisher, AsyncSitePoller, HttpClientEngine, BoundedQueue, \
+    KafkaBatchTaskProvider, BatchDbWriter, OVERLOAD_POLICIES, CHECK_MODES
+from tests.mock.kafka import MemoryKafka, MemoryRecord
+from tests.mock.repository import MockRepository
+
+STAGES = ('poll', 'publish', 'kafka', 'save', 'total')
+
+
+def run_farm(port: int, latency_ms: float, jitter_ms: float, body_bytes: int, ready: multiprocessing.Queue):
+    """
+    Serves every path with given body after random delay. Farm processes share the port
+    """
+    body = b'x' * max(body_bytes - 2, 0) + b'ok'
+
+    async def handler(_: web.Request) -> web.Response:
+        delay_ms = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+        return web.Response(body=body)
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get('/{path:.*}', handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port, reuse_port=True, backlog=4096).start()
+        ready.put(os.getpid())
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size, or peak size where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageClock:
+    """
+    Collects stage durations of saved checks, is used as success callback of database writer
+    """
+    def __init__(self):
+        self.durations: Dict[str, List[int]] = {stage: [] for stage in STAGES}
+        self.saved = 0
+        self.failed = 0
+
+    def reset(self):
+        self.__init__()
+
+    def __call__(self, record: MemoryRecord):
+        now = time.time_ns()
+        check = record.value
+        self.saved += 1
+        if not check.success:
+            self.failed += 1
+        if check.ended_ns is not None:
+            self.durations['poll'].append(check.ended_ns - check.started_ns)
+            self.durations['publish'].append(record.appended_ns - check.ended_ns)
+        self.durations['kafka'].append(record.fetched_ns - record.appended_ns)
+        self.durations['save'].append(now - record.fetched_ns)
+        self.durations['total'].append(now - check.started_ns)
+
+    def percentiles_ms(self, stage: str) -> tuple:
+        values = sorted(self.durations[stage])
+        if not values:
+            return float('nan'), float('nan')
+        return tuple(values[min(int(len(values) * q), len(values) - 1)] / 1e6 for q in (0.5, 0.99))
+
+
+async def run_pipelines(args: argparse.Namespace, targets: int) -> dict:
+    kafka = MemoryKafka(Serde(message_format=args.message_format).serialize, Serde().deserialize_check)
+    clock = StageClock()
+    pool = None
+    if args.postgres_dsn:
+        import asyncpg
+        from db import PostgresRepo
+        pool = await asyncpg.create_pool(args.postgres_dsn)
+        repo = PostgresRepo(pool, rollups=args.rollups)
+    else:
+        repo = MockRepository()
+
+    engine = HttpClientEngine(limit=args.connections, limit_per_host=0)
+    writer = BatchDbWriter(repo, 'success', 'failure', success_callback=clock, max_size=args.batch_size,
+                           max_age_s=args.batch_age_s)
+    async with KafkaPublisher(kafka, 'success', 'failure', max_in_flight=args.max_in_flight) as publisher, \
+            AsyncSitePoller(engine=engine, max_body_bytes=args.max_body_bytes) as poller, writer:
+        input_queue = BoundedQueue(args.queue_size, args.overload_policy)
+        producer = Composer(processors_concurrency=args.pollers, handlers_concurrency=args.publishers,
+                            queue_size=args.queue_size)
+        tasks = producer.run(QueueTaskProvider(input_queue), [poller], [publisher])
+        tasks += Composer(processors_concurrency=args.writers).run(
+            KafkaBatchTaskProvider(kafka, max_records=args.batch_size), [writer])
+
+        scheduler = HeapScheduler()
+        for i in range(targets):
+            task = {'url': f'http://127.0.0.1:{args.port}/site/{i}', 'pattern': args.pattern, 'check': args.check}
+            scheduler.schedule(input_queue.put, {'seconds': args.interval_s}, task)
+
+        await asyncio.sleep(args.warmup_s)
+        clock.reset()
+        started, cpu_started, max_rss = time.perf_counter(), time.process_time(), 0
+        while time.perf_counter() - started < args.duration_s:
+            await asyncio.sleep(0.5)
+            max_rss = max(max_rss, rss_bytes())
+            if isinstance(repo, MockRepository):  # saved checks are counted by clock, don't keep them
+                repo.success.clear(), repo.fail.clear(), repo.batches.clear()
+        elapsed, cpu_used = time.perf_counter() - started, time.process_time() - cpu_started
+
+        result = {
+            'targets': targets,
+            'offered': targets / args.interval_s,
+            'saved': clock.saved / elapsed,
+            'failed': clock.failed,
+            'cpu': cpu_used / elapsed,
+            'rss_mb': max_rss / 1024 ** 2,
+            'backlog': input_queue.qsize() + producer.queues[0].qsize() + len(kafka.records),
+            'stages': {stage: clock.percentiles_ms(stage) for stage in STAGES},
+        }
+        await scheduler.close()
+        for task in tasks:
+            task.cancel()
+    if pool:
+        await pool.close()
+    return result
+
+
+def measure(args: argparse.Namespace, targets: int) -> dict:
+    loguru.logger.remove()
+    loguru.logger.add(lambda message: None, level='WARNING')
+    return asyncio.run(run_pipelines(args, targets))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=[1_000, 10_000, 100_000], type=int, nargs='+')
+    parser.add_argument('--interval-s', default=10.0, type=float, help='check interval of every target')
+    parser.add_argument('--warmup-s', default=None, type=float, help='time before measurement, interval by default')
+    parser.add_argument('--duration-s', default=20.0, type=float, help='measurement time')
+    parser.add_argument('--latency-ms', default=20.0, type=float, help='mean response delay of target farm')
+    parser.add_argument('--jitter-ms', default=10.0, type=float, help='response delay is spread by this value')
+    parser.add_argument('--body-bytes', default=4096, type=int, help='response body size')
+    parser.add_argument('--farm-processes', default=2, type=int)
+    parser.add_argument('--pattern', default='ok', help='pattern to search in response, empty disables matching')
+    parser.add_argument('--check', default='full', choices=CHECK_MODES)
+    parser.add_argument('--max-body-bytes', default=65536, type=int, dest='max_body_bytes')
+    parser.add_argument('--connections', default=100, type=int, help='HTTP connections pool size')
+    parser.add_argument('--pollers', default=100, type=int)
+    parser.add_argument('--publishers', default=1, type=int)
+    parser.add_argument('--max-in-flight', default=0, type=int, dest='max_in_flight')
+    parser.add_argument('--queue-size', default=10_000, type=int, dest='queue_size')
+    parser.add_argument('--overload-policy', default='block', choices=OVERLOAD_POLICIES, dest='overload_policy')
+    parser.add_argument('--message-format', default='json', choices=CODECS, dest='message_format')
+    parser.add_argument('--writers', default=1, type=int)
+    parser.add_argument('--batch-size', default=500, type=int, dest='batch_size')
+    parser.add_argument('--batch-age-s', default=1.0, type=float, dest='batch_age_s')
+    parser.add_argument('--postgres-dsn', default=None, dest='postgres_dsn',
+                        help='save checks to this database instead of MockRepository')
+    parser.add_argument('--rollups', action='store_true', default=False, help='update rollups, with --postgres-dsn')
+    args = parser.parse_args()
+    args.pattern = args.pattern or None
+    if args.warmup_s is None:
+        args.warmup_s = args.interval_s
+    args.port = free_port()
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Queue()
+    farm = [context.Process(target=run_farm, args=(args.port, args.latency_ms, args.jitter_ms, args.body_bytes, ready),
+                            daemon=True) for _ in range(args.farm_processes)]
+    for process in farm:
+        process.start()
+    for _ in farm:
+        ready.get(timeout=30)
+
+    print(f'{"targets":>9}{"offered/s":>11}{"saved/s":>10}{"failed":>8}{"backlog":>9}{"cpu":>6}{"rss, MB":>9}  '
+          + ''.join(f'{stage + " p50/p99, ms":>24}' for stage in STAGES))
+    try:
+        for targets in args.targets:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                r = executor.submit(measure, args, targets).result()
+            stages = ''.join(f'{f"{p50:.1f} / {p99:.1f}":>24}' for p50, p99 in r['stages'].values())
+            print(f'{targets:>9}{r["offered"]:>11,.0f}{r["saved"]:>10,.0f}{r["failed"]:>8}{r["backlog"]:>9}'
+                  f'{r["cpu"]:>6.0%}{r["rss_mb"]:>9.0f}  {stages}')
+    finally:
+        for process in farm:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Measures cost of metrics updates on hot path, compared to a budget of 10k checks per second
+"""
+import argparse
+import time
+
+from common.metrics import Registry
+
+# per check: stage latency and counter for poller and publisher, in-flight gauge, Kafka ack latency
+UPDATES_PER_CHECK = 7
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', default=1_000_000, type=int, help='number of updates per measurement')
+    args = parser.parse_args()
+
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('worker',)).labels('poller')
+    counter = registry.counter('tasks_total', 'Tasks', ('worker',)).labels('poller')
+    gauge = registry.gauge('in_flight', 'In flight')
+
+    cases = {
+        'histogram.observe': lambda i: histogram.observe(i * 1e-6),
+        'counter.inc': lambda i: counter.inc(),
+        'gauge.inc/dec': lambda i: gauge.inc() or gauge.dec(),
+        'baseline (call only)': lambda i: None,
+    }
+    print(f'{"operation":<22}{"ns/op":>8}')
+    for name, update in cases.items():
+        started = time.perf_counter()
+        for i in range(args.events):
+            update(i)
+        print(f'{name:<22}{(time.perf_counter() - started) / args.events * 1e9:>8.0f}')
+
+    started = time.perf_counter()
+    for i in range(args.events // UPDATES_PER_CHECK):
+        histogram.observe(i * 1e-6)
+    per_update = (time.perf_counter() - started) / (args.events // UPDATES_PER_CHECK)
+    print(f'CPU share at 10k checks/s: {per_update * UPDATES_PER_CHECK * 10_000:.2%}')
+    started = time.perf_counter()
+    registry.expose()
+    print(f'exposition: {(time.perf_counter() - started) * 1e3:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Measures pipeline overhead per message with different logging setups: Composer passes messages from in-memory
+provider through KafkaPublisher with stub producer. "before" is the setup equal to logging before per-message logs
+were sampled: default DEBUG sink, every message logged, workers wrapped with logger.catch
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import loguru
+
+from abstractions import TaskProvider, ProviderClosed
+from common import log
+from common.composer import Composer
+from impl import KafkaPublisher
+
+TASK = {'started': '2021-03-16T19:58:53.450004+00:00', 'ended': '2021-03-16T19:58:54.374555+00:00',
+        'response_time_s': 0.924551, 'status': 200, 'success': True, 'url': 'https://status.dev.azure.com/_apis/status',
+        'match': True, 'pattern': 'Ongoing incident', 'dns_s': None, 'connect_s': None, 'ttfb_s': 0.9}
+
+
+class CountingProvider(TaskProvider):
+    def __init__(self, count: int, done: asyncio.Event):
+        self.left = count
+        self.done = done
+
+    async def get(self):
+        if not self.left:
+            self.done.set()
+            raise ProviderClosed('out of tasks')
+        self.left -= 1
+        return TASK
+
+
+class StubProducer:
+    async def send_and_wait(self, topic, value):
+        return topic
+
+
+class CatchingPublisher(KafkaPublisher):
+    """
+    Publisher as it was: logger.catch around every call and unconditional logger calls
+    """
+    @loguru.logger.catch
+    async def process(self, task: dict):
+        topic = self.topic_success if task['success'] else self.topic_failure
+        pub_result = await self.producer.send_and_wait(topic, task)
+        self.logger.debug('published: {}', pub_result)
+        self.logger.info('message sent: {}', task)
+
+
+async def run_pipeline(publisher_class, messages: int) -> float:
+    done = asyncio.Event()
+    publisher = publisher_class(StubProducer(), 'success', 'failure')
+    started = time.perf_counter()
+    tasks = Composer().run(CountingProvider(messages, done), [publisher])
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    for task in tasks:
+        task.cancel()
+    return elapsed / messages
+
+
+def configure(level: str, sample_every: int = 1, max_per_second: int = 0):
+    loguru.logger.enable('')  # tests package disables it
+    loguru.logger.remove()
+    log.SAMPLE_EVERY, log.MAX_PER_SECOND = sample_every, max_per_second
+    if level != 'OFF':
+        loguru.logger.add(open(os.devnull, 'w'), level=level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', default=50_000, type=int, help='number of messages per measurement')
+    args = parser.parse_args()
+
+    setups = [
+        ('before: DEBUG, catch, every message', CatchingPublisher, ('DEBUG',)),
+        ('before: INFO, catch, every message', CatchingPublisher, ('INFO',)),
+        ('DEBUG, every message', KafkaPublisher, ('DEBUG',)),
+        ('INFO, every message', KafkaPublisher, ('INFO',)),
+        ('INFO, sampled 1/100', KafkaPublisher, ('INFO', 100)),
+        ('INFO, max 10/s', KafkaPublisher, ('INFO', 1, 10)),
+        ('WARNING', KafkaPublisher, ('WARNING',)),
+        ('no sinks', KafkaPublisher, ('OFF',)),
+    ]
+    print(f'{"setup":<38}{"us/message":>11}')
+    for name, publisher_class, level_args in setups:
+        configure(*level_args)
+        per_message = asyncio.run(run_pipeline(publisher_class, args.messages))
+        print(f'{name:<38}{per_message * 1e6:>11.1f}')
+    loguru.logger.remove()
+
+
+if __name__ == '__main__':
+    main()
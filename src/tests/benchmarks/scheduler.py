@@ -0,0 +1,68 @@
+"""
+Compares event loop overhead of SimpleScheduler (task per target) and HeapScheduler (one driver task)
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from abstractions import Scheduler
+from impl import SimpleScheduler, HeapScheduler
+
+
+async def measure_lag(lags: list, period_s=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(period_s)
+        lags.append(loop.time() - started - period_s)
+
+
+async def run_scheduler(scheduler: Scheduler, targets: int, interval_s: float, duration_s: float) -> dict:
+    calls = 0
+
+    async def callback():
+        nonlocal calls
+        calls += 1
+
+    lags = []
+    cpu_started = time.process_time()
+    handles = [scheduler.schedule(callback, {'seconds': interval_s}) for _ in range(targets)]
+    lag_probe = asyncio.create_task(measure_lag(lags))
+    await asyncio.sleep(duration_s)
+    cpu_used = time.process_time() - cpu_started
+
+    tasks = len(asyncio.all_tasks())
+    lag_probe.cancel()
+    for handle in handles:
+        scheduler.cancel(handle)
+    await scheduler.close()
+
+    return {
+        'calls': calls,
+        'tasks': tasks,
+        'cpu_s': cpu_used,
+        'cpu_us_per_call': cpu_used / max(calls, 1) * 1e6,
+        'lag_mean_ms': statistics.mean(lags) * 1e3 if lags else float('nan'),
+        'lag_max_ms': max(lags) * 1e3 if lags else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--targets', default=[1_000, 10_000, 100_000], type=int, nargs='+')
+    parser.add_argument('--interval-s', default=1.0, type=float)
+    parser.add_argument('--duration-s', default=5.0, type=float)
+    args = parser.parse_args()
+
+    print(f'{"scheduler":<16}{"targets":>9}{"calls":>10}{"tasks":>9}{"cpu, s":>9}{"cpu/call, us":>14}'
+          f'{"lag mean, ms":>14}{"lag max, ms":>13}')
+    for targets in args.targets:
+        for factory in (SimpleScheduler, HeapScheduler):
+            result = asyncio.run(run_scheduler(factory(), targets, args.interval_s, args.duration_s))
+            print(f'{factory.__name__:<16}{targets:>9}{result["calls"]:>10}{result["tasks"]:>9}{result["cpu_s"]:>9.2f}'
+                  f'{result["cpu_us_per_call"]:>14.1f}{result["lag_mean_ms"]:>14.2f}{result["lag_max_ms"]:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Measures serialization and deserialization throughput of message formats on check results payloads,
+and conversion of decoded messages to database rows for messages with ISO and epoch timestamps
+"""
+import argparse
+import time
+from typing import Callable, List
+
+from dateutil.parser import parse as parse_date
+
+from common.check import CheckResult
+from common.serializer import Serde, CODECS
+
+SUCCESS = {
+    'started': '2021-03-16T19:58:53.450004+00:00', 'ended': '2021-03-16T19:58:54.374555+00:00',
+    'response_time_s': 0.924551, 'status': 200, 'success': True, 'url': 'https://status.dev.azure.com/_apis/status',
+    'match': True, 'pattern': 'Ongoing incident', 'bytes_read': 65536, 'truncated': False,
+}
+FAILURE = {
+    'started': '2021-03-16T21:30:03.058589+00:00', 'success': False,
+    'error_type': "<class 'aiohttp.client_exceptions.ClientConnectorError'>",
+    'message': 'Cannot connect to host httpbin.org:443 ssl:default [Name or service not known]',
+    'url': 'https://httpbin.org/anything',
+}
+
+CHECKS = [CheckResult.from_wire(SUCCESS), CheckResult.from_wire(FAILURE)]
+
+
+def legacy_row(data: dict) -> tuple:
+    """
+    Row building of previous version, with dict messages and ISO timestamps
+    """
+    if data['success']:
+        return (1, parse_date(data['started']), parse_date(data['ended']), data['response_time_s'], data['status'],
+                data.get('pattern'), data.get('match'),
+                data.get('dns_s'), data.get('connect_s'), data.get('ttfb_s'), data.get('transfer_s'))
+    return 1, parse_date(data['started']), data['error_type'], data['message']
+
+
+def check_row(check: CheckResult) -> tuple:
+    return check.success_row(1) if check.success else check.errors_row(1)
+
+
+def messages_per_second(function: Callable, values: List, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            function(value)
+    return repeat * len(values) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', default=100_000, type=int, help='number of messages per measurement')
+    args = parser.parse_args()
+
+    payloads = [SUCCESS, FAILURE] * 50
+    repeat = max(args.messages // len(payloads), 1)
+    baseline = None
+
+    print(f'{"format":<10}{"size, B":>9}{"serialize, msg/s":>19}{"deserialize, msg/s":>21}{"vs json":>9}')
+    for message_format in CODECS:
+        try:
+            serde = Serde(message_format=message_format)
+        except ValueError as e:
+            print(f'{message_format:<10} skipped: {e}')
+            continue
+
+        encoded = [serde.serialize(p) for p in payloads]
+        size = sum(map(len, encoded)) / len(encoded)
+        serialize = messages_per_second(serde.serialize, payloads, repeat)
+        deserialize = messages_per_second(serde.deserialize, encoded, repeat)
+        total = 1 / (1 / serialize + 1 / deserialize)
+        baseline = baseline or total
+        print(f'{message_format:<10}{size:>9.0f}{serialize:>19,.0f}{deserialize:>21,.0f}{total / baseline:>8.1f}x')
+
+    serde = Serde()
+    legacy, checks = [serde.serialize(p) for p in payloads], [serde.serialize(c) for c in CHECKS] * 50
+    legacy_rate = messages_per_second(lambda m: legacy_row(serde.deserialize(m)), legacy, repeat)
+    check_rate = messages_per_second(lambda m: check_row(serde.deserialize_check(m)), checks, repeat)
+    print(f'\njson message to row, msg/s: ISO timestamps {legacy_rate:,.0f}, '
+          f'CheckResult {check_rate:,.0f} ({check_rate / legacy_rate:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures reload of targets file: parsing of YAML and JSON files, and diff with rescheduling of changed sites
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import yaml
+
+from producer.targets import TargetsWatcher, load_targets
+
+
+class CountingScheduler:
+    def __init__(self):
+        self.calls = 0
+
+    def schedule(self, async_callback, interval, task, offset_s=None):
+        self.calls += 1
+        return self.calls
+
+    def cancel(self, handle):
+        self.calls += 1
+
+
+def generate_sites(count: int, changed_every: int = 0) -> list:
+    return [{'url': f'https://site-{i}.example.com/status', 'pattern': 'ok',
+             'interval': {'seconds': 30 if changed_every and i % changed_every == 0 else 60}}
+            for i in range(count)]
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--targets', default=[1_000, 10_000, 100_000], type=int, nargs='+')
+    parser.add_argument('--changed-every', default=100, type=int, help='every Nth site is changed on reload')
+    args = parser.parse_args()
+
+    print(f'{"targets":>9}{"yaml load, s":>14}{"json load, s":>14}{"diff, s":>10}{"rescheduled":>13}')
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.targets:
+            yaml_path, json_path = os.path.join(directory, 'sites.yaml'), os.path.join(directory, 'sites.json')
+            with open(yaml_path, 'w') as fp:
+                yaml.safe_dump({'sites': generate_sites(count)}, fp)
+            with open(json_path, 'w') as fp:
+                json.dump({'sites': generate_sites(count)}, fp)
+            _, yaml_s = timed(load_targets, yaml_path)
+            old, json_s = timed(load_targets, json_path)
+
+            with open(json_path, 'w') as fp:
+                json.dump({'sites': generate_sites(count, args.changed_every)}, fp)
+            new = load_targets(json_path)
+            scheduler = CountingScheduler()
+            watcher = TargetsWatcher(scheduler, None, json_path)
+            watcher.apply(old)
+            scheduler.calls = 0
+            _, diff_s = timed(watcher.apply, new)
+            print(f'{count:>9}{yaml_s:>14.3f}{json_s:>14.3f}{diff_s:>10.3f}{scheduler.calls // 2:>13}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,3 @@
 from .workers import *
 from .providers import *
+from .kafka import *
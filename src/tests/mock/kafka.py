@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple
+
+from aiokafka import TopicPartition
+
+__all__ = ['MemoryKafka', 'MemoryRecord', 'MockRecord']
+
+
+class MockRecord(NamedTuple):
+    """
+    Consumer record with the only fields used by consumer workers
+    """
+    value: dict
+    topic: str
+
+
+class MemoryRecord:
+    """
+    Record with attributes of ConsumerRecord used by workers, and times it was appended and fetched
+    """
+    __slots__ = ('topic', 'partition', 'offset', 'timestamp', 'key', 'value', 'appended_ns', 'fetched_ns')
+
+    def __init__(self, topic: str, offset: int, value: Any, appended_ns: int):
+        self.topic = topic
+        self.partition = 0
+        self.offset = offset
+        self.timestamp = appended_ns // 1_000_000
+        self.key = None
+        self.value = value
+        self.appended_ns = appended_ns
+        self.fetched_ns = None
+
+
+class MemoryKafka:
+    def __init__(self, serializer: Callable[[Any], bytes] = None, deserializer: Callable[[bytes], Any] = None):
+        """
+        In-process stand-in for Kafka, which is both producer for KafkaPublisher and consumer for
+        KafkaTaskProvider and KafkaBatchTaskProvider. Every topic has one partition. Messages are serialized on send
+        and deserialized on fetch, like by real clients. Sent messages are acked at once
+
+        :param serializer: value serializer of producer, messages are stored as is if not set
+        :param deserializer: value deserializer of consumer
+        """
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.records: Deque[MemoryRecord] = deque()
+        self.offsets: Dict[str, int] = {}
+        self.sent = 0
+        self._available = asyncio.Event()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(self, topic: str, value: Any, key: Any = None) -> asyncio.Future:
+        if self.serializer:
+            value = self.serializer(value)
+        offset = self.offsets.get(topic, 0)
+        self.offsets[topic] = offset + 1
+        self.records.append(MemoryRecord(topic, offset, value, time.time_ns()))
+        self.sent += 1
+        self._available.set()
+        delivery = asyncio.get_running_loop().create_future()
+        delivery.set_result((topic, offset))
+        return delivery
+
+    async def send_and_wait(self, topic: str, value: Any, key: Any = None) -> Any:
+        return await (await self.send(topic, value, key))
+
+    async def fetch(self, max_records: int) -> List[MemoryRecord]:
+        batch = []
+        fetched_ns = time.time_ns()
+        while self.records and len(batch) < max_records:
+            record = self.records.popleft()
+            if self.deserializer:
+                record.value = self.deserializer(record.value)
+            record.fetched_ns = fetched_ns
+            batch.append(record)
+        if not self.records:
+            self._available.clear()
+        return batch
+
+    async def getone(self) -> MemoryRecord:
+        while not self.records:
+            await self._available.wait()
+        return (await self.fetch(1))[0]
+
+    async def getmany(self, timeout_ms: int = 0, max_records: int = None) -> Dict[TopicPartition, List[MemoryRecord]]:
+        if not self.records:
+            try:
+                await asyncio.wait_for(self._available.wait(), timeout_ms / 1000)
+            except asyncio.TimeoutError:
+                return {}
+        partitions = {}
+        for record in await self.fetch(max_records or len(self.records)):
+            partitions.setdefault(TopicPartition(record.topic, record.partition), []).append(record)
+        return partitions
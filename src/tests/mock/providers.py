@@ -2,7 +2,7 @@ from abstractions import TaskProvider
 from abstractions.components import ProviderClosed
 
 
-__all__ = ['MockProvider']
+__all__ = ['MockProvider', 'MockBatchProvider']
 
 
 class MockProvider(TaskProvider):
@@ -16,3 +16,10 @@ class MockProvider(TaskProvider):
 
         self.enabled = False
         return self.task
+
+
+class MockBatchProvider(MockProvider):
+    """
+    Returns given list of tasks as one batch
+    """
+    batched = True
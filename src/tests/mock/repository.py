@@ -5,6 +5,7 @@ class MockRepository(Repository):
     def __init__(self):
         self.success = []
         self.fail = []
+        self.batches = []
 
     async def upsert_url(self, url: str) -> int:
         pass
@@ -14,3 +15,39 @@ class MockRepository(Repository):
 
     async def save_failed_check(self, data: dict):
         self.fail.append(data)
+
+    async def save_checks(self, successful, failed):
+        self.batches.append((successful, failed))
+        await super().save_checks(successful, failed)
+
+
+class FailingRepository(MockRepository):
+    """
+    Fails to save batch given number of times
+    """
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    async def save_checks(self, successful, failed):
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('database is not available')
+        await super().save_checks(successful, failed)
+
+
+class RejectingRepository(MockRepository):
+    """
+    Fails to save checks marked as malformed, and batches with them
+    """
+    async def save_successful_check(self, data: dict):
+        if data.get('malformed'):
+            raise ValueError('malformed check')
+        await super().save_successful_check(data)
+
+    async def save_checks(self, successful, failed):
+        if any(data.get('malformed') for data in successful + failed):
+            raise ValueError('malformed check')
+        await super().save_checks(successful, failed)
@@ -0,0 +1,86 @@
+import asyncio
+import random
+
+import pytest
+
+from impl import LatencyWindows, AnomalyDetector, DbWriter, FanOut
+from tests.mock.repository import MockRepository
+from tests.mock.kafka import MockRecord
+
+
+class MockProducer:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, topic, value):
+        self.sent.append((topic, value))
+
+
+def test_latency_windows_detect_spike():
+    windows = LatencyWindows(max_sites=10, window=32, min_samples=20)
+    random.seed(1)
+    for _ in range(40):
+        assert windows.update(['a', 'b'], [random.gauss(0.2, 0.01), random.gauss(0.5, 0.05)]) == []
+
+    anomalies = windows.update(['a', 'b', 'a'], [0.21, 0.55, 2.0])
+    assert [index for index, _ in anomalies] == [2], 'only spike of site a is anomaly'
+    stats = anomalies[0][1]
+    assert 0.18 < stats['ewma_s'] < 0.22 and stats['z_score'] > 4 and stats['percentile_s'] < 2.0
+    assert windows.count[windows.slots['a']] == 42, 'values of the same site in batch must all be added'
+
+
+def test_latency_windows_evict_least_recent():
+    windows = LatencyWindows(max_sites=2, window=4, min_samples=2)
+    windows.update(['a', 'b'], [0.1, 0.2])
+    windows.update(['a'], [0.1])
+    windows.update(['c'], [0.3])
+    assert set(windows.slots) == {'a', 'c'}
+    assert windows.count[windows.slots['c']] == 1, 'evicted slot must be reset'
+    assert windows.nbytes == 2 * (4 * 4 + 8 + 8 + 4 + 4)
+
+
+def test_latency_windows_evict_within_batch():
+    windows = LatencyWindows(max_sites=2, window=4, min_samples=2)
+    windows.update(['a', 'b'], [0.1, 0.2])
+    windows.update(['b'], [0.2])
+    windows.update(['a', 'c'], [0.1, 0.3])
+    assert dict(windows.slots) == {'a': 0, 'c': 1}, 'site updated earlier in batch must not be evicted'
+    assert windows.count[0] == 2 and windows.count[1] == 1
+
+
+def test_anomaly_detector_with_writer():
+    producer, repo = MockProducer(), MockRepository()
+    detector = AnomalyDetector(producer, 'ts', 'anomalies', LatencyWindows(window=8, min_samples=5), max_size=3)
+    worker = FanOut([DbWriter(repo, 'ts', 'tf'), detector])
+    times = [0.1, 0.11, 0.1, 0.12, 0.1, 0.11, 1.5]
+    records = [MockRecord({'url': 'https://example.com', 'response_time_s': t, 'success': True}, 'ts')
+               for t in times]
+    records.append(MockRecord({'url': 'https://example.com', 'success': False}, 'tf'))
+
+    async def run():
+        for record in records:
+            await worker.process(record)
+        await detector.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
+    assert len(repo.success) == 7 and len(repo.fail) == 1, 'writer must get every record'
+    assert [topic for topic, _ in producer.sent] == ['anomalies']
+    assert producer.sent[0][1]['response_time_s'] == 1.5 and producer.sent[0][1]['url'] == 'https://example.com'
+
+
+def test_anomaly_detector_flushes_by_age():
+    producer = MockProducer()
+    detector = AnomalyDetector(producer, 'ts', 'anomalies', LatencyWindows(window=8, min_samples=5), max_age_s=0.05)
+    times = [0.1, 0.11, 0.1, 0.12, 0.1, 0.11, 1.5]
+
+    async def run():
+        for t in times:
+            await detector.process(MockRecord({'url': 'https://example.com', 'response_time_s': t}, 'ts'))
+        sent_before_age = len(producer.sent)
+        await asyncio.sleep(0.2)
+        await detector.close()
+        return sent_before_age
+
+    sent_before_age = asyncio.get_event_loop().run_until_complete(run())
+    assert sent_before_age == 0 and len(producer.sent) == 1, 'records must be checked after max_age_s without new ones'
+    assert not detector.buffer
@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from common.check import CheckResult, ns_to_datetime, datetime_to_ns
+from common.serializer import Serde
+from db.database import success_row, errors_row
+
+
+def test_legacy_message():
+    legacy = {'url': 'https://example.com', 'started': '2021-03-16T19:58:53.450004+00:00',
+              'ended': '2021-03-16T19:58:54.374555+00:00', 'response_time_s': 0.924551, 'status': 200,
+              'success': True, 'match': True, 'pattern': 'incident', 'unknown': 1}
+    check = CheckResult.from_wire(legacy)
+
+    assert check.started == datetime(2021, 3, 16, 19, 58, 53, 450004, tzinfo=timezone.utc)
+    assert check.ended_ns == datetime_to_ns(datetime(2021, 3, 16, 19, 58, 54, 374555, tzinfo=timezone.utc))
+    assert success_row(7, legacy) == (7, check.started, check.ended, 0.924551, 200, 'incident', True,
+                                      None, None, None, None)
+    assert 'unknown' not in check and 'started' not in check.to_wire()
+
+
+@pytest.mark.parametrize('message_format', ['json', 'orjson', 'msgpack'])
+def test_check_round_trip(message_format):
+    pytest.importorskip(message_format)
+    check = CheckResult('https://example.com', True, 1615924733450004000, 1615924734374555000,
+                        response_time_s=0.92, status=200, dns_s=0.01)
+    check.validators = ('"etag"', None)
+
+    encoded = Serde(message_format=message_format).serialize(check)
+    decoded = Serde().deserialize_check(encoded)
+    assert decoded == check and decoded.validators is None, 'validators must not be sent'
+    assert Serde().deserialize(encoded) == check.to_wire()
+
+
+def test_check_dict_access():
+    failure = CheckResult('https://example.com', False, 1615924733450004000, error_type='timeout', message='')
+    assert failure['error_type'] == 'timeout' and failure.get('status', 0) == 0
+    assert 'status' not in failure and 'success' in failure
+    with pytest.raises(KeyError):
+        failure['unknown']
+    assert errors_row(3, failure) == (3, ns_to_datetime(1615924733450004000), 'timeout', '')
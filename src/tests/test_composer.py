@@ -1,7 +1,10 @@
 import asyncio
+from typing import Any
 
+from abstractions import Worker
 from common.composer import Composer
-from tests.mock import MockSitePoller, MockProvider, MockPublisher
+from impl import QueueTaskProvider
+from tests.mock import MockSitePoller, MockProvider, MockPublisher, MockBatchProvider
 
 
 def test_composer():
@@ -24,3 +27,65 @@ def test_composer():
 
     assert list(result) == ['url', 'status', 'text', 'pattern', 'match', 'started', 'ended', 'elapsed']
     assert result['url'] == 'https://example.com'
+
+
+def test_composer_concurrency():
+    """
+    Tests that slow task doesn't block others when processors run concurrently
+    """
+    class SlowWorker(Worker):
+        def __init__(self):
+            self.running = 0
+            self.max_running = 0
+            self.all_running = asyncio.Event()
+            self.release = asyncio.Event()
+
+        async def process(self, task: dict) -> Any:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            if self.running == 3:
+                self.all_running.set()
+            await self.all_running.wait()
+            if task['slow']:
+                await self.release.wait()
+            self.running -= 1
+            return task
+
+    async def run_pipeline():
+        tasks_queue, final = asyncio.Queue(), asyncio.Queue()
+        for slow in (True, False, False):
+            tasks_queue.put_nowait({'slow': slow})
+
+        worker = SlowWorker()
+        tasks = Composer(processors_concurrency=3, queue_size=1).run(
+            QueueTaskProvider(tasks_queue), [worker], [MockPublisher(final)])
+        # slow task is held until both fast ones are published, timeout only guards against hanging
+        results = [await asyncio.wait_for(final.get(), 10) for _ in range(2)]
+        worker.release.set()
+        results.append(await asyncio.wait_for(final.get(), 10))
+        for t in tasks:
+            t.cancel()
+        return worker, results, len(tasks)
+
+    worker, results, tasks_count = asyncio.get_event_loop().run_until_complete(run_pipeline())
+    assert tasks_count == 4, '3 processors and 1 publisher expected'
+    assert worker.max_running == 3
+    assert results == [{'slow': False}, {'slow': False}, {'slow': True}], 'fast tasks must not wait for slow one'
+
+
+def test_composer_batch():
+    """
+    Tests that batch from provider is processed by worker and every result is passed to output handler
+    """
+    final = asyncio.Queue()
+    provider = MockBatchProvider([{'url': 'https://example.com'}, {'url': 'https://example.org'}])
+
+    async def schedule_all():
+        tasks = Composer().run(provider, [MockSitePoller()], [MockPublisher(final)])
+        results = [await final.get(), await final.get()]
+        for t in tasks:
+            t.cancel()
+        return results
+
+    results = asyncio.get_event_loop().run_until_complete(schedule_all())
+    assert [r['url'] for r in results] == ['https://example.com', 'https://example.org']
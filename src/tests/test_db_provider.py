@@ -8,6 +8,7 @@ import pytest
 
 from common.settings import EnvSettings
 from db import PostgresRepo
+from db.database import LruCache, SUCCESS_COLUMNS, success_row
 
 
 @pytest.fixture
@@ -88,3 +89,61 @@ def test_pg_insert_success(db_repo, conn_pool):
 
     assert sr['site_id'] == fr['site_id'], 'site id mismatch'
     assert sr['started'] != fr['started']
+
+
+def test_success_row_timings():
+    report = {'started': '2021-03-16T19:58:53.450004+00:00', 'ended': '2021-03-16T19:58:54.374555+00:00',
+              'response_time_s': 0.924551, 'status': 200}
+    row = dict(zip(SUCCESS_COLUMNS, success_row(1, report)))
+    assert len(row) == len(SUCCESS_COLUMNS)
+    assert row['dns_time'] is None and row['transfer_time'] is None, 'checks without timings must be accepted'
+
+    row = dict(zip(SUCCESS_COLUMNS, success_row(1, {**report, 'dns_s': 0.01, 'connect_s': 0.02, 'ttfb_s': 0.5})))
+    assert (row['dns_time'], row['connect_time'], row['ttfb_time']) == (0.01, 0.02, 0.5)
+
+
+def test_lru_cache():
+    cache = LruCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache, 'least recently used key must be evicted'
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get('b') is None
+    assert len(cache) == 2
+
+
+@pytest.mark.integration
+def test_pg_repo_bulk_upsert(db_repo, conn_pool):
+    loop = asyncio.get_event_loop()
+    known, new = random_string(), random_string()
+
+    known_id = loop.run_until_complete(db_repo.upsert_url(known))
+    fresh_repo = PostgresRepo(conn_pool)
+    loop.run_until_complete(fresh_repo.warm_cache())
+    assert fresh_repo.site_ids.get(known) == known_id, 'cache must be warmed from sites table'
+
+    site_ids = loop.run_until_complete(fresh_repo.upsert_urls([known, new, new]))
+    assert site_ids[known] == known_id
+    assert site_ids[new] == loop.run_until_complete(db_repo.upsert_url(new)), 'same URL inserted twice'
+
+
+def test_pg_repo_cached_upsert():
+    class StubRepo(PostgresRepo):
+        def __init__(self):
+            super().__init__(pool_or_dsn=None)
+            self.queries = []
+
+        async def exec(self, query, *args, timeout=None):
+            self.queries.append(args)
+            return [{'id': i, 'url': url} for i, url in enumerate(sorted(set(args[0])), 1)]
+
+    repo = StubRepo()
+    loop = asyncio.get_event_loop()
+
+    assert loop.run_until_complete(repo.upsert_urls(['a', 'b'])) == {'a': 1, 'b': 2}
+    assert loop.run_until_complete(repo.upsert_url('a')) == 1
+    assert loop.run_until_complete(repo.upsert_urls(['b', 'c'])) == {'b': 2, 'c': 1}
+    assert repo.queries == [(['a', 'b'],), (['c'],)], 'only urls missing in cache must be queried'
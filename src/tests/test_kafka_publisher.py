@@ -0,0 +1,110 @@
+import asyncio
+
+from impl import KafkaPublisher, DiskSpool
+
+
+class MockProducer:
+    def __init__(self):
+        self.sent = []
+        self.deliveries = []
+
+    async def send(self, topic, value):
+        delivery = asyncio.get_running_loop().create_future()
+        self.sent.append((topic, value))
+        self.deliveries.append(delivery)
+        return delivery
+
+    async def send_and_wait(self, topic, value):
+        self.sent.append((topic, value))
+
+
+def test_publisher_waits_for_ack():
+    producer = MockProducer()
+    publisher = KafkaPublisher(producer, 'ts', 'tf')
+
+    asyncio.get_event_loop().run_until_complete(publisher.process({'success': False}))
+    assert producer.sent == [('tf', {'success': False})]
+    assert not producer.deliveries
+
+
+def test_pipelined_publisher_window():
+    producer = MockProducer()
+    failed = []
+    publisher = KafkaPublisher(producer, 'ts', 'tf', max_in_flight=2,
+                               delivery_callback=lambda task, error: failed.append((task, error)))
+
+    async def publish():
+        await publisher.process({'success': True, 'id': 1})
+        await publisher.process({'success': True, 'id': 2})
+        third = asyncio.create_task(publisher.process({'success': False, 'id': 3}))
+        await asyncio.sleep(0)
+        assert len(producer.sent) == 2, 'window is full, third message must wait for ack'
+
+        producer.deliveries[0].set_result('ok')
+        producer.deliveries[1].set_exception(ConnectionError('broker is not available'))
+        await third
+
+    asyncio.get_event_loop().run_until_complete(publish())
+    assert [topic for topic, _ in producer.sent] == ['ts', 'ts', 'tf']
+    assert len(failed) == 1
+    assert failed[0][0]['id'] == 2
+    assert isinstance(failed[0][1], ConnectionError)
+
+
+def test_publisher_spools_while_kafka_is_down(tmp_path):
+    class FailingProducer(MockProducer):
+        down = True
+
+        async def send_and_wait(self, topic, value):
+            if self.down:
+                raise ConnectionError('broker is not available')
+            await super().send_and_wait(topic, value)
+
+        async def send(self, topic, value):
+            delivery = await super().send(topic, value)
+            delivery.set_result('ok')
+            return delivery
+
+    producer = FailingProducer()
+    publisher = KafkaPublisher(producer, 'ts', 'tf', spool=DiskSpool(str(tmp_path)), replay_batch_size=2)
+    messages = [{'success': i % 2 == 0, 'url': 'https://example.com', 'id': i} for i in range(5)]
+
+    async def publish():
+        for message in messages[:3]:
+            await publisher.process(message)
+        assert publisher.spooling and not producer.sent, 'messages must be spooled after error'
+
+        producer.down = False
+        await publisher.process(messages[3])
+        assert not producer.sent, 'messages must go through spool until it is replayed'
+
+        await publisher.replay()
+        await publisher.process(messages[4])
+
+    asyncio.get_event_loop().run_until_complete(publish())
+    assert not publisher.spooling
+    assert [value['id'] for _, value in producer.sent] == list(range(5)), 'order must be kept'
+    assert [topic for topic, _ in producer.sent] == ['ts', 'tf', 'ts', 'tf', 'ts']
+
+
+def test_pipelined_publisher_spools_window_on_failure(tmp_path):
+    producer = MockProducer()
+    spool = DiskSpool(str(tmp_path))
+    publisher = KafkaPublisher(producer, 'ts', 'tf', max_in_flight=3, spool=spool)
+    messages = [{'success': True, 'url': 'https://example.com', 'id': i} for i in range(4)]
+
+    async def publish():
+        for message in messages[:3]:
+            await publisher.process(message)
+        producer.deliveries[1].set_exception(ConnectionError('broker is not available'))
+        await asyncio.sleep(0)
+        producer.deliveries[0].set_result('ok')
+        producer.deliveries[2].set_result('ok')
+        await publisher.process(messages[3])
+        await asyncio.sleep(0)
+        return await spool.oldest()
+
+    _, spooled = asyncio.get_event_loop().run_until_complete(publish())
+    assert publisher.spooling and len(producer.sent) == 3
+    assert [m['id'] for m in spooled] == [0, 1, 2, 3], 'messages in flight must be spooled in order they were sent'
+    assert not publisher.in_flight and publisher.window._value == 3
@@ -0,0 +1,70 @@
+import asyncio
+
+import loguru
+
+from common import log
+from common.log import MessageLog, log_errors, level_enabled
+
+
+def with_sink(level: str):
+    """
+    Logger copy with own list sink, which is not affected by disabled loguru in tests
+    """
+    messages = []
+    logger = loguru.logger.bind()
+    loguru.logger.enable('tests')
+    handler = logger.add(lambda m: messages.append(m.record['message']), level=level,
+                         filter=lambda r: r['extra'].get('sink') == id(messages))
+    return logger.bind(sink=id(messages)), messages, handler
+
+
+def test_message_log_sampling():
+    logger, messages, handler = with_sink('INFO')
+    try:
+        sampled = MessageLog('INFO', sample_every=3, max_per_second=0, logger=logger)
+        for i in range(7):
+            sampled('message {}', i)
+        assert messages == ['message 2', 'message 5']
+
+        disabled = MessageLog('TRACE', logger=logger)
+        assert not disabled.enabled, 'level below all sinks must be disabled'
+    finally:
+        loguru.logger.remove(handler)
+        loguru.logger.disable('tests')
+
+
+def test_message_log_rate_limit():
+    logger, messages, handler = with_sink('INFO')
+    try:
+        limited = MessageLog('INFO', max_per_second=2, logger=logger)
+        for i in range(5):
+            limited('message {}', i)
+        assert messages == ['message 0', 'message 1']
+
+        limited.window_start -= 1
+        limited('message {}', 5)
+        assert messages[2:] == ['3 similar messages suppressed', 'message 5']
+    finally:
+        loguru.logger.remove(handler)
+        loguru.logger.disable('tests')
+
+
+def test_level_enabled(monkeypatch):
+    monkeypatch.setattr(log, 'MIN_LEVEL', 'WARNING')
+    assert level_enabled('ERROR') and level_enabled('WARNING')
+    assert not level_enabled('INFO') and not MessageLog('INFO').enabled, 'level below configured one is disabled'
+
+
+def test_log_errors():
+    class Failing:
+        logger = loguru.logger
+
+        @log_errors
+        async def process(self, task):
+            if task:
+                raise ValueError(task)
+            return 'ok'
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(Failing().process(None)) == 'ok'
+    assert loop.run_until_complete(Failing().process('fail')) is None
@@ -1,13 +1,8 @@
 import asyncio
-from typing import NamedTuple
 
-from impl import DbWriter
-from tests.mock.repository import MockRepository
-
-
-class MockRecord(NamedTuple):
-    value: dict
-    topic: str
+from impl import DbWriter, BatchDbWriter
+from tests.mock.kafka import MockRecord
+from tests.mock.repository import MockRepository, FailingRepository
 
 
 def test_message_saver():
@@ -24,3 +19,110 @@ def test_message_saver():
 
     assert repo.success == [success_record.value], 'successful message was incorrectly saved'
     assert repo.fail == [failure_record.value], 'failure report was incorrectly saved'
+
+
+def test_batch_saver_flushes_full_batch():
+    topic_success, topic_failure = 'ts', 'tf'
+    records = [MockRecord({'id': i}, topic_success if i % 2 else topic_failure) for i in range(4)]
+    saved = []
+    repo = MockRepository()
+    writer = BatchDbWriter(repo, topic_success, topic_failure, success_callback=saved.append, max_size=2,
+                           max_age_s=60)
+
+    async def write():
+        for record in records[:3]:
+            await writer.process(record)
+        return list(saved)
+
+    loop = asyncio.get_event_loop()
+    saved_before_close = loop.run_until_complete(write())
+    assert saved_before_close == records[:2], 'only full batch must be saved and acknowledged'
+    assert repo.success == [records[1].value]
+    assert repo.fail == [records[0].value]
+
+    loop.run_until_complete(writer.close())
+    assert saved == records[:3], 'incomplete batch must be saved on close'
+
+
+def test_batch_saver_flushes_by_age():
+    repo = MockRepository()
+    writer = BatchDbWriter(repo, 'ts', 'tf', max_size=100, max_age_s=0.01)
+
+    async def write():
+        await writer.process(MockRecord({'success': True}, 'ts'))
+        await asyncio.sleep(0.05)
+        await writer.close()
+
+    asyncio.get_event_loop().run_until_complete(write())
+    assert repo.success == [{'success': True}]
+
+
+def test_batch_saver_retries_failed_batch():
+    repo = FailingRepository(failures=1)
+    saved = []
+    writer = BatchDbWriter(repo, 'ts', 'tf', success_callback=saved.append, max_size=1, max_age_s=60)
+    first, second = MockRecord({'id': 1}, 'ts'), MockRecord({'id': 2}, 'ts')
+
+    async def write():
+        await writer.process(first)
+        assert not saved, 'records must not be acknowledged before save'
+        await writer.process(second)
+        await writer.close()
+
+    asyncio.get_event_loop().run_until_complete(write())
+    assert repo.success == [first.value, second.value]
+    assert saved == [first, second]
+
+
+def test_batch_saver_backpressure():
+    repo = FailingRepository(failures=3)
+    writer = BatchDbWriter(repo, 'ts', 'tf', max_size=2, max_age_s=0.05, max_buffered=4)
+    records = [MockRecord({'id': i}, 'ts') for i in range(7)]
+
+    async def feed():
+        for record in records:
+            await writer.process(record)
+
+    async def write():
+        feeding = asyncio.create_task(feed())
+        await asyncio.sleep(0.01)
+        assert not feeding.done() and len(writer.buffer) == 4, 'writer must stop taking records when buffer is full'
+        await asyncio.wait_for(feeding, 1)
+        await writer.close()
+
+    asyncio.get_event_loop().run_until_complete(write())
+    assert repo.success == [r.value for r in records]
+    assert all(len(successful) <= 2 for successful, _ in repo.batches), 'retries must be saved by batches of max_size'
+
+
+def test_batch_saver_retries_by_age():
+    repo = FailingRepository(failures=1)
+    writer = BatchDbWriter(repo, 'ts', 'tf', max_size=2, max_age_s=0.05, max_buffered=10)
+    records = [MockRecord({'id': i}, 'ts') for i in range(8)]
+
+    async def write():
+        for record in records:
+            await writer.process(record)
+        attempts = repo.attempts
+        await asyncio.sleep(0.2)
+        await writer.close()
+        return attempts
+
+    attempts = asyncio.get_event_loop().run_until_complete(write())
+    assert attempts == 1, 'full batches must not be saved again while retry is pending'
+    assert repo.success == [r.value for r in records]
+    assert repo.attempts == 5, 'one failure and 4 batches'
+
+
+def test_message_saver_batch():
+    topic_success, topic_failure = 'ts', 'tf'
+    records = [MockRecord({'id': 1}, topic_success), MockRecord({'id': 2}, topic_failure),
+               MockRecord({'id': 3}, topic_success), MockRecord({'id': 4}, 'unknown')]
+    saved = []
+    repo = MockRepository()
+    writer = DbWriter(repo, topic_success, topic_failure, success_callback=saved.append)
+
+    asyncio.get_event_loop().run_until_complete(writer.process_batch(records))
+
+    assert repo.batches == [([{'id': 1}, {'id': 3}], [{'id': 2}])], 'batch must be saved at once'
+    assert saved == records
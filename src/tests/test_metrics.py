@@ -0,0 +1,78 @@
+import asyncio
+
+import aiohttp
+from aiohttp.test_utils import unused_port
+
+from common.composer import Composer, STAGE_TASKS
+from common.metrics import Registry, start_metrics_server, queue_metrics
+from impl import BoundedQueue
+from tests.mock import MockSitePoller, MockProvider, MockPublisher
+
+
+def test_metrics_exposition():
+    registry = Registry()
+    counter = registry.counter('checks_total', 'Checks', ('site',))
+    gauge = registry.gauge('depth', 'Depth')
+    histogram = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+
+    counter.labels('a"b').inc(2)
+    gauge.set(3)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    lines = registry.expose().splitlines()
+    assert '# TYPE checks_total counter' in lines
+    assert 'checks_total{site="a\\"b"} 2' in lines
+    assert 'depth 3' in lines
+    assert lines[-5:] == ['latency_seconds_bucket{le="0.1"} 1', 'latency_seconds_bucket{le="1"} 2',
+                          'latency_seconds_bucket{le="+Inf"} 3', 'latency_seconds_sum 5.55',
+                          'latency_seconds_count 3']
+    assert registry.counter('checks_total', 'Checks', ('site',)) is counter, 'metric must be registered once'
+
+
+def test_queue_metrics():
+    registry = Registry()
+    queue = BoundedQueue(1, 'skip')
+    queue_metrics({'checks': queue}, registry)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(queue.put({'url': 'a'}))
+    loop.run_until_complete(queue.put({'url': 'b'}))
+
+    lines = registry.expose().splitlines()
+    assert 'queue_depth{queue="checks"} 1' in lines
+    assert 'queue_skipped_total{queue="checks"} 1' in lines
+
+
+def test_metrics_server():
+    registry = Registry()
+    registry.counter('served_total', 'Served').inc()
+    port = unused_port()
+
+    async def scrape():
+        runner = await start_metrics_server(port, '127.0.0.1', registry)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    return response.headers['Content-Type'], await response.text()
+        finally:
+            await runner.cleanup()
+
+    content_type, text = asyncio.get_event_loop().run_until_complete(scrape())
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert 'served_total 1' in text
+
+
+def test_composer_metrics():
+    final = asyncio.Queue()
+    processed = STAGE_TASKS.labels('MockSitePoller')
+    before = processed.get()
+
+    async def run_once():
+        tasks = Composer().run(MockProvider({'url': 'https://example.com'}), [MockSitePoller()],
+                               [MockPublisher(final)])
+        await final.get()
+        for t in tasks:
+            t.cancel()
+
+    asyncio.get_event_loop().run_until_complete(run_once())
+    assert processed.get() > before
@@ -0,0 +1,102 @@
+import asyncio
+from typing import NamedTuple
+
+from aiokafka import TopicPartition
+
+from impl import OffsetTracker, CommitOnRebalance, DbWriter
+from tests.mock.kafka import MemoryRecord
+from tests.mock.repository import RejectingRepository
+
+
+class MockRecord(NamedTuple):
+    topic: str
+    partition: int
+    offset: int
+
+
+class MockConsumer:
+    def __init__(self):
+        self.commits = []
+
+    async def commit(self, offsets):
+        self.commits.append(offsets)
+
+
+def test_tracker_commits_contiguous_offsets():
+    consumer = MockConsumer()
+    tracker = OffsetTracker(consumer, commit_every=100)
+    tp0, tp1 = TopicPartition('ts', 0), TopicPartition('ts', 1)
+    records = [MockRecord('ts', 0, offset) for offset in (10, 11, 12)] + [MockRecord('ts', 1, 5)]
+
+    async def process():
+        for record in records:
+            tracker.track(record)
+        for record in (records[0], records[2], records[3]):
+            tracker.done(record)
+        await tracker.commit()
+        tracker.done(records[1])
+        await tracker.commit()
+        await tracker.commit()
+
+    asyncio.get_event_loop().run_until_complete(process())
+    assert consumer.commits == [{tp0: 11, tp1: 6}, {tp0: 13}], \
+        'offset after unprocessed record must not be committed, same offsets must not be committed twice'
+
+
+def test_tracker_commits_every_n_records():
+    consumer = MockConsumer()
+    tracker = OffsetTracker(consumer, commit_every=2)
+    records = [MockRecord('ts', 0, offset) for offset in range(3)]
+
+    async def process():
+        for record in records:
+            tracker.track(record)
+            tracker.done(record)
+            await asyncio.sleep(0)
+
+    asyncio.get_event_loop().run_until_complete(process())
+    assert consumer.commits == [{TopicPartition('ts', 0): 2}]
+
+
+def test_tracker_rebalance():
+    consumer = MockConsumer()
+    tracker = OffsetTracker(consumer, commit_every=100)
+    listener = CommitOnRebalance(tracker)
+    tp0, tp1 = TopicPartition('ts', 0), TopicPartition('ts', 1)
+    done, in_flight = MockRecord('ts', 0, 1), MockRecord('ts', 1, 1)
+
+    async def rebalance():
+        tracker.track(done)
+        tracker.track(in_flight)
+        tracker.done(done)
+        await listener.on_partitions_revoked([tp0, tp1])
+        tracker.done(in_flight)
+        await listener.on_partitions_assigned([tp0])
+        await tracker.close()
+
+    asyncio.get_event_loop().run_until_complete(rebalance())
+    assert consumer.commits == [{tp0: 2}], 'records of revoked partitions must not be committed after revoke'
+
+
+def test_tracker_commits_after_skipped_record():
+    consumer = MockConsumer()
+    tracker = OffsetTracker(consumer, commit_every=100)
+    repo = RejectingRepository()
+    writer = DbWriter(repo, 'ts', 'tf', success_callback=tracker.done, failure_callback=tracker.done,
+                      retries=1, retry_delay_s=0)
+    records = [MemoryRecord('ts', offset, {'url': f'https://{offset}.example.com', 'malformed': offset in (1, 4)}, 0)
+               for offset in range(6)]
+
+    async def process():
+        for record in records:
+            tracker.track(record)
+        await writer.process_batch(records[:3])
+        await tracker.commit()
+        for record in records[3:]:
+            await writer.process(record)
+        await tracker.commit()
+
+    asyncio.get_event_loop().run_until_complete(process())
+    tp = TopicPartition('ts', 0)
+    assert consumer.commits == [{tp: 3}, {tp: 6}], 'offsets after skipped record must be committed'
+    assert [check['url'] for check in repo.success] == [f'https://{offset}.example.com' for offset in (0, 2, 3, 5)]
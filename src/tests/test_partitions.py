@@ -0,0 +1,83 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+import asyncpg
+import pytest
+
+from common.settings import EnvSettings
+from db.partitions import PartitionManager, partition_start, partition_name, parse_partition_name
+
+NOW = datetime(2021, 3, 17, 12, 30, tzinfo=timezone.utc)  # Wednesday
+
+
+class FakeConnection:
+    """
+    Keeps partition names instead of postgres catalog
+    """
+    def __init__(self, partitions=()):
+        self.partitions = set(partitions)
+        self.executed = []
+
+    async def fetch(self, query, table):
+        return [{'relname': name} for name in self.partitions if name.startswith(table + '_')]
+
+    async def execute(self, query):
+        self.executed.append(query)
+        name = query.split()[-1] if query.startswith('DROP') else query.split()[5]
+        if query.startswith('DROP'):
+            self.partitions.discard(name)
+        else:
+            self.partitions.add(name)
+
+
+def test_partition_bounds():
+    assert partition_start(date(2021, 3, 17), 'day') == date(2021, 3, 17)
+    assert partition_start(date(2021, 3, 17), 'week') == date(2021, 3, 15)
+    assert partition_name('success', date(2021, 3, 15)) == 'success_p20210315'
+    assert parse_partition_name('success', 'success_p20210315') == date(2021, 3, 15)
+    assert parse_partition_name('success', 'success_default') is None
+    assert parse_partition_name('success', 'errors_p20210315') is None
+
+
+def test_partition_manager_creates_ahead():
+    conn = FakeConnection({'success_p20210317', 'success_default'})
+    manager = PartitionManager(conn, 'day', premake=2, tables=['success'])
+
+    created = asyncio.get_event_loop().run_until_complete(manager.create(NOW))
+
+    assert created == ['success_p20210318', 'success_p20210319'], 'existing partition must be kept'
+    assert "FROM ('2021-03-18 00:00:00+00') TO ('2021-03-19 00:00:00+00')" in conn.executed[0]
+
+
+def test_partition_manager_drops_expired():
+    conn = FakeConnection({'errors_p20210301', 'errors_p20210308', 'errors_p20210315', 'errors_default'})
+    manager = PartitionManager(conn, 'week', premake=1, retention=1, tables=['errors'])
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(manager.maintain(NOW))
+
+    assert conn.partitions == {'errors_p20210308', 'errors_p20210315', 'errors_p20210322', 'errors_default'}
+
+    manager.retention = 0
+    assert not loop.run_until_complete(manager.drop(datetime(2030, 1, 1, tzinfo=timezone.utc))), \
+        'nothing is dropped without retention'
+
+
+@pytest.mark.integration
+def test_pg_partition_manager():
+    async def run():
+        conn = await asyncpg.connect(EnvSettings().postgres_dsn)
+        try:
+            await conn.execute('DROP TABLE IF EXISTS partitions_test')
+            await conn.execute('CREATE TABLE partitions_test (started timestamptz NOT NULL) '
+                               'PARTITION BY RANGE (started)')
+            manager = PartitionManager(conn, 'day', premake=1, tables=['partitions_test'])
+            await manager.maintain()
+            await conn.execute('INSERT INTO partitions_test VALUES (now())')
+            return await manager.existing('partitions_test')
+        finally:
+            await conn.execute('DROP TABLE IF EXISTS partitions_test')
+            await conn.close()
+
+    partitions = asyncio.get_event_loop().run_until_complete(run())
+    assert len(partitions) == 2
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from impl import AsyncSitePoller, HttpClientEngine, HostPoliteness, parse_retry_after
+
+
+def test_parse_retry_after():
+    now = datetime(2021, 3, 16, 19, 58, 0, tzinfo=timezone.utc)
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Tue, 16 Mar 2021 19:59:30 GMT', now) == 90
+    assert parse_retry_after('Tue, 16 Mar 2021 19:00:00 GMT', now) == 0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_host_rate_and_concurrency():
+    politeness = HostPoliteness(rate=50, burst=2, concurrency=2)
+    running, max_running = 0, 0
+
+    async def request(url):
+        nonlocal running, max_running
+        async with politeness.slot(url):
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(*(request(f'https://example.com/{i}') for i in range(7)),
+                             request('https://other.example.com'))
+        return time.monotonic() - started
+
+    elapsed = asyncio.get_event_loop().run_until_complete(run())
+    assert max_running <= 3, 'other hosts must not be limited by example.com'
+    assert elapsed >= 5 / 50, 'requests after burst must wait for tokens'
+    assert set(politeness.hosts) == {'example.com', 'other.example.com'}
+
+
+def test_poller_backs_off_on_429():
+    answers = [web.Response(status=429, headers={'Retry-After': '60'}), web.Response(status=503),
+               web.Response(status=503), web.Response(text='ok')]
+
+    async def handler(request: web.Request):
+        return answers.pop(0)
+
+    app = web.Application()
+    app.router.add_route('GET', '/{path}', handler)
+
+    async def run():
+        politeness = HostPoliteness(base_backoff_s=10)
+        async with TestServer(app) as server, \
+                AsyncSitePoller(engine=HttpClientEngine(politeness=politeness)) as poller:
+            url = str(server.make_url('/status'))
+            results = [await poller.process({'url': url}), await poller.process({'url': url})]
+            host = politeness.hosts[server.host]
+            backoff_s = host.backoff_until - time.monotonic()
+
+            host.backoff_until = 0
+            results.append(await poller.process({'url': url}))
+            first_backoff_s = host.backoff_until - time.monotonic()
+            host.backoff_until = 0
+            results.append(await poller.process({'url': url}))
+            second_backoff_s = host.backoff_until - time.monotonic()
+            host.backoff_until = 0
+            results.append(await poller.process({'url': url}))
+            return results, backoff_s, first_backoff_s, second_backoff_s, host.failures
+
+    results, backoff_s, first_backoff_s, second_backoff_s, failures = \
+        asyncio.get_event_loop().run_until_complete(run())
+    assert results[0]['status'] == 429
+    assert results[1] is None, 'check must be skipped while host backs off'
+    assert 59 < backoff_s <= 60, 'Retry-After must be honored'
+    assert 19 < first_backoff_s <= 20 and 39 < second_backoff_s <= 40, 'backoff must grow without Retry-After'
+    assert results[4]['status'] == 200 and failures == 0
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+import aiohttp
+from aiohttp.test_utils import unused_port
+
+from common.metrics import Registry, start_metrics_server
+from common.profiling import SamplingProfiler, LoopMonitor, profile_handler, LOOP_BLOCKED
+from impl import HeapScheduler
+from impl.scheduler import SCHEDULER_DRIFT
+
+
+def busy_wait(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler(tmp_path):
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_wait, args=(stop,), name='busy')
+    thread.start()
+    profiler = SamplingProfiler(interval_s=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    stacks = profiler.stop()
+    stop.set()
+    thread.join()
+
+    assert not profiler.running and profiler.samples > 10
+    busy = [stack for stack in stacks if stack[0] == 'busy']
+    # sampler can catch the thread inside functions busy_wait calls, like Event.is_set
+    assert busy and all(any(frame.startswith('busy_wait (tests/test_profiling.py:') for frame in stack)
+                        for stack in busy)
+    with open(profiler.dump(str(tmp_path))) as fp:
+        lines = fp.read().splitlines()
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines), 'lines must be "stack count"'
+    assert any(line.startswith('busy;') for line in lines)
+
+
+def test_profile_endpoint():
+    profiler = SamplingProfiler(interval_s=0.001)
+    port = unused_port()
+
+    async def profile():
+        runner = await start_metrics_server(port, '127.0.0.1', Registry(),
+                                            handlers={'/profile': profile_handler(profiler)})
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/profile?seconds=0.1') as response:
+                    text = await response.text()
+                async with session.get(f'http://127.0.0.1:{port}/profile?seconds=x') as response:
+                    return text, response.status
+        finally:
+            await runner.cleanup()
+
+    text, bad_status = asyncio.get_event_loop().run_until_complete(profile())
+    assert 'MainThread;' in text and not profiler.running
+    assert bad_status == 400
+
+
+def test_loop_monitor_and_scheduler_drift():
+    blocked_before = LOOP_BLOCKED._default.get()
+    drift = SCHEDULER_DRIFT.labels('heap')
+    calls_before = drift.count
+
+    async def run():
+        async with LoopMonitor(interval_s=0.01, slow_callback_s=0.05):
+            async with HeapScheduler() as scheduler:
+                scheduler.schedule(asyncio.sleep, {'seconds': 1}, 0, offset_s=0.01)
+                await asyncio.sleep(0.02)
+                time.sleep(0.2)  # blocks loop, scheduled call is late
+                await asyncio.sleep(0.05)
+
+    asyncio.get_event_loop().run_until_complete(run())
+    # loaded machine can block the loop on its own, so only lower bound is exact
+    assert LOOP_BLOCKED._default.get() >= blocked_before + 1, 'blocking must be reported'
+    assert drift.count > calls_before
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from impl import BoundedQueue
+
+
+def drain(queue: asyncio.Queue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_queue_skip():
+    queue = BoundedQueue(2, 'skip')
+
+    async def fill():
+        for i in range(4):
+            await queue.put({'url': 'a', 'id': i})
+
+    asyncio.get_event_loop().run_until_complete(fill())
+    assert queue.stats() == {'depth': 2, 'maxsize': 2, 'coalesced': 0, 'skipped': 2}
+    assert [item['id'] for item in drain(queue)] == [0, 1]
+
+
+def test_queue_coalesce():
+    queue = BoundedQueue(2, 'coalesce')
+
+    async def fill():
+        await queue.put({'url': 'a', 'id': 0})
+        await queue.put({'url': 'b', 'id': 1})
+        await queue.put({'url': 'a', 'id': 2})
+        blocked = asyncio.create_task(queue.put({'url': 'c', 'id': 3}))
+        await asyncio.sleep(0)
+        assert not blocked.done(), 'new URL must wait for free slot'
+        first = await queue.get()
+        await blocked
+        return first
+
+    first = asyncio.get_event_loop().run_until_complete(fill())
+    assert first == {'url': 'a', 'id': 2}, 'pending check must be replaced with fresher one'
+    assert [item['id'] for item in drain(queue)] == [1, 3]
+    assert queue.coalesced == 1 and queue.dropped == 1
+
+
+def test_queue_block():
+    queue = BoundedQueue(1)
+
+    async def fill():
+        await queue.put({'url': 'a'})
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.put({'url': 'a'}), 0.01)
+
+    asyncio.get_event_loop().run_until_complete(fill())
+    assert queue.qsize() == 1 and queue.dropped == 0
+
+
+def test_queue_coalesce_join():
+    queue = BoundedQueue(2, 'coalesce')
+
+    async def fill_and_join():
+        await queue.put({'url': 'a', 'id': 0})
+        await queue.put({'url': 'b', 'id': 1})
+        queue.put_nowait({'url': 'a', 'id': 2})
+        blocked = [asyncio.create_task(queue.put({'url': 'c', 'id': i})) for i in (3, 4)]
+        await asyncio.sleep(0)
+        assert [queue.get_nowait()['id'], queue.get_nowait()['id']] == [2, 1]
+        queue.task_done(), queue.task_done()
+        await asyncio.gather(*blocked)  # second put waited for slot and is coalesced with the first one
+        assert queue.get_nowait() == {'url': 'c', 'id': 4} and queue.empty()
+        queue.task_done()
+        await asyncio.wait_for(queue.join(), 1)
+
+    asyncio.get_event_loop().run_until_complete(fill_and_join())
+    assert queue.coalesced == 2
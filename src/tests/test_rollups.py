@@ -0,0 +1,78 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from db import PostgresRepo
+from db.rollups import Rollup, bucket_of, histogram_percentile, merge_histograms, minute_rollups, HISTOGRAM_GROWTH
+
+STARTED = datetime(2021, 3, 16, 19, 58, 53, 450004, tzinfo=timezone.utc)
+MINUTE = datetime(2021, 3, 16, 19, 58, tzinfo=timezone.utc)
+
+
+def test_histogram_percentile_accuracy():
+    random.seed(1)
+    values = sorted(random.lognormvariate(-2, 1) for _ in range(10_000))
+    rollup = Rollup()
+    for value in values:
+        rollup.add(value)
+
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * len(values)) - 1]
+        assert abs(histogram_percentile(rollup.histogram, q) / exact - 1) < HISTOGRAM_GROWTH - 1
+
+    assert histogram_percentile([], 0.5) is None
+    assert bucket_of(0) == 0 and bucket_of(1e9) == bucket_of(1e10), 'values out of range go to edge buckets'
+
+
+def test_merge_histograms():
+    a, b = Rollup(), Rollup()
+    a.add(0.01)
+    b.add(0.01)
+    b.add(2)
+    merged = merge_histograms(a.histogram, b.histogram)
+    assert merged == merge_histograms(b.histogram, a.histogram)
+    assert sum(merged) == 3 and merged[bucket_of(0.01)] == 2
+
+
+def test_minute_rollups():
+    success_rows = [(1, STARTED, None, 0.2, 200), (1, STARTED.replace(second=1), None, 0.4, 200),
+                    (2, STARTED, None, 0.1, 200)]
+    errors_rows = [(1, STARTED, 'error', 'message'), (3, STARTED, 'error', 'message')]
+
+    rows = minute_rollups(success_rows, errors_rows)
+
+    assert [row[:7] for row in rows] == [
+        (1, MINUTE, 3, 1, 0.2, 0.4, pytest.approx(0.6)),
+        (2, MINUTE, 1, 0, 0.1, 0.1, 0.1),
+        (3, MINUTE, 1, 1, None, None, None),
+    ]
+    assert rows[2][7] == [], 'minute without successful checks has empty histogram'
+
+
+def test_site_stats():
+    first, second = Rollup(), Rollup()
+    for value in (0.1, 0.2, 0.3):
+        first.add(value)
+    second.add(1.0)
+    second.add_error()
+
+    class StubRepo(PostgresRepo):
+        def __init__(self):
+            super().__init__(pool_or_dsn=None)
+
+        async def exec(self, query, *args, timeout=None):
+            assert 'rollup_hour' in query and args[1] == 'hour'
+            keys = ('count', 'error_count', 'min_time', 'max_time', 'sum_time', 'histogram')
+            return [dict(zip(keys, r.row(1, MINUTE)[2:])) for r in (first, second)]
+
+    loop = asyncio.get_event_loop()
+    stats = loop.run_until_complete(StubRepo().site_stats('url', MINUTE, MINUTE, 'hour', percentiles=(0.5, 0.99)))
+
+    assert stats['count'] == 5 and stats['error_count'] == 1
+    assert stats['availability'] == 0.8
+    assert (stats['min_time'], stats['max_time']) == (0.1, 1.0)
+    assert stats['mean_time'] == pytest.approx(0.4)
+    assert stats['p50'] == pytest.approx(0.2, rel=HISTOGRAM_GROWTH - 1)
+    assert stats['p99'] == pytest.approx(1.0, rel=HISTOGRAM_GROWTH - 1)
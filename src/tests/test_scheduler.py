@@ -0,0 +1,113 @@
+import asyncio
+
+from impl import HeapScheduler, SimpleScheduler
+from impl.scheduler import ScheduledJob
+
+
+def test_heap_scheduler_intervals():
+    calls = []
+
+    async def callback(name):
+        calls.append((name, asyncio.get_running_loop().time()))
+
+    async def run():
+        async with HeapScheduler(jitter=0) as scheduler:
+            started = asyncio.get_running_loop().time()
+            scheduler.schedule(callback, {'seconds': 0.05}, 'fast')
+            scheduler.schedule(callback, {'seconds': 0.12}, 'slow')
+            await asyncio.sleep(0.22)
+        return started
+
+    started = asyncio.get_event_loop().run_until_complete(run())
+    fast = [t - started for name, t in calls if name == 'fast']
+    slow = [t - started for name, t in calls if name == 'slow']
+
+    # calls are late on loaded machine, and missed ones are skipped, but they are never early
+    assert 2 <= len(fast) <= 5, 'fast job must be called right after scheduling and then every 50ms'
+    assert 1 <= len(slow) <= 2
+    assert all(t >= i * 0.05 - 0.005 for i, t in enumerate(fast))
+    assert all(t >= i * 0.12 - 0.005 for i, t in enumerate(slow))
+
+
+def test_heap_scheduler_cancel():
+    calls = []
+
+    async def callback(name):
+        calls.append(name)
+
+    async def run():
+        async with HeapScheduler(jitter=0) as scheduler:
+            jobs = [scheduler.schedule(callback, {'seconds': 0.02}, name) for name in 'abc']
+            await asyncio.sleep(0.01)
+            scheduler.cancel(jobs[0])
+            scheduler.cancel(jobs[1])
+            assert len(scheduler) == 1
+            calls.clear()
+            await asyncio.sleep(0.05)
+
+    asyncio.get_event_loop().run_until_complete(run())
+    assert calls and set(calls) == {'c'}, 'cancelled jobs must not be called'
+
+
+def test_heap_scheduler_jitter():
+    async def callback():
+        pass
+
+    async def run():
+        async with HeapScheduler(jitter=1) as scheduler:
+            now = asyncio.get_running_loop().time()
+            jobs = [scheduler.schedule(callback, {'seconds': 10}) for _ in range(100)]
+            for job in jobs:
+                scheduler.cancel(job)
+        return now, jobs
+
+    now, jobs = asyncio.get_event_loop().run_until_complete(run())
+    offsets = [job.when - now for job in jobs]
+    assert all(0 <= offset <= 10 for offset in offsets)
+    assert max(offsets) - min(offsets) > 5, 'first calls must be spread over interval'
+
+
+def test_next_call_skips_missed():
+    job = ScheduledJob(None, (), {}, interval_s=10, when=100)
+    assert HeapScheduler.next_call(job, now=101) == 110
+    assert HeapScheduler.next_call(job, now=135) == 140
+
+
+def test_heap_scheduler_cancel_from_callback():
+    scheduler = HeapScheduler(jitter=0)
+    jobs = []
+
+    async def callback():
+        scheduler.cancel(jobs[0])
+
+    async def run():
+        jobs.append(scheduler.schedule(callback, {'seconds': 0.01}))
+        await asyncio.sleep(0.05)
+        assert len(scheduler) == 0, 'job cancelled by itself must not be put back'
+        assert not scheduler.heap
+        await scheduler.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_schedulers_close():
+    calls = []
+
+    async def callback(name):
+        calls.append(name)
+
+    async def run():
+        heap, simple = HeapScheduler(jitter=0), SimpleScheduler()
+        heap.schedule(callback, {'seconds': 0.01}, 'heap')
+        simple.schedule(callback, {'seconds': 0.01}, 'simple')
+        await asyncio.sleep(0.03)
+        driver, tasks = heap._driver, list(simple.tasks)
+        await heap.close()
+        await simple.close()
+        called = len(calls)
+        await asyncio.sleep(0.03)
+        return driver, tasks, called
+
+    driver, tasks, called = asyncio.get_event_loop().run_until_complete(run())
+    assert driver.cancelled() and all(task.cancelled() for task in tasks), 'background tasks must be finished'
+    assert {'heap', 'simple'} <= set(calls) and len(calls) == called, 'no calls are expected after close'
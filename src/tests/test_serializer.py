@@ -1,3 +1,5 @@
+import pytest
+
 from common.serializer import Serde
 
 
@@ -16,3 +18,25 @@ def test_serializer():
     assert serializer.serialize(decoded) == encoded
     assert serializer.deserialize(encoded) == decoded
     assert serializer.deserialize(serializer.serialize(val)) == val
+
+
+@pytest.mark.parametrize('message_format', ['json', 'orjson', 'msgpack'])
+def test_serializer_formats(message_format):
+    pytest.importorskip(message_format)
+    value = {'url': 'https://example.com', 'status': 200, 'response_time_s': 0.25, 'match': None, 'success': True}
+
+    encoded = Serde(message_format=message_format).serialize(value)
+    assert Serde().deserialize(encoded) == value, 'consumer must decode any format'
+
+
+def test_serializer_header():
+    pytest.importorskip('msgpack')
+    legacy, packed = Serde(), Serde(message_format='msgpack')
+    value = {'some': 'key'}
+
+    assert legacy.serialize(value) == b'{"some": "key"}', 'json messages must not have header'
+    assert packed.serialize(value)[:2] == b'\x00\x02'
+    assert [legacy.deserialize(m) for m in (legacy.serialize(value), packed.serialize(value))] == [value, value]
+
+    with pytest.raises(ValueError):
+        legacy.deserialize(b'\x00\x7f{}')
@@ -2,9 +2,11 @@ import asyncio
 
 import aiohttp
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from aioresponses import aioresponses
 
-from impl import AsyncSitePoller
+from impl import AsyncSitePoller, StreamMatcher, compile_pattern
 
 
 @pytest.mark.integration
@@ -45,3 +47,259 @@ def test_poller_negative():
         assert not result['success'], 'success must be False'
         assert 'ClientPayloadError' in result['error_type']
         assert result['message'] == 'test_msg'
+
+
+def test_poller_reuses_pooled_session():
+    url = 'http://test_pool'
+    created = []
+
+    def factory(kwargs):
+        created.append(kwargs)
+        return aiohttp.ClientSession(**kwargs)
+
+    async def check_twice():
+        async with AsyncSitePoller(session_factory=factory) as poller:
+            return [await poller.process({'url': url}), await poller.process({'url': url})]
+
+    loop = asyncio.get_event_loop()
+    with aioresponses() as mock:
+        mock.get(url, status=200, body='ok', repeat=True)
+        results = loop.run_until_complete(check_twice())
+
+    assert [r['status'] for r in results] == [200, 200]
+    assert len(created) == 1, 'pooled session must be created once'
+    assert 'connector' in created[0]
+
+
+def test_poller_cold_mode():
+    url = 'http://test_cold'
+    created = []
+
+    def factory(kwargs):
+        created.append(kwargs)
+        return aiohttp.ClientSession(**kwargs)
+
+    async def check_twice():
+        async with AsyncSitePoller(session_factory=factory) as poller:
+            for _ in range(2):
+                await poller.process({'url': url, 'cold': True})
+
+    loop = asyncio.get_event_loop()
+    with aioresponses() as mock:
+        mock.get(url, status=200, body='ok', repeat=True)
+        loop.run_until_complete(check_twice())
+
+    assert len(created) == 2, 'cold checks must create new session every time'
+    assert all('connector' not in kw for kw in created)
+
+
+def test_stream_matcher_chunk_border():
+    matcher = StreamMatcher(compile_pattern('needle'), overlap=10)
+    chunks = ['hay hay ne'.encode(), 'ed'.encode(), 'le hay'.encode()]
+    assert [matcher.feed(chunk) for chunk in chunks] == [False, False, True]
+
+    matcher = StreamMatcher(compile_pattern('ё'), encoding='utf-8')
+    encoded = 'ё'.encode()
+    assert not matcher.feed(encoded[:1]), 'incomplete character must wait for next chunk'
+    assert matcher.feed(encoded[1:])
+
+
+@pytest.mark.parametrize('pattern,max_body_bytes,expected', [
+    ('start', 0, {'match': True, 'truncated': False}),
+    ('end', 0, {'match': True, 'bytes_read': 2005, 'truncated': False}),
+    ('end', 1000, {'match': False, 'bytes_read': 1000, 'truncated': True}),
+    ('missing', 0, {'match': False, 'bytes_read': 2005, 'truncated': False}),
+])
+def test_poller_body_limit(pattern, max_body_bytes, expected):
+    url = 'http://test_limit'
+    task = {'url': url, 'pattern': pattern, 'max_body_bytes': max_body_bytes}
+
+    async def check():
+        async with AsyncSitePoller(chunk_size=100) as poller:
+            return await poller.process(task)
+
+    loop = asyncio.get_event_loop()
+    with aioresponses() as mock:
+        mock.get(url, status=200, body='start' + 'x' * 1997 + 'end')
+        result = loop.run_until_complete(check())
+
+    assert {key: result[key] for key in expected} == expected
+    assert result['pattern'] == pattern
+    if expected['match'] and pattern == 'start':
+        assert result['bytes_read'] < 2005, 'reading must stop when pattern is found'
+
+
+def test_poller_skips_body_without_pattern():
+    url = 'http://test_no_pattern'
+
+    async def check():
+        async with AsyncSitePoller() as poller:
+            return await poller.process({'url': url})
+
+    loop = asyncio.get_event_loop()
+    with aioresponses() as mock:
+        mock.get(url, status=200, body='body')
+        result = loop.run_until_complete(check())
+
+    assert result['status'] == 200
+    assert 'match' not in result and 'bytes_read' not in result
+
+
+def test_poller_request_phases():
+    async def handler(_):
+        return web.Response(text='phases test body')
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+
+    async def check():
+        async with TestServer(app) as server, AsyncSitePoller() as poller:
+            url = str(server.make_url('/'))
+            return [await poller.process({'url': url, 'pattern': 'body', 'cold': True}),
+                    await poller.process({'url': url}),
+                    await poller.process({'url': url})]
+
+    cold, first, pooled = asyncio.get_event_loop().run_until_complete(check())
+
+    assert cold['connect_s'] is not None and cold['ttfb_s'] is not None and cold['transfer_s'] is not None
+    assert cold['response_time_s'] >= cold['connect_s'] + cold['ttfb_s']
+    assert first['connect_s'] is not None, 'first pooled request opens connection'
+    assert pooled['connect_s'] is None and pooled['dns_s'] is None, 'keep-alive connection must be reused'
+    assert pooled['ttfb_s'] is not None and pooled['transfer_s'] is None, 'body is not read without pattern'
+
+
+def test_poller_response_time_excludes_body():
+    async def handler(request: web.Request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(b'start ')
+        await asyncio.sleep(0.5)  # headers are sent at once, body takes much longer
+        await response.write(b'slow body end')
+        return response
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+
+    async def check():
+        async with TestServer(app) as server, AsyncSitePoller() as poller:
+            url = str(server.make_url('/'))
+            return await poller.process({'url': url, 'pattern': 'end'}), await poller.process({'url': url})
+
+    matched, plain = asyncio.get_event_loop().run_until_complete(check())
+    assert matched['match'] and matched['transfer_s'] >= 0.5
+    assert matched['response_time_s'] < matched['transfer_s'], 'body must be only in transfer_s'
+    assert plain['response_time_s'] < matched['transfer_s'], 'response time must not wait for body'
+    assert (matched['ended_ns'] - matched['started_ns']) / 1e9 < matched['transfer_s']
+
+
+def test_poller_untraced_request_timing():
+    url = 'http://test_untraced'
+
+    async def check():
+        async with AsyncSitePoller() as poller:
+            return await poller.process({'url': url})
+
+    with aioresponses() as mock:
+        mock.get(url, status=200, body='ok')
+        result = asyncio.get_event_loop().run_until_complete(check())
+
+    assert result['response_time_s'] >= 0
+    assert result['ttfb_s'] == result['response_time_s']
+
+
+def test_poller_check_modes():
+    requests = []
+    body = 'start' + 'x' * 5000 + 'end'
+
+    async def handler(request: web.Request):
+        requests.append((request.method, dict(request.headers)))
+        if request.path == '/etag' and request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        if request.path == '/etag':
+            return web.Response(text=body, headers={'ETag': '"v1"'})
+        if 'Range' in request.headers:
+            return web.Response(status=206, text=body[:100])
+        return web.Response(text=body)
+
+    app = web.Application()
+    app.router.add_route('*', '/{path}', handler)
+
+    async def check(poller, server, path, **task):
+        return await poller.process({'url': str(server.make_url(path)), **task})
+
+    async def run():
+        async with TestServer(app) as server, AsyncSitePoller() as poller:
+            head = await check(poller, server, '/head', check='head', pattern='start')
+            ranged = await check(poller, server, '/range', check='range', pattern='end', max_body_bytes=100)
+            conditional = [await check(poller, server, '/etag', check='conditional', pattern='end')
+                           for _ in range(2)]
+            hashed = [await check(poller, server, '/plain', check='conditional', pattern='end') for _ in range(2)]
+            return head, ranged, conditional, hashed
+
+    head, ranged, conditional, hashed = asyncio.get_event_loop().run_until_complete(run())
+
+    assert requests[0][0] == 'HEAD' and head['status'] == 200 and 'match' not in head
+    assert requests[1][1]['Range'] == 'bytes=0-99'
+    assert ranged['status'] == 206 and ranged['bytes_read'] == 100 and not ranged['match']
+
+    assert conditional[0]['match'] and conditional[0]['bytes_read'] == len(body)
+    assert requests[3][1]['If-None-Match'] == '"v1"'
+    assert conditional[1]['status'] == 304 and conditional[1]['not_modified']
+    assert conditional[1]['match'] and conditional[1]['bytes_read'] == 0, 'match must be reused on 304'
+    assert conditional[1]['pattern'] == 'end'
+
+    assert 'If-None-Match' not in requests[5][1], 'response without validators'
+    assert [r['match'] for r in hashed] == [True, True]
+
+
+def test_poller_reuses_match_of_same_body(monkeypatch):
+    url = 'http://test_same_body'
+    fed = []
+
+    original_feed = StreamMatcher.feed
+
+    def feed(self, chunk, final=False):
+        fed.append(chunk)
+        return original_feed(self, chunk, final)
+
+    monkeypatch.setattr(StreamMatcher, 'feed', feed)
+
+    async def check_twice():
+        async with AsyncSitePoller() as poller:
+            return [await poller.process({'url': url, 'pattern': 'test', 'check': 'conditional'}) for _ in range(2)]
+
+    with aioresponses() as mock:
+        mock.get(url, status=200, body='contains test', repeat=True)
+        results = asyncio.get_event_loop().run_until_complete(check_twice())
+
+    assert [r['match'] for r in results] == [True, True]
+    assert len(fed) == 1, 'unchanged body must not be matched again'
+
+
+def test_poller_drains_short_body_rest():
+    peers = []
+
+    async def handler(request: web.Request):
+        peers.append((request.path, request.transport.get_extra_info('peername')))
+        response = web.StreamResponse()
+        response.content_length = 2 + int(request.query['rest'])
+        await response.prepare(request)
+        await response.write(b'ok')
+        for _ in range(int(request.query['rest']) // 500):  # rest is not received yet when pattern is found
+            await asyncio.sleep(0.02)
+            await response.write(b'x' * 500)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/{path}', handler)
+
+    async def check():
+        async with TestServer(app) as server, AsyncSitePoller(chunk_size=100, drain_bytes=1000) as poller:
+            for path, rest in (('short', 500), ('short', 500), ('long', 5000), ('long', 5000)):
+                result = await poller.process({'url': str(server.make_url(f'/{path}?rest={rest}')), 'pattern': 'ok'})
+                assert result['match'] and result['bytes_read'] == 2
+
+    asyncio.get_event_loop().run_until_complete(check())
+    short, long = [[peer for path, peer in peers if path == f'/{name}'] for name in ('short', 'long')]
+    assert short[0] == short[1], 'connection must be reused after short rest of body is drained'
+    assert long[0] != long[1], 'connection with long rest of body must be closed'
@@ -0,0 +1,47 @@
+import asyncio
+
+from impl import DiskSpool
+
+
+def test_spool_segments(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_bytes=10_000, segment_bytes=1000)
+    assert not spool
+    for i in range(60):
+        spool.append({'url': f'https://site-{i}.example.com', 'id': i})
+    assert spool and len(spool.closed) > 1, 'segments must be rotated by size'
+
+    async def read_all():
+        messages = []
+        while (segment := await spool.oldest()) is not None:
+            sequence, records = segment
+            messages.extend(records)
+            spool.remove(sequence)
+        return messages
+
+    messages = asyncio.get_event_loop().run_until_complete(read_all())
+    assert [m['id'] for m in messages] == list(range(60)), 'messages must be read in written order'
+    assert not spool and spool.size_bytes == 0 and not list(tmp_path.iterdir())
+
+
+def test_spool_size_limit_and_reopen(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_bytes=2000, segment_bytes=500)
+    for i in range(100):
+        spool.append({'id': i})
+    assert spool.size_bytes <= 2000, 'oldest segments must be dropped'
+    spool.close()
+
+    with open(spool.path(spool.closed[-1][0]), 'ab') as fp:
+        fp.write(b'\x00\x00\x01')  # interrupted write
+
+    reopened = DiskSpool(str(tmp_path), max_bytes=2000, segment_bytes=500)
+    assert [s[0] for s in reopened.closed] == [s[0] for s in spool.closed]
+
+    async def read_all():
+        messages = []
+        while (segment := await reopened.oldest()) is not None:
+            messages.extend(segment[1])
+            reopened.remove(segment[0])
+        return messages
+
+    ids = [m['id'] for m in asyncio.get_event_loop().run_until_complete(read_all())]
+    assert ids == list(range(ids[0], 100)), 'newest messages must be kept in order'
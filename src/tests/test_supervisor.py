@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import time
+from collections import Counter
+from contextlib import suppress
+
+from producer.main import schedule_many
+from producer.supervisor import Supervisor, shard_of
+
+
+def exit_immediately(args: argparse.Namespace, heartbeat):
+    heartbeat.value = time.time()
+
+
+class MockProcess:
+    def __init__(self, alive: bool):
+        self.alive = alive
+        self.pid = 1
+        self.exitcode = None if alive else 1
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+
+class MockScheduler:
+    def __init__(self):
+        self.tasks = []
+
+    def schedule(self, async_callback, interval, task, offset_s=None):
+        self.tasks.append(task)
+
+
+def test_shard_of():
+    urls = [f'https://site-{i}.example.com' for i in range(10_000)]
+    shards = Counter(shard_of(url, 4) for url in urls)
+
+    assert sorted(shards) == [0, 1, 2, 3]
+    assert min(shards.values()) > 2000, 'sites must be distributed evenly'
+    assert all(shard_of(url, 4) == shard_of(url, 4) for url in urls[:100])
+
+
+def test_schedule_shard(tmp_path):
+    config = tmp_path / 'sites.yaml'
+    config.write_text('sites:\n' + ''.join(f'  - url: https://site-{i}.example.com\n' for i in range(100)))
+
+    scheduled = []
+    for index in range(3):
+        scheduler = MockScheduler()
+        schedule_many(scheduler, asyncio.Queue(), str(config), index, 3)
+        assert all(shard_of(task['url'], 3) == index for task in scheduler.tasks)
+        scheduled.extend(task['url'] for task in scheduler.tasks)
+
+    assert len(scheduled) == len(set(scheduled)) == 100, 'every site must be scheduled by exactly one shard'
+
+
+def test_supervisor_restarts_exited_shard():
+    supervisor = Supervisor(argparse.Namespace(), workers=2, target=exit_immediately, max_backoff_s=0,
+                            check_interval_s=0.05)
+
+    async def run():
+        task = asyncio.create_task(supervisor.run())
+        # spawned processes start slowly, wait for restarts instead of fixed time
+        deadline = time.monotonic() + 60
+        while not all(h['restarts'] > 0 for h in supervisor.health()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.get_event_loop().run_until_complete(run())
+    health = supervisor.health()
+    assert [h['shard'] for h in health] == [0, 1]
+    assert all(h['restarts'] > 0 for h in health), 'exited shards must be restarted'
+    assert supervisor.shard_args(1).shard_index == 1 and supervisor.shard_args(1).shard_count == 2
+
+
+def test_supervisor_resets_backoff_of_stable_shard():
+    supervisor = Supervisor(argparse.Namespace(), workers=1, target=exit_immediately, max_backoff_s=60, stable_s=100)
+    shard = supervisor.shards[0]
+    now = time.time()
+
+    shard.process, shard.restarts, shard.failures = MockProcess(alive=False), 5, 5
+    supervisor.check(shard, now)
+    assert shard.restart_at == now + 32, 'pause must double with every failure'
+
+    shard.process, shard.restart_at = MockProcess(alive=True), 0.0
+    shard.started, shard.heartbeat.value = now - 150, now - 100
+    supervisor.check(shard, now - 100)
+    assert shard.failures == 5, 'shard is not stable yet'
+    shard.heartbeat.value = now
+    supervisor.check(shard, now)
+    assert shard.failures == 0 and shard.restarts == 5, 'stable shard must get short pause, restarts are kept'
+
+    shard.process = MockProcess(alive=False)
+    supervisor.check(shard, now)
+    assert shard.restart_at == now + 1
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+
+from producer.targets import TargetsWatcher, diff_targets, load_targets, host_offsets
+
+
+class MockScheduler:
+    def __init__(self):
+        self.scheduled = {}
+        self.cancelled = []
+
+    def schedule(self, async_callback, interval, task, offset_s=None):
+        handle = (task['url'], len(self.scheduled) + len(self.cancelled))
+        self.scheduled[handle] = (task, interval)
+        return handle
+
+    def cancel(self, handle):
+        self.cancelled.append(handle)
+        del self.scheduled[handle]
+
+
+def write_sites(path, sites: list):
+    path.write_text(json.dumps({'sites': sites}))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))  # mtime must change within one tick
+
+
+def test_diff_targets():
+    old = {'a': ({'url': 'a'}, {'seconds': 60}), 'b': ({'url': 'b'}, {'seconds': 60}),
+           'c': ({'url': 'c'}, {'seconds': 60})}
+    new = {'a': ({'url': 'a'}, {'seconds': 60}), 'c': ({'url': 'c'}, {'seconds': 30}),
+           'd': ({'url': 'd'}, {'seconds': 60})}
+    assert diff_targets(old, new) == (['d'], ['b'], ['c'])
+
+
+def test_load_targets_yaml(tmp_path):
+    config = tmp_path / 'sites.yaml'
+    config.write_text('sites:\n  - url: https://a.example.com\n    interval: {minutes: 5}\n'
+                      '  - url: https://a.example.com\n    check: head\n')
+    targets = load_targets(str(config))
+    task, interval = targets['https://a.example.com']
+    assert len(targets) == 1 and task['check'] == 'head', 'last of duplicate sites must be kept'
+    assert interval == {'seconds': 60}
+
+
+def test_watcher_reschedules_only_changed(tmp_path):
+    config = tmp_path / 'sites.json'
+    sites = [{'url': f'https://site-{i}.example.com'} for i in range(5)]
+    write_sites(config, sites)
+    scheduler = MockScheduler()
+    watcher = TargetsWatcher(scheduler, asyncio.Queue().put, str(config))
+    loop = asyncio.get_event_loop()
+
+    assert loop.run_until_complete(watcher.reload())
+    assert len(scheduler.scheduled) == 5
+    assert not loop.run_until_complete(watcher.reload()), 'unchanged file must not be reloaded'
+
+    kept = dict(watcher.handles)
+    sites[1]['pattern'] = 'changed'
+    del sites[2]
+    sites.append({'url': 'https://new.example.com', 'interval': {'seconds': 10}})
+    write_sites(config, sites)
+    assert loop.run_until_complete(watcher.reload())
+
+    assert sorted(url for url, _ in scheduler.cancelled) == ['https://site-1.example.com',
+                                                             'https://site-2.example.com']
+    assert len(scheduler.scheduled) == 5
+    assert scheduler.scheduled[watcher.handles['https://site-1.example.com']][0]['pattern'] == 'changed'
+    assert scheduler.scheduled[watcher.handles['https://new.example.com']][1] == {'seconds': 10}
+    for url in ('https://site-0.example.com', 'https://site-3.example.com', 'https://site-4.example.com'):
+        assert watcher.handles[url] == kept[url], 'unchanged sites must keep their schedule'
+
+    config.write_text('sites: [')
+    assert not loop.run_until_complete(watcher.reload())
+    assert len(watcher.targets) == 5, 'invalid file must not change targets'
+
+
+def test_host_offsets():
+    targets = {f'https://example.com/page-{i}': ({}, {'minutes': 1}) for i in range(4)}
+    targets['https://other.example.com'] = ({}, {'minutes': 1})
+    offsets = host_offsets(targets, list(targets))
+    assert sorted(offsets.values()) == [0, 15, 30, 45], 'sites of one host must be spread over interval'
+    assert 'https://other.example.com' not in offsets
@@ -0,0 +1,52 @@
+import asyncio
+
+from aiokafka import TopicPartition
+
+from common.check import CheckResult
+from common.serializer import Serde
+from impl import KafkaBatchTaskProvider, KafkaPublisher, DbWriter
+from tests.mock.kafka import MemoryKafka
+from tests.mock.repository import MockRepository
+
+
+class MockConsumer:
+    def __init__(self, fetches: list):
+        self.fetches = fetches
+        self.calls = []
+
+    async def getmany(self, timeout_ms, max_records):
+        self.calls.append((timeout_ms, max_records))
+        return self.fetches.pop(0)
+
+
+def test_kafka_batch_provider():
+    tp1, tp2 = TopicPartition('ts', 0), TopicPartition('ts', 1)
+    consumer = MockConsumer([{}, {tp1: ['a1', 'a2'], tp2: ['b1']}])
+    provider = KafkaBatchTaskProvider(consumer, timeout_ms=100, max_records=10)
+
+    batch = asyncio.get_event_loop().run_until_complete(provider.get())
+
+    assert provider.batched
+    assert batch == ['a1', 'a2', 'b1'], 'records of every partition must keep order'
+    assert consumer.calls == [(100, 10), (100, 10)], 'empty fetch must be retried'
+
+
+def test_memory_kafka_pipeline():
+    kafka = MemoryKafka(Serde().serialize, Serde().deserialize_check)
+    repo = MockRepository()
+    publisher = KafkaPublisher(kafka, 'ts', 'tf')
+    checks = [CheckResult('https://example.com', True, 1, 2, response_time_s=0.1, status=200),
+              CheckResult('https://example.com', False, 3, error_type='timeout', message='')]
+
+    async def run():
+        for check in checks:
+            await publisher.process(check)
+        provider = KafkaBatchTaskProvider(kafka, timeout_ms=10, max_records=10)
+        batch = await provider.get()
+        await DbWriter(repo, 'ts', 'tf').process_batch(batch)
+        return batch, await kafka.getmany(timeout_ms=10)
+
+    batch, empty = asyncio.get_event_loop().run_until_complete(run())
+    assert [(r.topic, r.offset) for r in batch] == [('ts', 0), ('tf', 0)]
+    assert repo.success == checks[:1] and repo.fail == checks[1:]
+    assert empty == {}, 'fetch must time out when there are no records'